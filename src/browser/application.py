@@ -122,6 +122,7 @@ class Remembrance(Adw.Application):
             # for now, we can just add the action here if the app is sandboxed
             # later I will probably make the frontend of the app the owner of the notification to simplify things
             self.create_action('reminder-completed', self.notification_completed_cb, GLib.VariantType.new('s'))
+            self.create_action('reminders-completed', self.notification_completedv_cb, GLib.VariantType.new('as'))
             self.create_action('notification-clicked', self.notification_clicked_cb)
 
     def check_service_version(self):
@@ -173,6 +174,7 @@ class Remembrance(Adw.Application):
         self.service.connect('g-signal::ReminderRemoved', self.reminder_deleted_cb)
         self.service.connect('g-signal::ReminderUpdated', self.reminder_updated_cb)
         self.service.connect('g-signal::ReminderShown', self.reminder_shown_cb)
+        self.service.connect('g-signal::RemindersShown', self.reminders_shown_cb)
         self.service.connect('g-signal::RemindersUpdated', self.reminders_updated_cb)
         self.service.connect('g-signal::RemindersRemoved', self.reminders_removed_cb)
         self.service.connect('g-signal::ListUpdated', self.list_updated_cb)
@@ -218,6 +220,25 @@ class Remembrance(Adw.Application):
         except AttributeError:
             pass
 
+    def notification_completedv_cb(self, action, variant, data = None):
+        reminder_ids = [reminder_id for reminder_id in variant.unpack() if reminder_id in self.win.reminder_lookup_dict and not self.win.reminder_lookup_dict[reminder_id].completed]
+        results = self.run_service_method(
+            'UpdateCompletedv',
+            GLib.Variant('(sasb)', (info.app_id, reminder_ids, True))
+        )
+        updated_reminder_ids, timestamp, completed_date = results.unpack()
+        try:
+            for reminder_id in updated_reminder_ids:
+                reminder = self.win.reminder_lookup_dict[reminder_id]
+                reminder.options['updated-timestamp'] = timestamp
+                reminder.options['completed-date'] = completed_date
+                reminder.set_completed(True)
+            self.win.selected_changed()
+            self.win.invalidate_filter()
+            self.win.reminders_list.invalidate_sort()
+        except AttributeError:
+            pass
+
     def list_updated_cb(self, proxy, sender_name, signal_name, parameters):
         app_id, task_list = parameters.unpack()
         list_id = task_list['id']
@@ -266,6 +287,12 @@ class Remembrance(Adw.Application):
         reminder = self.win.reminder_lookup_dict[reminder_id]
         reminder.refresh_time()
 
+    def reminders_shown_cb(self, proxy, sender_name, signal_name, parameters):
+        reminder_ids = parameters.unpack()[0]
+        for reminder_id in reminder_ids:
+            reminder = self.win.reminder_lookup_dict[reminder_id]
+            reminder.refresh_time()
+
     def reminders_updated_cb(self, proxy, sender_name, signal_name, parameters):
         app_id, new_reminders = parameters.unpack()
         if app_id != info.app_id:
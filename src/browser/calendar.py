@@ -15,20 +15,21 @@
 
 import datetime
 
-from gi.repository import GLib, Gio
+from gi.repository import Gio
 
 from reminders import info
+from reminders.clock import get_clock
 from logging import getLogger
-from time import time
 from threading import Thread
 
 logger = getLogger(info.app_executable)
 
 class Calendar(Thread):
     '''Updates date labels when day changes'''
-    def __init__(self, win):
+    def __init__(self, win, clock = None):
         self.win = win
-        self.time = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        self.clock = clock if clock is not None else get_clock()
+        self.time = datetime.datetime.combine(self.clock.today(), datetime.time())
         self.countdown_id = 0
         super().__init__(target=self.run_countdown)
         self.start()
@@ -49,6 +50,12 @@ class Calendar(Thread):
         if parameters.unpack()[0]:
             return
 
+        # labels only have to be updated once, no matter how many days passed while suspended
+        today = datetime.datetime.combine(self.clock.today(), datetime.time())
+        if today > self.time:
+            self.time = today
+            self.timestamp = self.time.timestamp()
+
         self.run_countdown(False)
 
     def on_countdown_done(self):
@@ -62,7 +69,7 @@ class Calendar(Thread):
         return False
 
     def remove_countdown(self):
-        GLib.Source.remove(self.countdown_id)
+        self.clock.source_remove(self.countdown_id)
 
     def run_countdown(self, new_day = True):
         try:
@@ -71,13 +78,13 @@ class Calendar(Thread):
                 self.timestamp = self.time.timestamp()
 
             if self.countdown_id != 0:
-                GLib.Source.remove(self.countdown_id)
+                self.clock.source_remove(self.countdown_id)
                 self.countdown_id = 0
 
-            now = time()
+            now = self.clock.time()
             wait = int(1000 * (self.timestamp - now))
             if wait > 0:
-                self.countdown_id = GLib.timeout_add(wait, self.on_countdown_done)
+                self.countdown_id = self.clock.timeout_add(wait, self.on_countdown_done)
             else:
                 self.on_countdown_done()
         except Exception as error:
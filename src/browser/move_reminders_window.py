@@ -75,16 +75,16 @@ class MoveRemindersWindow(Adw.Window):
                         'repeat-until': GLib.Variant('u', opts['repeat-until']),
                         'list-id': GLib.Variant('s', opts['list-id'])
                     })
-                results = self.win.app.run_service_method(
-                    'UpdateReminderv',
-                    GLib.Variant(
-                        '(saa{sv})',
-                        (
-                            info.app_id,
-                            variants
-                        )
+            results = self.win.app.run_service_method(
+                'UpdateReminderv',
+                GLib.Variant(
+                    '(saa{sv})',
+                    (
+                        info.app_id,
+                        variants
                     )
                 )
+            )
             updated_reminder_ids, timestamp = results.unpack()
             for reminder_id in updated_reminder_ids:
                 reminder = self.win.reminder_lookup_dict[reminder_id]
@@ -27,6 +27,7 @@ logger = getLogger(info.app_executable)
 
 DEFAULT_OPTIONS = info.reminder_defaults.copy()
 DEFAULT_OPTIONS.pop('uid')
+DEFAULT_OPTIONS.pop('etag')
 DEFAULT_OPTIONS.pop('updated-timestamp')
 DEFAULT_OPTIONS.pop('created-timestamp')
 DEFAULT_OPTIONS.pop('completed-timestamp')
@@ -0,0 +1,94 @@
+# clock.py
+# Copyright (C) 2023 Sasha Hale <dgsasha04@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of  MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+from gi.repository import GLib
+
+from time import time
+from heapq import heappush, heappop
+from itertools import count
+
+class Clock():
+    '''The current time and timeouts, backed by the system clock and GLib'''
+    def time(self):
+        return time()
+
+    def today(self):
+        return datetime.date.today()
+
+    def timeout_add(self, interval, callback, *args):
+        return GLib.timeout_add(interval, callback, *args)
+
+    def timeout_add_seconds(self, interval, callback, *args):
+        # for timeouts that don't need to be exact, GLib groups them with others so it wakes up less often
+        return GLib.timeout_add_seconds(interval, callback, *args)
+
+    def source_remove(self, source):
+        GLib.Source.remove(source)
+
+class VirtualClock(Clock):
+    '''Time that only moves when it is advanced, timeouts run as it passes them'''
+    def __init__(self, start = None):
+        self.now = time() if start is None else start
+        # min-heap of (deadline, source)
+        self.heap = []
+        # {source: (interval, callback, args)}
+        self.sources = {}
+        self.ids = count(1)
+
+    def time(self):
+        return self.now
+
+    def today(self):
+        return datetime.date.fromtimestamp(self.now)
+
+    def timeout_add(self, interval, callback, *args):
+        source = next(self.ids)
+        self.sources[source] = (interval, callback, args)
+        heappush(self.heap, (self.now + interval / 1000, source))
+        return source
+
+    def timeout_add_seconds(self, interval, callback, *args):
+        return self.timeout_add(interval * 1000, callback, *args)
+
+    def source_remove(self, source):
+        self.sources.pop(source)
+
+    def advance(self, seconds):
+        '''Moves time forward, running every timeout that comes due on the way in order'''
+        target = self.now + seconds
+        while len(self.heap) > 0 and self.heap[0][0] <= target:
+            deadline, source = heappop(self.heap)
+            if source not in self.sources:
+                continue
+            self.now = max(self.now, deadline)
+            interval, callback, args = self.sources[source]
+            # same as GLib, the timeout keeps running for as long as the callback returns True
+            if callback(*args):
+                heappush(self.heap, (self.now + interval / 1000, source))
+            else:
+                self.sources.pop(source, None)
+        self.now = max(self.now, target)
+
+default = Clock()
+
+def get_clock():
+    return default
+
+def set_clock(clock):
+    '''Replaces the clock used by everything created afterwards'''
+    global default
+    default = clock
@@ -46,7 +46,8 @@ reminder_defaults = {
     'completed-timestamp': 0,
     'completed-date': 0,
     'list-id': 'local',
-    'uid': ''
+    'uid': '',
+    'etag': ''
 }
 
 class TimeFormat(IntEnum):
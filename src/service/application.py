@@ -53,6 +53,7 @@ class RemembranceService(Gio.Application):
                 # xdg-desktop-portal will try to run the actions on the frontend when the notification is interacted with
                 # for this reason, we only need the actions here if we are not sandboxed
                 self.create_action('reminder-completed', self.notification_completed_cb, GLib.VariantType.new('s'))
+                self.create_action('reminders-completed', self.notification_completedv_cb, GLib.VariantType.new('as'))
                 self.create_action('notification-clicked', self.launch_browser, None)
 
             self.create_action('quit', self.quit_service, None)
@@ -97,7 +98,13 @@ class RemembranceService(Gio.Application):
 
     def notification_completed_cb(self, action, variant, data = None):
         reminder_id = variant.get_string()
-        self.reminders.set_completed(info.service_id, reminder_id, True)
+        self.reminders.update_completed(info.service_id, reminder_id, True)
+
+    def notification_completedv_cb(self, action, variant, data = None):
+        reminder_ids = variant.unpack()
+        # reminders that were already completed or removed since the summary was sent are left out
+        reminder_ids = [reminder_id for reminder_id in reminder_ids if reminder_id in self.reminders.reminders and not self.reminders.reminders[reminder_id]['completed']]
+        self.reminders.update_completedv(info.service_id, reminder_ids, True)
 
     def configure_logging(self):
         handler = logging.StreamHandler()
@@ -23,25 +23,30 @@ from gi.repository import GLib, Gio, GSound, Secret
 from reminders import info
 from reminders.service.ms_to_do import MSToDo
 from reminders.service.caldav import CalDAV
-from reminders.service.queue import ReminderQueue
+from reminders.service.credentials import Credentials
+from reminders.service.queue import ReminderQueue, should_queue
 from reminders.service.countdowns import Countdowns
+from reminders.service.recurrence import Recurrence, get_rule, next_occurrences
+from reminders.service.due_index import DueIndex
+from reminders.clock import get_clock
 from reminders.service.icalendar import iCalendar
 from reminders.service.reminder import Reminder
 
-from gettext import gettext as _
+from gettext import gettext as _, ngettext
 from math import floor
-from calendar import monthrange
-from threading import Thread
-from queue import Queue
+from threading import Thread, Event, current_thread, main_thread
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid1
 from traceback import format_exception
 from logging import getLogger
-from time import time
+from time import perf_counter, tzset
 from os import path, mkdir, remove, getpid
 from json import load as load_json
 from csv import DictReader, DictWriter
 from requests import HTTPError, Timeout, ConnectionError
 from shutil import move
+from resource import getrusage, RUSAGE_SELF
 
 REMINDERS_FILE = f'{info.data_dir}/reminders.csv'
 LISTS_FILE = f'{info.data_dir}/lists.csv'
@@ -52,6 +57,20 @@ TASK_LISTS_FILE = f'{info.data_dir}/task_lists.json'
 TASK_LIST_IDS_FILE = f'{info.data_dir}/task_list_ids.csv'
 
 VERSION = info.version
+
+# fields that are merged together when a reminder changed both locally and on the server
+MERGE_FIELDS = (
+    ('title',),
+    ('description',),
+    ('timestamp', 'due-date'),
+    ('completed', 'completed-timestamp', 'completed-date'),
+    ('important',),
+    ('repeat-type', 'repeat-frequency', 'repeat-days', 'repeat-until', 'repeat-times')
+)
+# more reminders than this being due at once are shown in a single notification
+NOTIFICATION_SUMMARY_THRESHOLD = 3
+# how many remote operations that can't be batched run at once, across every caller
+REMOTE_WORKERS = 4
 PID = getpid()
 
 logger = getLogger(info.service_executable)
@@ -63,37 +82,72 @@ with open(info.interface_file, newline='') as f:
     INTERFACE_XML = f.read()
 
 class Reminders():
-    def __init__(self, app):
+    def __init__(self, app, clock = None):
         if not path.isdir(info.data_dir):
             mkdir(info.data_dir)
         self.connection = Gio.bus_get_sync(Gio.BusType.SESSION, None)
         self.app = app
+        self.clock = clock if clock is not None else get_clock()
         self.reminders = self.lists = {}
         self.schema = Secret.Schema.new(
             info.app_id,
             Secret.SchemaFlags.NONE,
             { 'name': Secret.SchemaAttributeType.STRING }
         )
+        self.credentials = Credentials(self.schema)
+        # the accounts are read from the secret service without blocking startup, until then nothing is synced
+        # and method calls wait in self.waiting
+        self.accounts_loaded = False
+        self.waiting = []
         self.refreshing = False
+        self.sync_stats = {}
+        # {reminder_id: Reminder} as it was last seen on the server
+        self.remote_base = {}
+        # {user_id: Queue} of remote writes waiting to be sent for that account
+        self.pipelines = {}
+        # shared by the pipelines and the queue replay so they can't open more connections than this between them
+        self.remote_pool = ThreadPoolExecutor(max_workers=REMOTE_WORKERS, thread_name_prefix='remote')
         self._regid = None
         self.playing_sound = False
+        # reminder ids that came due during this main loop iteration, shown together
+        self.due = []
+        # reminder ids in the summary notification that is currently shown, it is updated as they are completed or removed
+        self.summary = []
+        self.summary_changed = False
+        # {reminder_id: (rule, Recurrence)}, a cached recurrence is only used while its rule is unchanged
+        self.recurrences = {}
+        self.due_index = DueIndex(self.clock)
         self.synced_ids = self.app.settings.get_value('synced-lists').unpack()
         self.to_do = MSToDo(self)
         self.caldav = CalDAV(self)
         self.ical = iCalendar(self)
+        self.countdowns = Countdowns(self.clock)
         self.queue = ReminderQueue(self)
         self.synced_changed = self.app.settings.connect('changed::synced-lists', lambda *args: self._synced_task_list_changed())
         self.reminders, self.lists = self._get_reminders(migrate_old=True)
+        # ids of the reminders that keep their time of day when the timezone changes, kept up to date by _set_countdown
+        self.wall_clock = set(reminder_id for reminder_id, reminder in self.reminders.items() if self._is_wall_clock(reminder))
         self.sound = GSound.Context()
         self.sound.init()
-        self.countdowns = Countdowns()
+        self.network = Gio.NetworkMonitor.get_default()
+        self.connectivity = self.network.get_connectivity()
+        self.network.connect('notify::connectivity', lambda *args: self._connectivity_changed())
         self.refresh_time = int(self.app.settings.get_string('refresh-frequency').strip('m'))
         self.app.settings.connect('changed::refresh-frequency', lambda *args: self._refresh_time_changed())
         self.app.settings.connect('changed::week-starts-sunday', lambda *args: self._week_start_changed())
-        try:
-            self.queue.load()
-        except:
-            pass
+        self.localtime = Gio.File.new_for_path('/etc/localtime').monitor_file(Gio.FileMonitorFlags.NONE, None)
+        self.localtime.connect('changed', lambda *args: self._timezone_changed())
+        self.system_connection = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+        self.system_connection.signal_subscribe(
+            'org.freedesktop.timedate1',
+            'org.freedesktop.DBus.Properties',
+            'PropertiesChanged',
+            '/org/freedesktop/timedate1',
+            None,
+            Gio.DBusSignalFlags.NONE,
+            lambda connection, sender, path, interface, signal, parameters, *args: self._timedate_changed(parameters),
+            None
+        )
         self._save_reminders()
         self._save_lists()
         self._methods = {
@@ -124,9 +178,26 @@ class Reminders():
             'ExportLists': self.export_lists,
             'ImportLists': self.import_lists,
             'Refresh': self.refresh,
+            'GetSyncStats': self.get_sync_stats,
+            'GetOccurrences': self.get_occurrences,
+            'GetNextDue': self.get_next_due,
+            'GetPastDue': self.get_past_due,
             'GetVersion': self.get_version
         }
         self._register()
+        self.credentials.load(('microsoft-cache', 'microsoft-users', 'caldav'), self._accounts_loaded)
+
+    def _accounts_loaded(self):
+        # runs on the main loop once the secrets are read, the first sync happens here instead of while starting up
+        self.to_do.load_accounts()
+        self.caldav.load_accounts()
+        self.accounts_loaded = True
+        self.refresh()
+
+        waiting = self.waiting
+        self.waiting = []
+        for args in waiting:
+            self._on_method_call(*args)
 
     def emit_error(self, error):
         logger.error("".join(format_exception(error)))
@@ -140,8 +211,11 @@ class Reminders():
         self.refresh(False)
 
     def start_countdowns(self):
-        for reminder_id in self.reminders.keys():
+        self.due_index.rebuild(self.reminders)
+        # only reminders that are due within the horizon are counted down now, the sweeps add the rest as it moves forward
+        for reminder_id in self.due_index.timestamps_between(None, self.countdowns.horizon):
             self._set_countdown(reminder_id)
+        self.countdowns.pending = self._pending_countdowns
         self.countdowns.add_timeout(self.refresh_time, self._refresh_cb, 'refresh')
 
     def do_emit(self, signal_name, parameters):
@@ -154,7 +228,6 @@ class Reminders():
         )
 
     def _refresh_cb(self):
-        self.countdowns.dict['refresh']['id'] = 0
         self.refresh()
         return False
 
@@ -162,10 +235,59 @@ class Reminders():
         starts_sunday = self.app.settings.get_boolean('week-starts-sunday')
         self.do_emit('WeekStartChanged', GLib.Variant('(b)', (starts_sunday,)))
 
+    def _timedate_changed(self, parameters):
+        # timedated sends this for the ntp and rtc settings as well
+        interface, changed, invalidated = parameters.unpack()
+        if 'Timezone' in changed or 'Timezone' in invalidated:
+            self._timezone_changed()
+
+    def _is_wall_clock(self, reminder):
+        # repeating local reminders keep their time of day, so their next timestamp moves with the timezone
+        return reminder['timestamp'] != 0 and not reminder['completed'] and reminder['repeat-type'] >= info.RepeatType.DAY and \
+            reminder['list-id'] in self.lists and self.lists[reminder['list-id']]['user-id'] == 'local'
+
+    def _update_wall_clock(self, reminder_id):
+        if self._is_wall_clock(self.reminders[reminder_id]):
+            self.wall_clock.add(reminder_id)
+        else:
+            self.wall_clock.discard(reminder_id)
+
+    def _timezone_changed(self):
+        # only the reminders in the wall clock index can move, everything else is a fixed point in time
+        wall_clock = {}
+        for reminder_id in self.wall_clock:
+            if reminder_id in self.reminders:
+                wall_clock[reminder_id] = datetime.datetime.fromtimestamp(self.reminders[reminder_id]['timestamp'])
+
+        # python only reads the timezone once, this makes it read it again
+        tzset()
+        self.recurrences = {}
+
+        updated_ids = []
+        now = floor(self.clock.time())
+        for reminder_id, reminder_datetime in wall_clock.items():
+            timestamp = floor(reminder_datetime.timestamp())
+            if timestamp != self.reminders[reminder_id]['timestamp']:
+                self.reminders[reminder_id]['timestamp'] = timestamp
+                self.reminders[reminder_id]['updated-timestamp'] = now
+                self._set_countdown(reminder_id)
+                updated_ids.append(reminder_id)
+
+        if len(updated_ids) > 0:
+            self._save_reminders()
+            updated_reminders = self.get_reminders(ids=updated_ids, return_variant=False)
+            self.do_emit('RemindersUpdated', GLib.Variant('(saa{sv})', (info.service_id, updated_reminders)))
+
     def _refresh_time_changed(self):
         self.refresh_time = int(self.app.settings.get_string('refresh-frequency').strip('m'))
         self.countdowns.add_timeout(self.refresh_time, self._refresh_cb, 'refresh')
 
+    def _connectivity_changed(self):
+        connectivity = self.network.get_connectivity()
+        if connectivity == Gio.NetworkConnectivity.FULL and self.connectivity != Gio.NetworkConnectivity.FULL:
+            self.queue.reconnect()
+        self.connectivity = connectivity
+
     def _synced_task_list_changed(self):
         self.synced_ids = self.app.settings.get_value('synced-lists').unpack()
         self.do_emit('SyncedListsChanged', self.get_synced_lists())
@@ -218,157 +340,258 @@ class Reminders():
         self.synced_changed = self.app.settings.connect('changed::synced-lists', lambda *args: self._synced_task_list_changed())
 
     def _sync_remote(self, old_reminders, old_lists, notify_past):
-        updated_reminder_ids = self.queue.get_updated_reminder_ids()
-        removed_reminder_ids = self.queue.get_removed_reminder_ids()
-
-        updated_list_ids = self.queue.get_updated_list_ids()
-        removed_list_ids = self.queue.get_removed_list_ids()
-
-        ms_lists, ms_not_synced = self.to_do.get_lists(removed_list_ids, old_lists, self.synced_ids)
-
-        caldav_lists, caldav_not_synced = self.caldav.get_lists(removed_list_ids, old_lists, self.synced_ids)
+        try:
+            start = perf_counter()
+            updated_reminder_ids = set(self.queue.get_updated_reminder_ids())
+            removed_reminder_ids = set(self.queue.get_removed_reminder_ids())
 
-        not_synced = ms_not_synced + caldav_not_synced
+            updated_list_ids = self.queue.get_updated_list_ids()
+            removed_list_ids = self.queue.get_removed_list_ids()
 
-        if ms_lists is None:
-            ms_lists = {}
-        if caldav_lists is None:
-            caldav_lists = {}
+            ms_lists, ms_not_synced = self.to_do.get_lists(removed_list_ids, old_lists, self.synced_ids)
 
-        new_lists = old_lists.copy()
-        for list_id, value in old_lists.items():
-            if value['user-id'] != 'local' and value['user-id'] not in not_synced:
-                new_lists.pop(list_id)
+            caldav_lists, caldav_not_synced = self.caldav.get_lists(removed_list_ids, old_lists, self.synced_ids)
 
-        new_reminders = old_reminders.copy()
-        for reminder_id, reminder in old_reminders.items():
-            if reminder['list-id'] not in new_lists.keys():
-                new_reminders.pop(reminder_id)
+            not_synced = ms_not_synced + caldav_not_synced
 
-        for user_id in ms_lists.keys():
-            for task_list in ms_lists[user_id]:
-                list_id = task_list['id']
+            if ms_lists is None:
+                ms_lists = {}
+            if caldav_lists is None:
+                caldav_lists = {}
 
-                new_lists[list_id] = {
-                    'name': task_list['name'],
-                    'user-id': user_id,
-                    'uid': task_list['uid']
-                }
+            new_lists = old_lists.copy()
+            for list_id, value in old_lists.items():
+                if value['user-id'] != 'local' and value['user-id'] not in not_synced:
+                    new_lists.pop(list_id)
 
-                for task in task_list['tasks']:
-                    if task['id'] in removed_reminder_ids:
-                        continue
+            new_reminders = old_reminders.copy()
+            # {reminder_id: Reminder} for reminders with queued changes that also changed on the server
+            remote_changes = {}
+            uids = {}
+            for reminder_id, reminder in old_reminders.items():
+                if reminder['list-id'] not in new_lists.keys():
+                    new_reminders.pop(reminder_id)
+                if reminder['uid'] != '' and reminder['uid'] not in uids:
+                    uids[reminder['uid']] = reminder_id
 
-                    reminder_id = None
-                    for old_reminder_id, old_reminder in old_reminders.items():
-                        if old_reminder['uid'] == task['id']:
-                            reminder_id = old_reminder_id
-                            break
+            for user_id in ms_lists.keys():
+                for task_list in ms_lists[user_id]:
+                    list_id = task_list['id']
 
-                    if reminder_id is None:
-                        reminder_id = self._do_generate_id()
+                    new_lists[list_id] = {
+                        'name': task_list['name'],
+                        'user-id': user_id,
+                        'uid': task_list['uid']
+                    }
 
                     try:
-                        timestamp = self._rfc_to_timestamp(task['reminderDateTime']['dateTime']) if 'reminderDateTime' in task else 0
-                    except:
-                        timestamp = 0
+                        self._merge_ms_tasks(task_list['tasks'], list_id, old_reminders, new_reminders, uids, updated_reminder_ids, removed_reminder_ids, remote_changes, notify_past)
+                    except Exception as error:
+                        logger.exception(f'{error}: Failed to sync list {list_id}, keeping the local copy')
+                        self._keep_list(list_id, old_reminders, new_reminders)
+
+            for user_id in caldav_lists.keys():
+                for task_list in caldav_lists[user_id]:
+                    list_id = task_list['id']
+
+                    new_lists[list_id] = {
+                        'name': task_list['name'],
+                        'user-id': user_id,
+                        'uid': task_list['uid']
+                    }
+
+                    for task_id, etag, task in task_list['tasks']:
+                        if task_id in removed_reminder_ids:
+                            continue
 
-                    is_future = timestamp > floor(time())
+                        reminder_id = uids.get(task_id, None)
+                        if reminder_id is None:
+                            reminder_id = self._do_generate_id()
 
-                    if reminder_id in old_reminders:
-                        if reminder_id in updated_reminder_ids:
+                        if self._remote_unchanged(reminder_id, list_id, etag, old_reminders, new_reminders, updated_reminder_ids):
                             continue
-                        reminder = old_reminders[reminder_id].copy()
-                    else:
-                        reminder = Reminder()
-                        reminder['shown'] = timestamp != 0 and not (is_future or notify_past)
 
-                    new_reminders[reminder_id] = self.to_do.task_to_reminder(task, list_id, reminder, timestamp)
+                        due_date = 0
+                        timestamp = 0
+                        due = task.icalendar_component.get('DUE', None)
+                        if due is not None:
+                            due = due.dt
+                            try:
+                                if isinstance(due, datetime.datetime):
+                                    timestamp = due.timestamp()
+                                elif isinstance(due, datetime.date):
+                                    due_date = datetime.datetime.combine(due, datetime.time(), tzinfo=datetime.timezone.utc).timestamp()
+                            except:
+                                pass
+
+                        is_future = timestamp > floor(self.clock.time())
+
+                        if reminder_id in old_reminders:
+                            reminder = old_reminders[reminder_id].copy()
+                        else:
+                            reminder = Reminder()
+                            reminder['shown'] = timestamp != 0 and not (is_future or notify_past)
+
+                        reminder = self.caldav.task_to_reminder(task.icalendar_component, list_id, reminder, timestamp, due_date)
+                        self._remote_changed(reminder_id, reminder, etag, new_reminders, updated_reminder_ids, remote_changes)
+
+            for reminder_id in updated_reminder_ids:
+                if reminder_id in remote_changes:
+                    new_reminders[reminder_id] = self._merge_remote(reminder_id, old_reminders[reminder_id], remote_changes[reminder_id])
+                elif reminder_id in old_reminders.keys():
+                    new_reminders[reminder_id] = old_reminders[reminder_id].copy()
+
+            for reminder_id in list(self.remote_base.keys()):
+                if reminder_id not in new_reminders:
+                    self.remote_base.pop(reminder_id)
+
+            for list_id in updated_list_ids:
+                if list_id in old_lists.keys():
+                    new_lists[list_id] = old_lists[list_id].copy()
+
+            with self.to_do.stats_lock:
+                ms_stats = self.to_do.stats.copy()
+            with self.caldav.stats_lock:
+                caldav_stats = self.caldav.stats.copy()
+            self.sync_stats = {
+                'duration': perf_counter() - start,
+                'ms-requests': ms_stats['requests'],
+                'ms-bytes': ms_stats['bytes'],
+                'ms-parse-time': ms_stats['parse-time'],
+                'caldav-requests': caldav_stats['requests'],
+                'caldav-bytes': caldav_stats['bytes'],
+                # ru_maxrss is in kilobytes and covers the whole life of the service, not just this sync
+                'lifetime-peak-memory': getrusage(RUSAGE_SELF).ru_maxrss * 1024
+            }
+            logger.info(f"Synced in {self.sync_stats['duration']:.2f}s, {self.sync_stats['ms-requests']} Microsoft To Do requests, {self.sync_stats['ms-bytes']} bytes, {self.sync_stats['ms-parse-time']:.3f}s parsing, {self.sync_stats['caldav-requests']} CalDAV requests, {self.sync_stats['caldav-bytes']} bytes, {self.sync_stats['lifetime-peak-memory'] // 1024} KiB peak memory since starting")
+
+            return new_reminders, new_lists
+        finally:
+            # the counters stay attached to this thread otherwise, and requests it makes later would count towards this sync
+            self.to_do.end_stats()
+            self.caldav.end_stats()
+
+    def _merge_ms_tasks(self, tasks, list_id, old_reminders, new_reminders, uids, updated_reminder_ids, removed_reminder_ids, remote_changes, notify_past):
+        # tasks can be a generator that fetches pages while it is being consumed
+        for task in tasks:
+            if task['id'] in removed_reminder_ids:
+                continue
 
-        for user_id in caldav_lists.keys():
-            for task_list in caldav_lists[user_id]:
-                list_id = task_list['id']
+            reminder_id = uids.get(task['id'], None)
+            if reminder_id is None:
+                reminder_id = self._do_generate_id()
 
-                new_lists[list_id] = {
-                    'name': task_list['name'],
-                    'user-id': user_id,
-                    'uid': task_list['uid']
-                }
-
-                for task in task_list['tasks']:
-                    task_id = task.icalendar_component.get('UID', None)
-                    if task_id in removed_reminder_ids:
-                        continue
-
-                    reminder_id = None
-                    for old_reminder_id, old_reminder in old_reminders.items():
-                        if old_reminder['uid'] == task_id:
-                            reminder_id = old_reminder_id
-                            break
-
-                    if reminder_id is None:
-                        reminder_id = self._do_generate_id()
-
-                    due_date = 0
-                    timestamp = 0
-                    due = task.icalendar_component.get('DUE', None)
-                    if due is not None:
-                        due = due.dt
-                        try:
-                            if isinstance(due, datetime.datetime):
-                                timestamp = due.timestamp()
-                            elif isinstance(due, datetime.date):
-                                due_date = datetime.datetime.combine(due, datetime.time(), tzinfo=datetime.timezone.utc).timestamp()
-                        except:
-                            pass
+            etag = self.to_do.get_etag(task)
+            if self._remote_unchanged(reminder_id, list_id, etag, old_reminders, new_reminders, updated_reminder_ids):
+                continue
 
-                    is_future = timestamp > floor(time())
+            try:
+                timestamp = self._rfc_to_timestamp(task['reminderDateTime']['dateTime']) if task.get('reminderDateTime', None) is not None else 0
+            except:
+                timestamp = 0
 
-                    if reminder_id in old_reminders:
-                        if reminder_id in updated_reminder_ids:
-                            continue
-                        reminder = old_reminders[reminder_id].copy()
-                    else:
-                        reminder = Reminder()
-                        reminder['shown'] = timestamp != 0 and not (is_future or notify_past)
+            is_future = timestamp > floor(self.clock.time())
 
-                    new_reminders[reminder_id] = self.caldav.task_to_reminder(task.icalendar_component, list_id, reminder, timestamp, due_date)
+            if reminder_id in old_reminders:
+                reminder = old_reminders[reminder_id].copy()
+            else:
+                reminder = Reminder()
+                reminder['shown'] = timestamp != 0 and not (is_future or notify_past)
 
-        for reminder_id in updated_reminder_ids:
-            if reminder_id in old_reminders.keys():
-                new_reminders[reminder_id] = old_reminders[reminder_id].copy()
+            reminder = self.to_do.task_to_reminder(task, list_id, reminder, timestamp)
+            self._remote_changed(reminder_id, reminder, etag, new_reminders, updated_reminder_ids, remote_changes)
 
-        for list_id in updated_list_ids:
-            if list_id in old_lists.keys():
-                new_lists[list_id] = old_lists[list_id].copy()
+    def _remote_unchanged(self, reminder_id, list_id, etag, old_reminders, new_reminders, updated_reminder_ids):
+        # keeps the stored reminder without converting the task again if the server copy is the one that was last synced
+        if etag == '' or reminder_id not in old_reminders:
+            return False
+        reminder = old_reminders[reminder_id]
+        if reminder['etag'] != etag or reminder['list-id'] != list_id:
+            return False
+        if reminder_id not in updated_reminder_ids:
+            new_reminders[reminder_id] = reminder
+            if reminder_id not in self.remote_base:
+                self.remote_base[reminder_id] = reminder.copy()
+        return True
+
+    def _remote_changed(self, reminder_id, reminder, etag, new_reminders, updated_reminder_ids, remote_changes):
+        reminder['etag'] = etag
+        if reminder_id in updated_reminder_ids:
+            # both sides changed, this gets merged with the local copy later
+            remote_changes[reminder_id] = reminder
+        else:
+            new_reminders[reminder_id] = reminder
+            self.remote_base[reminder_id] = reminder.copy()
+
+    def _merge_fields(self, base, local, remote):
+        # three way merge against the last synced copy, anything that changed on both sides keeps the local value
+        merged = local.copy()
+        if base is not None:
+            for fields in MERGE_FIELDS:
+                if all(local[field] == base[field] for field in fields):
+                    for field in fields:
+                        merged[field] = remote[field]
+        return merged
+
+    def _merge_remote(self, reminder_id, local, remote):
+        # the local value wins when both sides changed since it is still queued
+        merged = self._merge_fields(self.remote_base.get(reminder_id, None), local, remote)
+        merged['etag'] = remote['etag']
+        self.remote_base[reminder_id] = remote
+        return merged
+
+    def _merge_conflict(self, reminder_id, todo, merged):
+        # the server rejected an update because the task changed since it was fetched, todo is what it has now
+        # merged is filled in with the merged reminder, the task for it is sent instead of the local copy
+        local = self.reminders[reminder_id]
+        remote = self.caldav.task_to_reminder(todo.icalendar_component, local['list-id'], local.copy())
+        merged.update(self._merge_fields(self.remote_base.get(reminder_id, None), local, remote))
+        return self.caldav.reminder_to_task(merged, completed=merged['completed'], completed_timestamp=merged['completed-timestamp'])
+
+    def _apply_merge(self, reminder_id, merged):
+        # runs on the main loop once a merged update was sent, the server copy is the base for the next sync
+        if reminder_id in self.reminders:
+            reminder = self.reminders[reminder_id]
+            for fields in MERGE_FIELDS:
+                for field in fields:
+                    reminder[field] = merged[field]
+            reminder['etag'] = merged['etag']
+            self.remote_base[reminder_id] = merged
+            self._reminder_updated(info.service_id, reminder_id, reminder)
+            self._set_countdown(reminder_id)
+            self._save_reminders()
+        return False
 
-        return new_reminders, new_lists
+    def _keep_list(self, list_id, old_reminders, new_reminders):
+        # used when a list could only be partially synced, so nothing gets removed
+        for reminder_id, reminder in old_reminders.items():
+            if reminder['list-id'] == list_id and reminder_id not in new_reminders:
+                new_reminders[reminder_id] = reminder.copy()
 
     def _do_remote_create_reminder(self, reminder_id, location):
         try:
             uid = None
             try:
-                self.queue.load()
-                uid = self._to_remote_task(self.reminders[reminder_id], location, False)
+                self.queue.load({self._reminder_user(reminder_id)})
+                uid = self._to_remote_task(reminder_id, location, False)
             except (ConnectionError, Timeout):
-                self.queue.create_reminder(reminder_id, location)
+                self.queue.create_reminder(reminder_id)
             except HTTPError as error:
                 if error.response.status_code == 503:
-                    self.queue.create_reminder(reminder_id, location)
+                    self.queue.create_reminder(reminder_id)
                 else:
                     raise error
             if uid is not None:
-                self.reminders[reminder_id]['uid'] = uid
-                self._save_reminders()
+                self._write_back({reminder_id: {'uid': uid}})
         except Exception as error:
             self.emit_error(error)
 
-    def _do_remote_update_reminder(self, reminder_id, location, old_user_id, old_list_uid, old_uid, updating, old_list_id, save = True):
+    def _do_remote_update_reminder(self, reminder_id, location, old_user_id, old_list_uid, old_uid, updating, old_list_id):
         try:
             uid = None
             try:
-                self.queue.load()
-                uid = self._to_remote_task(self.reminders[reminder_id], location, updating, old_user_id, old_list_uid, old_uid, self.reminders[reminder_id]['completed'], self.reminders[reminder_id]['completed-timestamp'], self.reminders[reminder_id]['completed-date'])
+                self.queue.load({self._reminder_user(reminder_id), old_user_id})
+                uid = self._to_remote_task(reminder_id, location, updating, old_user_id, old_list_uid, old_uid, self.reminders[reminder_id]['completed'], self.reminders[reminder_id]['completed-timestamp'], self.reminders[reminder_id]['completed-date'])
             except (ConnectionError, Timeout):
                 self.queue.update_reminder(reminder_id, old_uid, old_user_id, old_list_uid, old_list_id, updating, self.reminders[reminder_id]['completed'], self.reminders[reminder_id]['completed-timestamp'], self.reminders[reminder_id]['completed-date'])
             except HTTPError as error:
@@ -377,21 +600,17 @@ class Reminders():
                 else:
                     raise error
             if uid is not None:
-                self.reminders[reminder_id]['uid'] = uid
-                if save:
-                    self._save_reminders()
+                self._write_back({reminder_id: {'uid': uid}})
         except Exception as error:
-            self.reminders[reminder_id]['uid'] = old_uid
-            self.reminders[reminder_id]['list-id'] = old_list_id
-            if save:
-                self._save_reminders()
+            self._write_back({reminder_id: {'uid': old_uid, 'list-id': old_list_id}})
             self.emit_error(error)
 
     def _do_remote_update_completed(self, reminder_id, reminder_dict):
         try:
+            uid = None
             try:
-                self.queue.load()
-                self._remote_set_completed(reminder_id, reminder_dict)
+                self.queue.load({self._reminder_user(reminder_id)})
+                uid = self._remote_set_completed(reminder_id, reminder_dict)
             except (ConnectionError, Timeout):
                 self.queue.update_completed(reminder_id)
             except HTTPError as error:
@@ -399,13 +618,15 @@ class Reminders():
                     self.queue.update_completed(reminder_id)
                 else:
                     raise error
+            if uid is not None:
+                self._write_back({reminder_id: {'uid': uid}})
         except Exception as error:
             self.emit_error(error)
 
     def _do_remote_remove_reminder(self, reminder_id, task_id, user_id, task_list):
         try:
             try:
-                self.queue.load()
+                self.queue.load({user_id})
                 self._remote_remove_task(user_id, task_list, task_id)
             except (ConnectionError, Timeout):
                 self.queue.remove_reminder(reminder_id, task_id, user_id, task_list)
@@ -421,7 +642,7 @@ class Reminders():
         try:
             uid = None
             try:
-                self.queue.load()
+                self.queue.load({user_id})
                 uid = self._remote_create_list(user_id, list_name)
             except (ConnectionError, Timeout):
                 self.queue.add_list(list_id)
@@ -430,15 +651,15 @@ class Reminders():
                     self.queue.add_list(list_id)
                 else:
                     raise error
-            self.lists[list_id]['uid'] = uid
-            self._save_lists()
+            if uid is not None:
+                self._write_back(lists={list_id: uid})
         except Exception as error:
             self.emit_error(error)
 
     def _do_remote_rename_list(self, user_id, list_id, new_name, uid):
         try:
             try:
-                self.queue.load()
+                self.queue.load({user_id})
                 self._remote_rename_list(user_id, uid, new_name)
             except (ConnectionError, Timeout):
                 self.queue.update_list(list_id)
@@ -453,7 +674,7 @@ class Reminders():
     def _do_remote_delete_list(self, user_id, list_id, uid):
         try:
             try:
-                self.queue.load()
+                self.queue.load({user_id})
                 self._remote_delete_list(user_id, uid)
             except (ConnectionError, Timeout):
                 self.queue.remove_list(list_id, uid, user_id)
@@ -465,6 +686,97 @@ class Reminders():
         except Exception as error:
             self.emit_error(error)
 
+    def _do_remote_update_reminderv(self, items):
+        # items is a dict of {reminder_id: (location, old_user_id, old_list_uid, old_uid, updating, old_list_id)}
+        try:
+            args = {}
+            for reminder_id, (location, old_user_id, old_list_uid, old_uid, updating, old_list_id) in items.items():
+                if reminder_id in self.reminders:
+                    reminder = self.reminders[reminder_id]
+                    args[reminder_id] = (location, updating, old_user_id, old_list_uid, old_uid, reminder['completed'], reminder['completed-timestamp'], reminder['completed-date'])
+
+            user_ids = set()
+            for reminder_id, (location, old_user_id, old_list_uid, old_uid, updating, old_list_id) in items.items():
+                user_ids.add(old_user_id)
+                if reminder_id in self.reminders:
+                    user_ids.add(self._reminder_user(reminder_id))
+
+            try:
+                self.queue.load(user_ids)
+                results = self._remote_update_reminderv(args)
+            except Exception as error:
+                if not should_queue(error):
+                    raise error
+                results = dict.fromkeys(args.keys(), error)
+
+            written = {}
+            for reminder_id, result in results.items():
+                if result is None or reminder_id not in self.reminders:
+                    continue
+                if not isinstance(result, Exception):
+                    written[reminder_id] = {'uid': result}
+                    continue
+                location, old_user_id, old_list_uid, old_uid, updating, old_list_id = items[reminder_id]
+                if should_queue(result):
+                    reminder = self.reminders[reminder_id]
+                    self.queue.update_reminder(reminder_id, old_uid, old_user_id, old_list_uid, old_list_id, updating, reminder['completed'], reminder['completed-timestamp'], reminder['completed-date'])
+                else:
+                    written[reminder_id] = {'uid': old_uid, 'list-id': old_list_id}
+                    self.emit_error(result)
+
+            self._write_back(written)
+        except Exception as error:
+            self.emit_error(error)
+
+    def _do_remote_update_completedv(self, reminder_ids):
+        try:
+            reminder_ids = [reminder_id for reminder_id in reminder_ids if reminder_id in self.reminders]
+
+            try:
+                self.queue.load(set(self._reminder_user(reminder_id) for reminder_id in reminder_ids))
+                results = self._remote_set_completedv(reminder_ids)
+            except Exception as error:
+                if not should_queue(error):
+                    raise error
+                results = dict.fromkeys(reminder_ids, error)
+
+            written = {}
+            for reminder_id, result in results.items():
+                if result is None:
+                    continue
+                if not isinstance(result, Exception):
+                    written[reminder_id] = {'uid': result}
+                elif should_queue(result):
+                    self.queue.update_completed(reminder_id)
+                else:
+                    self.emit_error(result)
+
+            self._write_back(written)
+        except Exception as error:
+            self.emit_error(error)
+
+    def _do_remote_remove_reminderv(self, values):
+        # values is a dict of {reminder_id: (task_id, user_id, task_list)}
+        try:
+            try:
+                self.queue.load(set(user_id for task_id, user_id, task_list in values.values()))
+                results = self._remote_remove_taskv(values)
+            except Exception as error:
+                if not should_queue(error):
+                    raise error
+                results = dict.fromkeys(values.keys(), error)
+
+            for reminder_id, error in results.items():
+                if error is None:
+                    continue
+                if should_queue(error):
+                    task_id, user_id, task_list = values[reminder_id]
+                    self.queue.remove_reminder(reminder_id, task_id, user_id, task_list)
+                else:
+                    self.emit_error(error)
+        except Exception as error:
+            self.emit_error(error)
+
     def _remote_remove_task(self, user_id, task_list, task_id):
         if user_id in self.to_do.users.keys():
             self.to_do.remove_task(user_id, task_list, task_id)
@@ -497,16 +809,265 @@ class Reminders():
         else:
             raise KeyError('Invalid user id')
 
+    def _reminder_user(self, reminder_id):
+        return self.lists[self.reminders[reminder_id]['list-id']]['user-id']
+
+    def _push(self, user_id, target, *args):
+        # remote writes run in order on a thread per account, so local changes never wait on the server
+        if user_id not in self.pipelines:
+            pipeline = Queue()
+            Thread(target=self._run_pipeline, args=(pipeline,), daemon=True).start()
+            self.pipelines[user_id] = pipeline
+        self.pipelines[user_id].put((target, args))
+
+    def _stop_pipeline(self, user_id):
+        # the account is gone, so whatever is still waiting can't be sent and the thread exits after the current write
+        pipeline = self.pipelines.pop(user_id, None)
+        if pipeline is not None:
+            while True:
+                try:
+                    pipeline.get_nowait()
+                except Empty:
+                    break
+            pipeline.put(None)
+
+    def _run_pipeline(self, pipeline):
+        while True:
+            item = pipeline.get()
+            if item is None:
+                return
+            target, args = item
+            try:
+                target(*args)
+            except Exception as error:
+                logger.exception(error)
+
+    def _write_back(self, reminders = None, lists = None):
+        # reminders is a dict of {reminder_id: {key: value}} and lists is a dict of {list_id: uid} that the server gave back,
+        # they are written on the main loop so they can't be lost to refresh replacing the reminders and lists
+        if not reminders and not lists:
+            return
+
+        if current_thread() is main_thread():
+            self._apply_write_back(reminders, lists)
+            return
+
+        written = Event()
+
+        def apply():
+            try:
+                self._apply_write_back(reminders, lists)
+            finally:
+                written.set()
+            return False
+
+        GLib.idle_add(apply)
+        # the next write for the same reminder or list needs the new uid, so the pipeline or replay waits for it
+        written.wait()
+
+    def _apply_write_back(self, reminders, lists):
+        if reminders:
+            for reminder_id, values in reminders.items():
+                if reminder_id in self.reminders:
+                    for key, value in values.items():
+                        self.reminders[reminder_id][key] = value
+            self._save_reminders()
+
+        if lists:
+            for list_id, uid in lists.items():
+                if list_id in self.lists:
+                    self.lists[list_id]['uid'] = uid
+            self._save_lists()
+
+    def _add_remote_reminder(self, new_reminder):
+        # runs on the main loop after the server split a completed recurring reminder
+        new_id = self._do_generate_id()
+        self.reminders[new_id] = new_reminder
+        self._set_countdown(new_id)
+        self._reminder_updated(info.service_id, new_id, new_reminder)
+        self._save_reminders()
+        return False
+
+    def _get_location(self, user_id):
+        if user_id == 'local':
+            return 'local'
+        elif user_id in self.to_do.users.keys():
+            return 'ms-to-do'
+        elif user_id in self.caldav.users.keys():
+            return 'caldav'
+        else:
+            raise KeyError('Invalid user id')
+
+    def _remote_each(self, items, target):
+        # runs target for every item that can't be batched, returns a dict of {key: what target returned or error}
+        # the remote methods below give back the new uid of a reminder or list, or None if it didn't change,
+        # they never write it themselves since they run off the main loop
+        results = {}
+        futures = {key: self.remote_pool.submit(target, *args) for key, args in items.items()}
+        for key, future in futures.items():
+            error = future.exception()
+            results[key] = error if error is not None else future.result()
+
+        return results
+
+    def _remote_batches(self, batches, target):
+        # runs target once per microsoft account, returns a dict of {key: what target returned or error}
+        results = {}
+        for user_id, keys in batches.items():
+            try:
+                results.update(target(user_id, keys))
+            except Exception as error:
+                for key in keys:
+                    results[key] = error
+        return results
+
+    def _remote_create_reminder(self, reminder_id):
+        location = self._get_location(self.lists[self.reminders[reminder_id]['list-id']]['user-id'])
+        return self._to_remote_task(reminder_id, location, False)
+
+    def _remote_create_reminderv(self, reminder_ids):
+        results = {}
+        batches = {}
+        others = {}
+        for reminder_id in reminder_ids:
+            try:
+                user_id = self.lists[self.reminders[reminder_id]['list-id']]['user-id']
+                if user_id in self.to_do.users.keys():
+                    batches.setdefault(user_id, []).append(reminder_id)
+                else:
+                    others[reminder_id] = (reminder_id,)
+            except Exception as error:
+                results[reminder_id] = error
+
+        results.update(self._remote_each(others, self._remote_create_reminder))
+        results.update(self._remote_batches(batches, self._ms_create_reminderv))
+        return results
+
+    def _ms_create_reminderv(self, user_id, reminder_ids):
+        tasks = {}
+        for reminder_id in reminder_ids:
+            reminder = self.reminders[reminder_id]
+            tasks[reminder_id] = (self.lists[reminder['list-id']]['uid'], self.to_do.reminder_to_task(reminder))
+
+        return self.to_do.create_tasks(user_id, tasks)
+
+    def _remote_update_reminder(self, reminder_id, location, updating, old_user_id, old_list_uid, old_uid, completed, completed_timestamp, completed_date):
+        return self._to_remote_task(reminder_id, location, updating, old_user_id, old_list_uid, old_uid, completed, completed_timestamp, completed_date)
+
+    def _remote_update_reminderv(self, items):
+        # items is a dict of {reminder_id: (location, updating, old_user_id, old_list_uid, old_uid, completed, completed_timestamp, completed_date)}
+        results = {}
+        batches = {}
+        others = {}
+        for reminder_id, args in items.items():
+            if reminder_id not in self.reminders:
+                results[reminder_id] = KeyError('Invalid reminder id')
+            elif args[0] == 'ms-to-do' and (args[2] is None or args[2] in self.to_do.users.keys()):
+                user_id = self.lists[self.reminders[reminder_id]['list-id']]['user-id']
+                batches.setdefault(user_id, []).append(reminder_id)
+            else:
+                others[reminder_id] = (reminder_id,) + tuple(args)
+
+        results.update(self._remote_each(others, self._remote_update_reminder))
+
+        for user_id, reminder_ids in batches.items():
+            creating = {}
+            updating = {}
+            for reminder_id in reminder_ids:
+                reminder = self.reminders[reminder_id]
+                list_uid = self.lists[reminder['list-id']]['uid']
+                completed, completed_date = items[reminder_id][5], items[reminder_id][7]
+                task = self.to_do.reminder_to_task(reminder, completed=completed, completed_date=completed_date)
+                if items[reminder_id][1]:
+                    updating[reminder_id] = (list_uid, reminder['uid'], task)
+                else:
+                    creating[reminder_id] = (list_uid, task)
+
+            try:
+                if len(updating) > 0:
+                    results.update(self.to_do.update_tasks(user_id, updating))
+                if len(creating) > 0:
+                    results.update(self.to_do.create_tasks(user_id, creating))
+            except Exception as error:
+                for reminder_id in reminder_ids:
+                    results[reminder_id] = error
+
+        moving = {}
+        for user_id, reminder_ids in batches.items():
+            for reminder_id in reminder_ids:
+                if isinstance(results[reminder_id], Exception):
+                    continue
+                # a created task gives back its uid, an updated one gives back the task which isn't needed
+                uid = results[reminder_id] if not items[reminder_id][1] else None
+                results[reminder_id] = uid
+                old_user_id, old_list_uid, old_uid = items[reminder_id][2:5]
+                if old_list_uid not in (None, self.lists[self.reminders[reminder_id]['list-id']]['uid']) or old_uid not in (None, uid if uid is not None else self.reminders[reminder_id]['uid']):
+                    if old_user_id is None:
+                        old_user_id = user_id
+                    moving.setdefault(old_user_id, []).append(reminder_id)
+
+        if len(moving) > 0:
+            def remove_old(user_id, reminder_ids):
+                tasks = {}
+                for reminder_id in reminder_ids:
+                    tasks[reminder_id] = (items[reminder_id][3], items[reminder_id][4])
+                return self.to_do.remove_tasks(user_id, tasks)
+
+            for reminder_id, error in self._remote_batches(moving, remove_old).items():
+                if error is not None:
+                    results[reminder_id] = error
+
+        return results
+
+    def _remote_set_completedv(self, reminder_ids):
+        results = {}
+        batches = {}
+        others = {}
+        for reminder_id in reminder_ids:
+            try:
+                reminder = self.reminders[reminder_id]
+                user_id = self.lists[reminder['list-id']]['user-id']
+                if user_id in self.to_do.users.keys():
+                    batches.setdefault(user_id, []).append(reminder_id)
+                else:
+                    others[reminder_id] = (reminder_id, reminder)
+            except Exception as error:
+                results[reminder_id] = error
+
+        results.update(self._remote_each(others, self._remote_set_completed))
+        results.update(self._remote_batches(batches, self._ms_set_completedv))
+        return results
+
+    def _remote_remove_taskv(self, values):
+        # values is a dict of {key: (task_id, user_id, task_list)}
+        batches = {}
+        others = {}
+        for key, (task_id, user_id, task_list) in values.items():
+            if user_id in self.to_do.users.keys():
+                batches.setdefault(user_id, []).append(key)
+            else:
+                others[key] = (user_id, task_list, task_id)
+
+        def remove(user_id, keys):
+            tasks = {}
+            for key in keys:
+                tasks[key] = (values[key][2], values[key][0])
+            return self.to_do.remove_tasks(user_id, tasks)
+
+        results = self._remote_each(others, self._remote_remove_task)
+        results.update(self._remote_batches(batches, remove))
+        return results
+
     def _remote_set_completed(self, reminder_id, reminder_dict):
         user_id = self.lists[reminder_dict['list-id']]['user-id']
         if user_id in self.to_do.users.keys():
-            self._ms_set_completed(reminder_id, reminder_dict)
+            return self._ms_set_completed(reminder_id, reminder_dict)
         elif user_id in self.caldav.users.keys():
-            self._caldav_set_completed(reminder_id, reminder_dict)
+            return self._caldav_set_completed(reminder_id, reminder_dict)
         else:
             raise KeyError('Invalid user id')
 
-    def _ms_set_completed(self, reminder_id, reminder):
+    def _ms_completed_json(self, reminder):
         reminder_json = {}
         reminder_json['status'] = 'completed' if reminder['completed'] else 'notStarted'
 
@@ -517,35 +1078,48 @@ class Reminders():
         else:
             reminder_json['completedDateTime'] = None
 
+        return reminder_json
+
+    def _ms_set_completed(self, reminder_id, reminder):
         list_id = reminder['list-id']
         user_id = self.lists[reminder['list-id']]['user-id']
         list_uid = self.lists[list_id]['uid']
-        results = self.to_do.update_task(user_id, list_uid, reminder['uid'], reminder_json)
+        results = self.to_do.update_task(user_id, list_uid, reminder['uid'], self._ms_completed_json(reminder))
 
+        return self._ms_completed_recurring(reminder_id, reminder, results)
+
+    def _ms_set_completedv(self, user_id, reminder_ids):
+        tasks = {}
+        for reminder_id in reminder_ids:
+            reminder = self.reminders[reminder_id]
+            list_uid = self.lists[reminder['list-id']]['uid']
+            tasks[reminder_id] = (list_uid, reminder['uid'], self._ms_completed_json(reminder))
+
+        uids = {}
+        for reminder_id, results in self.to_do.update_tasks(user_id, tasks).items():
+            if isinstance(results, Exception):
+                uids[reminder_id] = results
+            else:
+                uids[reminder_id] = self._ms_completed_recurring(reminder_id, self.reminders[reminder_id], results)
+
+        return uids
+
+    def _ms_completed_recurring(self, reminder_id, reminder, results):
+        # returns the uid of the completed copy if the server moved the task on to its next occurrence
         try:
             if reminder['completed'] and results['status'] != 'completed':
-                # this sucks but microsofts api is goofy and this is the only way I can get the new uid of the reminder that was completed
-                updated_timestamp = self._rfc_to_timestamp(results['lastModifiedDateTime'])
-                match_diff = None
-                new_uid = ''
-                for task in self.to_do.get_tasks(list_uid, user_id):
-                    if task['id'] == results['id']:
-                        continue
-                    timestamp = self._rfc_to_timestamp(task['lastModifiedDateTime'])
-                    diff = abs(updated_timestamp - timestamp)
-                    if match_diff is None or diff < match_diff:
-                        match_diff = diff
-                        new_uid = task['id']
-
-                reminder = self.to_do.task_to_reminder(results, list_id)
-                new_id = self._do_generate_id()
-                self.reminders[reminder_id]['uid'] = new_uid
-                self.reminders[new_id] = reminder
-                self._set_countdown(new_id)
-                self._reminder_updated(info.service_id, new_id, reminder)
-                self._save_reminders()
-        except:
-            pass
+                list_id = reminder['list-id']
+                user_id = self.lists[list_id]['user-id']
+                list_uid = self.lists[list_id]['uid']
+                # the task that was sent keeps its id and becomes the next occurrence
+                new_uid = self.to_do.get_completed_copy(user_id, list_uid, results, reminder['completed-date'])
+
+                new_reminder = self.to_do.task_to_reminder(results, list_id)
+                GLib.idle_add(self._add_remote_reminder, new_reminder)
+                return new_uid if new_uid is not None else ''
+        except Exception as error:
+            logger.exception(f'{error}: Failed to find the completed copy of {reminder_id}')
+        return None
 
     def _caldav_set_completed(self, reminder_id, reminder):
         list_id = reminder['list-id']
@@ -559,14 +1133,11 @@ class Reminders():
             new_uid, task = self.caldav.complete_task(user_id, list_uid, task_id, completed_timestamp)
             if new_uid is not None:
                 new_reminder = self.caldav.task_to_reminder(task, list_id)
-                new_id = self._do_generate_id()
-                self.reminders[reminder_id]['uid'] = new_uid
-                self.reminders[new_id] = new_reminder
-                self._set_countdown(new_id)
-                self._reminder_updated(info.service_id, new_id, new_reminder)
-                self._save_reminders()
+                GLib.idle_add(self._add_remote_reminder, new_reminder)
+            return new_uid
         else:
             self.caldav.incomplete_task(user_id, list_uid, task_id)
+            return None
 
     def _register(self):
         if self._regid is not None:
@@ -582,6 +1153,11 @@ class Reminders():
         )
 
     def _on_method_call(self, connection, sender, path, interface, method, parameters, invocation):
+        if not self.accounts_loaded:
+            # answering now could leave out accounts or lists that are still being read
+            self.waiting.append((connection, sender, path, interface, method, parameters, invocation))
+            return
+
         try:
             # These methods need special code to function properly
             if method == 'Quit':
@@ -615,39 +1191,121 @@ class Reminders():
 
     def _remove_countdown(self, reminder_id):
         self.countdowns.remove_countdown(reminder_id)
+        self.due_index.remove(reminder_id)
+        self.wall_clock.discard(reminder_id)
 
     def _set_countdown(self, reminder_id):
         self.countdowns.remove_countdown(reminder_id)
 
         reminder = self.reminders[reminder_id]
+        self.due_index.update(reminder_id, reminder)
+        self._update_wall_clock(reminder_id)
         if reminder['timestamp'] == 0:
             return
 
         if reminder['completed'] or reminder['shown']:
             return
 
+        # reminders past the horizon are already in the due index, a sweep adds them once they get close
+        if self.countdowns.pending is not None and reminder['timestamp'] > self.countdowns.horizon:
+            return
+
+        self.countdowns.add_countdown(reminder['timestamp'], self._countdown_callback(reminder_id), reminder_id)
+
+    def _countdown_callback(self, reminder_id):
         def do_show_notification():
             self.show_notification(reminder_id)
             return False
 
-        self.countdowns.add_countdown(reminder['timestamp'], do_show_notification, reminder_id)
+        return do_show_notification
+
+    def _pending_countdowns(self, start, end):
+        countdowns = []
+        for reminder_id in self.due_index.timestamps_between(start, end):
+            reminder = self.reminders.get(reminder_id, None)
+            if reminder is not None and not reminder['completed'] and not reminder['shown']:
+                countdowns.append((reminder['timestamp'], self._countdown_callback(reminder_id), reminder_id))
+        return countdowns
 
     def show_notification(self, reminder_id):
+        # countdowns that are due together all fire before the main loop gets idle again
+        if len(self.due) == 0:
+            GLib.idle_add(self._show_due)
+        self.due.append(reminder_id)
+
+    def _show_due(self):
+        due = self.due
+        self.due = []
+        reminder_ids = []
+        for reminder_id in due:
+            if reminder_id in self.reminders and reminder_id not in reminder_ids and not self.reminders[reminder_id]['shown']:
+                reminder_ids.append(reminder_id)
+
+        if len(reminder_ids) == 0:
+            return False
+
+        if len(reminder_ids) > NOTIFICATION_SUMMARY_THRESHOLD:
+            self._send_summary_notification(reminder_ids)
+        else:
+            for reminder_id in reminder_ids:
+                self._send_notification(reminder_id)
+
+        self._play_sound()
+
+        for reminder_id in reminder_ids:
+            self.reminders[reminder_id]['shown'] = True
+        self._save_reminders()
+
+        if len(reminder_ids) == 1:
+            self.do_emit('ReminderShown', GLib.Variant('(s)', (reminder_ids[0],)))
+        else:
+            self.do_emit('RemindersShown', GLib.Variant('(as)', (reminder_ids,)))
+        return False
+
+    def _send_notification(self, reminder_id):
         notification = Gio.Notification.new(self.reminders[reminder_id]['title'])
         notification.set_body(self.reminders[reminder_id]['description'])
         notification.add_button_with_target(_('Mark as completed'), 'app.reminder-completed', GLib.Variant('s', reminder_id))
         notification.set_default_action('app.notification-clicked')
 
         self.app.send_notification(reminder_id, notification)
+
+    def _send_summary_notification(self, reminder_ids):
+        count = len(reminder_ids)
+        notification = Gio.Notification.new(ngettext('{} reminder is due', '{} reminders are due', count).format(count))
+        notification.set_body('\n'.join(self.reminders[reminder_id]['title'] for reminder_id in reminder_ids))
+        notification.add_button_with_target(_('Mark as completed'), 'app.reminders-completed', GLib.Variant('as', reminder_ids))
+        notification.set_default_action('app.notification-clicked')
+
+        self.summary = list(reminder_ids)
+        self.app.send_notification('summary', notification)
+
+    def _withdraw_notification(self, reminder_id):
+        self.app.withdraw_notification(reminder_id)
+        if reminder_id in self.summary:
+            self.summary.remove(reminder_id)
+            # reminders are completed together from several threads, the summary is only sent again once for all of them
+            if not self.summary_changed:
+                self.summary_changed = True
+                GLib.idle_add(self._refresh_summary)
+
+    def _refresh_summary(self):
+        self.summary_changed = False
+        reminder_ids = [reminder_id for reminder_id in self.summary if reminder_id in self.reminders and not self.reminders[reminder_id]['completed']]
+        if len(reminder_ids) == 0:
+            self.summary = []
+            self.app.withdraw_notification('summary')
+        else:
+            self._send_summary_notification(reminder_ids)
+        return False
+
+    def _play_sound(self):
         if self.app.settings.get_boolean('notification-sound') and not self.playing_sound:
             self.playing_sound = True
             if self.app.settings.get_boolean('included-notification-sound'):
                 self.sound.play_full({GSound.ATTR_MEDIA_FILENAME: f'{GLib.get_system_data_dirs()[0]}/sounds/{info.app_executable}/notification.ogg'}, None, self._sound_cb)
             else:
                 self.sound.play_full({GSound.ATTR_EVENT_ID: 'bell'}, None, self._sound_cb)
-        self._shown(reminder_id)
-        self.do_emit('ReminderShown', GLib.Variant('(s)', (reminder_id,)))
-        self.countdowns.dict[reminder_id]['id'] = 0
 
     def _sound_cb(self, context, result):
         try:
@@ -657,197 +1315,26 @@ class Reminders():
         self.playing_sound = False
 
     def _repeat(self, reminder_dict):
-        delta = None
-        repeat_times = reminder_dict['repeat-times']
-
-        if repeat_times != -1:
-            repeat_times -= 1
-
-        if repeat_times == 0:
-            return
-
-        timestamp = reminder_dict['timestamp']
-        repeat_until = reminder_dict['repeat-until']
-
-        notify = timestamp != 0
-        if notify:
-            reminder_datetime = datetime.datetime.fromtimestamp(timestamp)
-        else:
-            timestamp = reminder_dict['due-date']
-            reminder_datetime = datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
-
-        repeat_until_date = datetime.datetime.fromtimestamp(repeat_until, tz=datetime.timezone.utc).date()
-
-        if repeat_until > 0 and reminder_datetime.date() > repeat_until_date:
-            return
-
-        repeat_type = reminder_dict['repeat-type']
-        frequency = reminder_dict['repeat-frequency']
-        repeat_days = reminder_dict['repeat-days']
-
-        if repeat_type == info.RepeatType.MINUTE:
-            delta = datetime.timedelta(minutes=frequency)
-        elif repeat_type == info.RepeatType.HOUR:
-            delta = datetime.timedelta(hours=frequency)
-        elif repeat_type == info.RepeatType.DAY:
-            delta = datetime.timedelta(days=frequency)
-
-        if delta is not None:
-            reminder_datetime += delta
-            timestamp = reminder_datetime.timestamp()
-            while ((timestamp < floor(time())) if notify else (reminder_datetime.date() < datetime.date.today())):
-                if repeat_times != -1:
-                    repeat_times -= 1
-                if repeat_times == 0:
-                    break
-                reminder_datetime += delta
-                timestamp = reminder_datetime.timestamp()
-
-        if repeat_type == info.RepeatType.WEEK:
-            starts_sunday = self.app.settings.get_boolean('week-starts-sunday')
-            week_frequency = 0
-
-            if not starts_sunday:
-                weekday = reminder_datetime.date().weekday()
-            else:
-                weekday = (reminder_datetime.date().weekday() + 1) % 7
-
-            if repeat_days == 0:
-                repeat_days = weekday
-
-            repeat_days_flag = info.RepeatDays(repeat_days)
-            index = 0
-            days = []
-            if not starts_sunday:
-                flags = (
-                    info.RepeatDays.MON,
-                    info.RepeatDays.TUE,
-                    info.RepeatDays.WED,
-                    info.RepeatDays.THU,
-                    info.RepeatDays.FRI,
-                    info.RepeatDays.SAT,
-                    info.RepeatDays.SUN
-                )
-            else:
-                flags = (
-                    info.RepeatDays.SUN,
-                    info.RepeatDays.MON,
-                    info.RepeatDays.TUE,
-                    info.RepeatDays.WED,
-                    info.RepeatDays.THU,
-                    info.RepeatDays.FRI,
-                    info.RepeatDays.SAT
-                )
-
-            for num, flag in enumerate(flags):
-                if flag in repeat_days_flag:
-                    days.append(num)
-
-            if len(days) == 0:
-                return
-
-            for i, value in enumerate(days):
-                if value == weekday:
-                    index = i + 1
-                    if index > len(days) - 1:
-                        index = 0
-                        week_frequency = frequency - 1
-                    break
-                if value > weekday:
-                    index = i
-                    break
-                if i == len(days) - 1:
-                    index = 0
-                    week_frequency = frequency - 1
-                    break
-
-            reminder_datetime += datetime.timedelta(days=(((days[index] - weekday - 1) % 7 + 1) + 7 * week_frequency))
-            timestamp = reminder_datetime.timestamp()
-            while ((timestamp < floor(time())) if notify else (reminder_datetime.date() < datetime.date.today())):
-                week_frequency = 0
-                if repeat_times != -1:
-                    repeat_times -= 1
-                if repeat_times == 0:
-                    break
-
-                if not starts_sunday:
-                    weekday = reminder_datetime.date().weekday()
-                else:
-                    weekday = (reminder_datetime.date().weekday() + 1) % 7
-
-                index += 1
-                if index > len(days) - 1:
-                    index = 0
-                    week_frequency = frequency - 1
-
-                reminder_datetime += datetime.timedelta(days=(((days[index] - weekday - 1) % 7 + 1) + 7 * week_frequency))
-                timestamp = reminder_datetime.timestamp()
-
-        elif repeat_type == info.RepeatType.MONTH:
-            reminder_datetime = self._month_repeat(reminder_datetime, frequency)
-            timestamp = reminder_datetime.timestamp()
-            while ((timestamp < floor(time())) if notify else (reminder_datetime.date() < datetime.date.today())):
-                if repeat_times != -1:
-                    repeat_times -= 1
-                if repeat_times == 0:
-                    break
-                reminder_datetime = self._month_repeat(reminder_datetime, frequency)
-                timestamp = reminder_datetime.timestamp()
-
-        elif repeat_type == info.RepeatType.YEAR:
-            reminder_datetime = self._year_repeat(reminder_datetime, frequency)
-            timestamp = reminder_datetime.timestamp()
-            while ((timestamp < floor(time())) if notify else (reminder_datetime.date() < datetime.date.today())):
-                if repeat_times != -1:
-                    repeat_times -= 1
-                if repeat_times == 0:
-                    break
-                reminder_datetime = self._year_repeat(reminder_datetime, frequency)
-                timestamp = reminder_datetime.timestamp()
-
-        if repeat_until > 0 and reminder_datetime.date() > repeat_until_date:
-            return
-
-        timestamp = floor(reminder_datetime.timestamp()) if notify else 0
-        due_date = floor(reminder_datetime.timestamp()) if not notify else 0
-
-        return timestamp, due_date, repeat_times
-
-    def _month_repeat(self, reminder_datetime, frequency):
-        date = reminder_datetime.date()
-        time = reminder_datetime.time()
-        tz = reminder_datetime.tzinfo
-        months = date.month + frequency - 1
-
-        year = date.year + months // 12
-
-        month = months % 12 + 1
-
-        days = monthrange(year, month)[1]
-        day = date.day
-        if day > days:
-            day = days
-
-        return datetime.datetime.combine(datetime.date(year, month, day), time, tzinfo=tz)
-
-    def _year_repeat(self, reminder_datetime, frequency):
-        date = reminder_datetime.date()
-        time = reminder_datetime.time()
-        tz = reminder_datetime.tzinfo
-
-        year = date.year + frequency
-
-        days = monthrange(year, date.month)[1]
-        day = date.day
-        if day > days:
-            day = days
-
-        return datetime.datetime.combine(datetime.date(year, date.month, day), time, tzinfo=tz)
+        return next_occurrences([get_rule(reminder_dict)], self.app.settings.get_boolean('week-starts-sunday'), self.clock)[0]
+
+    def _add_repeat(self, reminder_dict, repeat):
+        new_dict = reminder_dict.copy()
+        new_dict['timestamp'], new_dict['due-date'], new_dict['repeat-times'] = repeat
+        new_dict['completed'] = False
+        new_id = self._do_generate_id()
+        self.reminders[new_id] = new_dict
+        self._set_countdown(new_id)
+        self._reminder_updated(info.service_id, new_id, new_dict)
+
+    def _get_recurrence(self, reminder_id, week_starts_sunday):
+        reminder = self.reminders[reminder_id]
+        rule = get_rule(reminder)
+        if reminder_id in self.recurrences and self.recurrences[reminder_id][0] == (rule, week_starts_sunday):
+            return self.recurrences[reminder_id][1]
 
-    def _shown(self, reminder_id):
-        if not self.reminders[reminder_id]['shown'] > 0:
-            self.reminders[reminder_id]['shown'] = True
-            self._save_reminders()
+        recurrence = Recurrence(rule, week_starts_sunday)
+        self.recurrences[reminder_id] = ((rule, week_starts_sunday), recurrence)
+        return recurrence
 
     def _save_reminders(self):
         with open(REMINDERS_FILE, 'w', newline='') as csvfile:
@@ -874,7 +1361,8 @@ class Reminders():
                     'completed-timestamp': reminder['completed-timestamp'],
                     'completed-date': reminder['completed-date'],
                     'list-id': reminder['list-id'],
-                    'uid': reminder['uid']
+                    'uid': reminder['uid'],
+                    'etag': reminder['etag']
                 })
 
     def _save_lists(self):
@@ -1002,7 +1490,8 @@ class Reminders():
                         try:
                             list_id = row['id']
                             user_id = row['user-id']
-                            if user_id not in 'local' and user_id not in self.to_do.users.keys() and user_id not in self.caldav.users.keys():
+                            # lists of accounts that aren't read yet are kept, they would be saved without them otherwise
+                            if self.accounts_loaded and user_id not in 'local' and user_id not in self.to_do.users.keys() and user_id not in self.caldav.users.keys():
                                 continue
                             lists[list_id] = {
                                 'name': row['name'],
@@ -1054,6 +1543,7 @@ class Reminders():
                             reminders[reminder_id]['completed-date'] = self._get_int(row, 'completed-date')
                             reminders[reminder_id]['list-id'] = list_id
                             reminders[reminder_id]['uid'] = self._get_str(row, 'uid')
+                            reminders[reminder_id]['etag'] = self._get_str(row, 'etag')
 
                             if repeat_type != 0:
                                 reminders[reminder_id]['repeat-frequency'] = self._get_int(row, 'repeat-frequency')
@@ -1068,11 +1558,13 @@ class Reminders():
 
         self._migrate_old(reminders, lists)
 
-        reminders, lists = self._sync_remote(reminders, lists, notify_past)
+        if self.accounts_loaded:
+            reminders, lists = self._sync_remote(reminders, lists, notify_past)
 
         return reminders, lists
 
-    def _to_remote_task(self, reminder, location, updating, old_user_id = None, old_list_id = None, old_task_id = None, completed = None, completed_timestamp = None, completed_date = None):
+    def _to_remote_task(self, reminder_id, location, updating, old_user_id = None, old_list_id = None, old_task_id = None, completed = None, completed_timestamp = None, completed_date = None):
+        reminder = self.reminders[reminder_id]
         list_id = reminder['list-id']
         user_id = self.lists[list_id]['user-id']
         list_uid = self.lists[list_id]['uid']
@@ -1090,7 +1582,11 @@ class Reminders():
         elif location == 'caldav':
             task = self.caldav.reminder_to_task(reminder, completed=completed, completed_timestamp=completed_timestamp)
             if updating:
-                self.caldav.update_task(user_id, list_uid, task_id, task)
+                merged = {}
+                self.caldav.update_task(user_id, list_uid, task_id, task, lambda todo: self._merge_conflict(reminder_id, todo, merged))
+                if len(merged) > 0:
+                    merged['etag'] = self.caldav.get_etag(self.caldav.get_todo(user_id, list_uid, task_id))
+                    GLib.idle_add(self._apply_merge, reminder_id, merged)
             else:
                 new_task_id = self.caldav.create_task(user_id, list_uid, task)
 
@@ -1105,9 +1601,9 @@ class Reminders():
         return new_task_id
 
     # Below methods can be accessed by other apps over dbus
-    def update_completed(self, app_id: str, reminder_id: str, completed: bool, now = None, today = None, save = True):
+    def update_completed(self, app_id: str, reminder_id: str, completed: bool, now = None, today = None, save = True, batch = None, repeats = None):
         if now is None:
-            now = floor(time())
+            now = floor(self.clock.time())
 
         if today is None:
             today = datetime.datetime.combine(datetime.date.fromtimestamp(now), datetime.time(), tzinfo=datetime.timezone.utc).timestamp()
@@ -1122,22 +1618,23 @@ class Reminders():
 
             user_id = self.lists[self.reminders[reminder_id]['list-id']]['user-id']
             if user_id != 'local':
-                GLib.idle_add(lambda *args: self._do_remote_update_completed(reminder_id, reminder_dict))
+                if batch is not None:
+                    batch.append(reminder_id)
+                else:
+                    self._push(user_id, self._do_remote_update_completed, reminder_id, reminder_dict)
 
             if completed:
-                self.app.withdraw_notification(reminder_id)
+                self._withdraw_notification(reminder_id)
                 self._remove_countdown(reminder_id)
                 if user_id == 'local' and reminder_dict['repeat-type'] != 0 and reminder_dict['repeat-times'] != 0:
-                    try:
-                        new_dict = reminder_dict.copy()
-                        new_dict['timestamp'], new_dict['due-date'], new_dict['repeat-times'] = self._repeat(reminder_dict)
-                        new_dict['completed'] = False
-                        new_id = self._do_generate_id()
-                        self.reminders[new_id] = new_dict
-                        self._set_countdown(new_id)
-                        self._reminder_updated(info.service_id, new_id, new_dict)
-                    except:
-                        pass
+                    if repeats is not None:
+                        # the caller works out all of the repeats at once
+                        repeats.append(reminder_id)
+                    else:
+                        try:
+                            self._add_repeat(reminder_dict, self._repeat(reminder_dict))
+                        except:
+                            pass
             else:
                 self._set_countdown(reminder_id)
 
@@ -1148,25 +1645,27 @@ class Reminders():
         return GLib.Variant('(uu)', (now, today))
 
     def update_completedv(self, app_id: str, reminder_ids: list, completed: bool):
-        now = floor(time())
+        now = floor(self.clock.time())
         today = datetime.datetime.combine(datetime.date.fromtimestamp(now), datetime.time(), tzinfo=datetime.timezone.utc).timestamp()
-        threads = []
-        queue = Queue()
-        for reminder_id in reminder_ids:
-            thread = UpdateThread(queue, reminder_id, target=self.update_completed, args=(app_id, reminder_id, completed, now, today, False))
-            threads.append(thread)
-            thread.start()
-
-        for thread in threads:
-            thread.join()
-
+        batch = []
+        repeats = []
         completed_ids = []
-        while not queue.empty():
-            value = queue.get()
-            if isinstance(value, Exception):
-                self.emit_error(value)
-            else:
-                completed_ids.append(value)
+        # nothing here waits on the server, the remote changes are sent in one batch per account below
+        for reminder_id in reminder_ids:
+            try:
+                self.update_completed(app_id, reminder_id, completed, now, today, False, batch, repeats)
+                completed_ids.append(reminder_id)
+            except Exception as error:
+                self.emit_error(error)
+
+        if len(repeats) > 0:
+            week_starts_sunday = self.app.settings.get_boolean('week-starts-sunday')
+            results = next_occurrences([get_rule(self.reminders[reminder_id]) for reminder_id in repeats], week_starts_sunday, self.clock)
+            for reminder_id, repeat in zip(repeats, results):
+                try:
+                    self._add_repeat(self.reminders[reminder_id], repeat)
+                except:
+                    pass
 
         if len(completed_ids) == 1:
             reminder_id = completed_ids[0]
@@ -1176,10 +1675,16 @@ class Reminders():
 
         self._save_reminders()
 
+        batches = {}
+        for reminder_id in batch:
+            batches.setdefault(self._reminder_user(reminder_id), []).append(reminder_id)
+        for user_id, reminder_ids in batches.items():
+            self._push(user_id, self._do_remote_update_completedv, reminder_ids)
+
         return GLib.Variant('(asuu)', (completed_ids, now, today))
 
-    def remove_reminder(self, app_id: str, reminder_id: str, save = True):
-        self.app.withdraw_notification(reminder_id)
+    def remove_reminder(self, app_id: str, reminder_id: str, save = True, batch = None):
+        self._withdraw_notification(reminder_id)
         self._remove_countdown(reminder_id)
 
         if reminder_id in self.reminders:
@@ -1187,7 +1692,10 @@ class Reminders():
             if user_id != 'local':
                 task_id = self.reminders[reminder_id]['uid']
                 task_list = self.lists[self.reminders[reminder_id]['list-id']]['uid']
-                GLib.idle_add(lambda *args: self._do_remote_remove_reminder(reminder_id, task_id, user_id, task_list))
+                if batch is not None:
+                    batch[reminder_id] = (task_id, user_id, task_list)
+                else:
+                    self._push(user_id, self._do_remote_remove_reminder, reminder_id, task_id, user_id, task_list)
             self.reminders.pop(reminder_id)
             if save:
                 self.do_emit('ReminderRemoved', GLib.Variant('(ss)', (app_id, reminder_id)))
@@ -1196,8 +1704,9 @@ class Reminders():
     def remove_reminderv(self, app_id: str, reminder_ids: list):
         threads = []
         queue = Queue()
+        batch = {}
         for reminder_id in reminder_ids:
-            thread = UpdateThread(queue, reminder_id, target=self.remove_reminder, args=(app_id, reminder_id, False))
+            thread = UpdateThread(queue, reminder_id, target=self.remove_reminder, args=(app_id, reminder_id, False, batch))
             threads.append(thread)
             thread.start()
 
@@ -1220,6 +1729,12 @@ class Reminders():
 
         self._save_reminders()
 
+        batches = {}
+        for reminder_id, value in batch.items():
+            batches.setdefault(value[1], {})[reminder_id] = value
+        for user_id, values in batches.items():
+            self._push(user_id, self._do_remote_remove_reminderv, values)
+
         return GLib.Variant('(as)', (removed_ids,))
 
     def create_reminder(self, app_id: str, **kwargs):
@@ -1267,7 +1782,7 @@ class Reminders():
                 # due date has to be the same day as the reminder date
                 reminder_dict['due-date'] = int(datetime.datetime(notif_date.year, notif_date.month, notif_date.day, tzinfo=datetime.timezone.utc).timestamp())
 
-        now = floor(time())
+        now = floor(self.clock.time())
         reminder_dict['created-timestamp'] = now
         reminder_dict['updated-timestamp'] = now
 
@@ -1276,11 +1791,12 @@ class Reminders():
         self._reminder_updated(app_id, reminder_id, reminder_dict)
         self._save_reminders()
 
-        GLib.idle_add(lambda *args: self._do_remote_create_reminder(reminder_id, location))
+        if user_id != 'local':
+            self._push(user_id, self._do_remote_create_reminder, reminder_id, location)
 
         return GLib.Variant('(su)', (reminder_id, now))
 
-    def update_reminder(self, app_id: str, now = None, save = True, **kwargs):
+    def update_reminder(self, app_id: str, now = None, save = True, batch = None, **kwargs):
         reminder_id = str(kwargs['id'])
 
         reminder_dict = self.reminders[reminder_id].copy()
@@ -1322,10 +1838,10 @@ class Reminders():
             reminder_dict['important'] = bool(kwargs['important'])
 
         if now is None:
-            now = floor(time())
+            now = floor(self.clock.time())
         reminder_dict['updated-timestamp'] = now
 
-        if reminder_dict['timestamp'] > floor(time()):
+        if reminder_dict['timestamp'] > floor(self.clock.time()):
             reminder_dict['shown'] = False
 
         if reminder_dict['timestamp'] != 0:
@@ -1355,19 +1871,28 @@ class Reminders():
             self._reminder_updated(app_id, reminder_id, reminder_dict)
             self._save_reminders()
 
-        GLib.idle_add(lambda *args: self._do_remote_update_reminder(reminder_id, location, old_user_id, old_list_uid, old_uid, updating, old_list_id, save))
+        if batch is not None:
+            batch[reminder_id] = (location, old_user_id, old_list_uid, old_uid, updating, old_list_id)
+        else:
+            # moving a reminder to a local list still has to remove it from the old account
+            pipeline_user_id = self.lists[reminder_dict['list-id']]['user-id']
+            if pipeline_user_id == 'local':
+                pipeline_user_id = old_user_id
+            if pipeline_user_id is not None:
+                self._push(pipeline_user_id, self._do_remote_update_reminder, reminder_id, location, old_user_id, old_list_uid, old_uid, updating, old_list_id)
 
         return GLib.Variant('(u)', (now,))
 
     def update_reminderv(self, app_id: str, reminders: list):
-        now = floor(time())
+        now = floor(self.clock.time())
 
         updated_ids = []
         if len(reminders) > 1:
             threads = []
             queue = Queue()
+            batch = {}
             for reminder in reminders:
-                thread = UpdateThread(queue, reminder['id'], target=self.update_reminder, args=(app_id, now, False), kwargs=reminder)
+                thread = UpdateThread(queue, reminder['id'], target=self.update_reminder, args=(app_id, now, False, batch), kwargs=reminder)
                 threads.append(thread)
                 thread.start()
 
@@ -1385,6 +1910,16 @@ class Reminders():
                 updated_reminders = self.get_reminders(ids=updated_ids, return_variant=False)
                 self.do_emit('RemindersUpdated', GLib.Variant('(saa{sv})', (app_id, updated_reminders)))
 
+            batches = {}
+            for reminder_id, value in batch.items():
+                user_id = self._reminder_user(reminder_id)
+                if user_id == 'local':
+                    user_id = value[1]
+                if user_id is not None:
+                    batches.setdefault(user_id, {})[reminder_id] = value
+            for user_id, items in batches.items():
+                self._push(user_id, self._do_remote_update_reminderv, items)
+
         elif len(reminders) == 1:
             reminder = reminders[0]
             self.update_reminder(app_id, now, **reminder)
@@ -1509,6 +2044,41 @@ class Reminders():
     def get_version(self):
         return GLib.Variant('(s)', (VERSION,))
 
+    def get_sync_stats(self):
+        stats = {
+            'duration': GLib.Variant('d', self.sync_stats.get('duration', 0.0)),
+            'ms-requests': GLib.Variant('u', self.sync_stats.get('ms-requests', 0)),
+            'ms-bytes': GLib.Variant('t', self.sync_stats.get('ms-bytes', 0)),
+            'ms-parse-time': GLib.Variant('d', self.sync_stats.get('ms-parse-time', 0.0)),
+            'caldav-requests': GLib.Variant('u', self.sync_stats.get('caldav-requests', 0)),
+            'caldav-bytes': GLib.Variant('t', self.sync_stats.get('caldav-bytes', 0)),
+            'lifetime-peak-memory': GLib.Variant('t', self.sync_stats.get('lifetime-peak-memory', 0))
+        }
+        return GLib.Variant('(a{sv})', (stats,))
+
+    def get_occurrences(self, start, end):
+        week_starts_sunday = self.app.settings.get_boolean('week-starts-sunday')
+        occurrences = []
+        for reminder_id, reminder in self.reminders.items():
+            if reminder['completed'] or (reminder['timestamp'] == 0 and reminder['due-date'] == 0):
+                continue
+            for timestamp in self._get_recurrence(reminder_id, week_starts_sunday).between(start, end):
+                occurrences.append((reminder_id, timestamp))
+
+        for reminder_id in [reminder_id for reminder_id in self.recurrences if reminder_id not in self.reminders]:
+            self.recurrences.pop(reminder_id)
+
+        occurrences.sort(key=lambda occurrence: occurrence[1])
+        return GLib.Variant('(a(su))', (occurrences,))
+
+    def get_next_due(self, count):
+        return GLib.Variant('(as)', (self.due_index.next_due(count),))
+
+    def get_past_due(self, offset, count):
+        # there can be a lot of them, so callers get the total and page through it
+        total, reminder_ids = self.due_index.past_due(offset, count)
+        return GLib.Variant('(uas)', (total, reminder_ids))
+
     def create_list(self, app_id, variant = True, **kwargs):
         list_name = str(kwargs['name'])
         user_id = str(kwargs['user-id'])
@@ -1520,13 +2090,14 @@ class Reminders():
                 if user_id not in self.synced_ids:
                     self.synced_ids.append(list_id)
                     self._set_synced_lists_no_refresh(self.synced_ids)
-                GLib.idle_add(lambda *args: self._do_remote_create_list(user_id, list_name, list_id))
 
             self.lists[list_id] = {
                 'name': list_name,
                 'user-id': user_id,
                 'uid': ''
             }
+            if user_id != 'local':
+                self._push(user_id, self._do_remote_create_list, user_id, list_name, list_id)
             self._save_lists()
             self._list_updated(app_id, list_id, list_name, user_id)
             if variant:
@@ -1544,7 +2115,7 @@ class Reminders():
             user_id = self.lists[list_id]['user-id']
             uid = self.lists[list_id]['uid']
             if user_id != 'local':
-                GLib.idle_add(lambda *args: self._do_remote_rename_list(user_id, list_id, new_name, uid))
+                self._push(user_id, self._do_remote_rename_list, user_id, list_id, new_name, uid)
 
             self.lists[list_id]['name'] = new_name
             self._save_lists()
@@ -1559,7 +2130,7 @@ class Reminders():
             if list_id == user_id:
                 raise Exception("Can't remove default list")
             if user_id != 'local':
-                GLib.idle_add(lambda *args: self._do_remote_delete_list(user_id, list_id, uid))
+                self._push(user_id, self._do_remote_delete_list, user_id, list_id, uid)
 
             self.lists.pop(list_id)
             self._save_lists()
@@ -1592,6 +2163,8 @@ class Reminders():
         else:
             raise KeyError('Invalid user id')
 
+        self._stop_pipeline(user_id)
+
         if user_id in self.synced_ids:
             self.synced_ids.remove(user_id)
             self._set_synced_lists_no_refresh(self.synced_ids)
@@ -1599,7 +2172,7 @@ class Reminders():
         GLib.idle_add(lambda *args: self.refresh())
 
     def refresh(self, notify_past = True):
-        if self.refreshing:
+        if self.refreshing or not self.accounts_loaded:
             return
 
         self.refreshing = True
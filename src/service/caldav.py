@@ -15,67 +15,188 @@
 
 import datetime
 
-from gi.repository import Secret
-
 from reminders import info
 from reminders.service.reminder import Reminder
 from logging import getLogger
 from json import loads, dumps
-from requests import HTTPError, Timeout, ConnectionError
-from caldav.davclient import DAVClient
-from caldav.elements.dav import DisplayName
-from caldav.objects import Todo
+from requests import HTTPError, Timeout, ConnectionError, Response
+from requests.structures import CaseInsensitiveDict
+from caldav.davclient import DAVClient, DAVResponse
+from caldav.elements.dav import DisplayName, GetEtag, Prop
+from caldav.elements.cdav import CalendarQuery, CalendarData, Filter, CompFilter
+from caldav.objects import Todo, Principal
+from caldav.lib.error import PutError, NotFoundError
+from threading import Thread, Lock, local
+from hashlib import blake2b
+from urllib.parse import urlsplit, quote
+from os import environ
 
 DAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+
+# same as ms_to_do.py, every CalDAV response is written to REMINDERS_RECORD_DIR if it is set,
+# and REMINDERS_REPLAY_DIR answers requests with responses recorded earlier instead of going to the network
+RECORD_DIR = environ.get('REMINDERS_RECORD_DIR', None)
+REPLAY_DIR = environ.get('REMINDERS_REPLAY_DIR', None)
+# the only response headers that are recorded
+RECORD_HEADERS = ('Content-Type', 'ETag')
+
 logger = getLogger(info.service_executable)
 
+class Client(DAVClient):
+    '''DAVClient that records its responses, or answers from a recording, when that is turned on'''
+    def __init__(self, caldav, user_id, user):
+        super().__init__(user['url'], None, user['username'], user['password'], timeout=5)
+        self.caldav = caldav
+        self.user_id = user_id
+        self.user = user
+
+    def request(self, url, method = 'GET', body = '', headers = {}):
+        if REPLAY_DIR is not None:
+            response = self.caldav._replay_request(url, method, body)
+        else:
+            response = super().request(url, method, body, headers)
+        # a request that had to authenticate comes back through here, it is only counted once
+        if not getattr(response, 'counted', False):
+            response.counted = True
+            self.caldav._count(response)
+            if RECORD_DIR is not None:
+                self.caldav._record(self, url, method, body, response)
+        return response
+
 class CalDAV():
     def __init__(self, reminders):
         self.users = {}
         self.principals = {}
+        # {user_id: {calendar_id: Calendar}}
+        self.calendars = {}
+        # {user_id: {task_id: (calendar_id, Todo)}}, this is refreshed every sync so that objects can be addressed by their url
+        self.todos = {}
+        # {user_id: {url: (etag, task_id)}}, so unchanged objects don't have to be parsed to find their uid
+        self.fingerprints = {}
         self.reminders = reminders
-        self.schema = reminders.schema
+        self.credentials = reminders.credentials
+        self.record_lock = Lock()
+        self.replay = None
+        # {user_id: index} of the placeholders that replace the accounts in recordings
+        self.placeholders = {}
+        # the account pipelines send requests while a sync is running, only the ones made by the sync are counted
+        self.stats_lock = Lock()
+        self.counting = local()
+        self.reset_stats()
+
+    def load_accounts(self):
+        # called once the credentials are read
         self.load_users()
-        try:
-            self.get_principals()
-        except:
-            pass
+
+        # accounts that have been discovered before don't need the network here, the rest are discovered when first used
+        for user_id in self.users.keys():
+            try:
+                self.restore_principal(user_id)
+            except Exception as error:
+                logger.exception(error)
+
+    def restore_principal(self, user_id):
+        user = self.users[user_id]
+        if 'principal-url' not in user.keys() or 'calendar-home-url' not in user.keys():
+            return
+
+        client = Client(self, user_id, user)
+        principal = Principal(client, user['principal-url'])
+        principal.calendar_home_set = user['calendar-home-url']
+        self.principals[user_id] = principal
+
+    def discover_principal(self, user_id, user):
+        client = Client(self, user_id, user)
+        principal = client.principal()
+        user['principal-url'] = str(principal.url)
+        user['calendar-home-url'] = str(principal.calendar_home_set.url)
+        return principal
 
     def get_principals(self):
+        # discovers every account that doesn't have a principal yet, all at once
         logout = []
-        for user_id in self.users.keys():
-            url = self.users[user_id]['url']
-            username = self.users[user_id]['username']
-            password = self.users[user_id]['password']
+        errors = []
+        threads = []
+
+        def discover(user_id):
             try:
-                self.principals[user_id] = DAVClient(url, None, username, password, timeout=5).principal()
+                self.principals[user_id] = self.discover_principal(user_id, self.users[user_id])
             except (ConnectionError, Timeout) as error:
-                raise error
+                errors.append(error)
             except:
                 logout.append(user_id)
 
+        for user_id in self.users.keys():
+            if user_id not in self.principals.keys():
+                thread = Thread(target=discover, args=(user_id,))
+                thread.start()
+                threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        if len(threads) > len(logout) + len(errors):
+            self.store()
+
         for user_id in logout:
             self.reminders.logout(user_id)
 
+        if len(errors) > 0:
+            raise errors[0]
+
+    def rediscover(self, user_id):
+        # the cached urls stopped working, so they probably moved
+        self.forget_user(user_id)
+        self.principals.pop(user_id, None)
+        for key in ('principal-url', 'calendar-home-url'):
+            self.users[user_id].pop(key, None)
+        self.principals[user_id] = self.discover_principal(user_id, self.users[user_id])
+        self.store()
+
+    def get_calendar(self, user_id, calendar_id):
+        calendars = self.calendars.setdefault(user_id, {})
+        if calendar_id not in calendars:
+            calendars[calendar_id] = self.principals[user_id].calendar(cal_id=calendar_id)
+        return calendars[calendar_id]
+
+    def get_todo(self, user_id, calendar_id, task_id, cached = True):
+        todos = self.todos.setdefault(user_id, {})
+        if cached and task_id in todos and todos[task_id][0] == calendar_id:
+            return todos[task_id][1]
+
+        todo = self.get_calendar(user_id, calendar_id).object_by_uid(task_id, comp_class=Todo)
+        todos[task_id] = (calendar_id, todo)
+        return todo
+
+    def get_todos(self, calendar):
+        # same as calendar.todos(include_completed=True), but the etags are fetched as well so changes can be sent with If-Match
+        query = CalendarQuery() + [Prop() + [GetEtag(), CalendarData()], Filter() + (CompFilter('VCALENDAR') + CompFilter('VTODO'))]
+        response, todos = calendar._request_report_build_resultlist(query, Todo, props=[GetEtag()])
+        return todos
+
+    def forget_todo(self, user_id, task_id):
+        if user_id in self.todos:
+            self.todos[user_id].pop(task_id, None)
+
+    def forget_user(self, user_id):
+        self.calendars.pop(user_id, None)
+        self.todos.pop(user_id, None)
+        self.fingerprints.pop(user_id, None)
+
     def store(self):
-        if len(self.users.keys()) > 0:
-            Secret.password_store_sync(
-                self.schema,
-                { 'name': 'caldav' },
-                None,
-                'users',
-                dumps(self.users),
-                None
-            )
+        if REPLAY_DIR is None and len(self.users.keys()) > 0:
+            self.credentials.store('caldav', 'users', dumps(self.users))
 
     def load_users(self):
+        if REPLAY_DIR is not None:
+            # a replay never touches the secret service, the accounts come from the recording
+            with open(f'{REPLAY_DIR}/caldav_users.json', 'r') as recording:
+                self.users = loads(recording.read())
+            return
+
         try:
-            self.users = loads(Secret.password_lookup_sync(
-                self.schema,
-                { 'name': 'caldav' },
-                None
-            ))
-            for i, value in self.users.items():
+            self.users = loads(self.credentials.lookup('caldav'))
+            for i, value in self.users.copy().items():
                 for key in ('name', 'url', 'username', 'password'):
                     if key not in value.keys():
                         self.users.pop(i)
@@ -83,24 +204,123 @@ class CalDAV():
         except:
             self.users = {}
 
+    def reset_stats(self):
+        # same as ms_to_do.py, requests from this thread are counted until end_stats
+        stats = {
+            'requests': 0,
+            'bytes': 0
+        }
+        with self.stats_lock:
+            self.stats = stats
+        self.counting.stats = stats
+
+    def end_stats(self):
+        self.counting.stats = None
+
+    def _count(self, response):
+        stats = getattr(self.counting, 'stats', None)
+        if stats is not None:
+            with self.stats_lock:
+                stats['requests'] += 1
+                stats['bytes'] += len(response.raw)
+
+    def _placeholder(self, user_id):
+        # an account keeps the same placeholder for the whole recording
+        with self.record_lock:
+            index = self.placeholders.setdefault(user_id, len(self.placeholders))
+        return f'https://caldav{index}.example.com', f'user{index}'
+
+    def _scrub(self, client, text):
+        # the server and the username are replaced, the password is only ever sent in headers which aren't recorded
+        origin, username = self._placeholder(client.user_id)
+        url = urlsplit(client.user['url'])
+        text = text.replace(f'{url.scheme}://{url.hostname}' + (f':{url.port}' if url.port else ''), origin)
+        if client.user['username']:
+            text = text.replace(quote(client.user['username']), username).replace(client.user['username'], username)
+        return text
+
+    def _body_hash(self, body, client = None):
+        if body is None:
+            body = ''
+        elif isinstance(body, bytes):
+            body = body.decode()
+        if client is not None:
+            body = self._scrub(client, body)
+        return blake2b(body.encode(), digest_size=16).hexdigest()
+
+    def _record(self, client, url, method, body, response):
+        raw = response.raw
+        record = {
+            'method': method,
+            'url': self._scrub(client, urlsplit(str(url)).path),
+            'body-hash': self._body_hash(body, client),
+            'status': response.status,
+            'headers': {key: response.headers[key] for key in RECORD_HEADERS if key in response.headers},
+            'body': self._scrub(client, raw.decode() if isinstance(raw, bytes) else raw)
+        }
+        with self.record_lock:
+            with open(f'{RECORD_DIR}/caldav.jsonl', 'a') as recording:
+                recording.write(dumps(record) + '\n')
+
+    def _record_users(self):
+        users = {}
+        for user_id, value in self.users.items():
+            origin, username = self._placeholder(user_id)
+            users[user_id] = {
+                'name': username,
+                'url': origin + urlsplit(value['url']).path,
+                'username': username if value['username'] else None,
+                'password': None
+            }
+            for key in ('principal-url', 'calendar-home-url'):
+                if key in value:
+                    users[user_id][key] = origin + urlsplit(value[key]).path
+        with open(f'{RECORD_DIR}/caldav_users.json', 'w') as recording:
+            recording.write(dumps(users))
+
+    def _replay_request(self, url, method, body):
+        with self.record_lock:
+            if self.replay is None:
+                # {(method, path, body hash): [record]}, requests that were made more than once are answered in the same order
+                self.replay = {}
+                with open(f'{REPLAY_DIR}/caldav.jsonl', 'r') as recording:
+                    for line in recording:
+                        record = loads(line)
+                        self.replay.setdefault((record['method'], record['url'], record['body-hash']), []).append(record)
+
+            records = self.replay.get((method, urlsplit(str(url)).path, self._body_hash(body)), [])
+            if len(records) == 0:
+                raise ConnectionError(f'No recorded response for {method} {url}')
+            record = records.pop(0) if len(records) > 1 else records[0]
+
+        response = Response()
+        response.status_code = record['status']
+        response.headers = CaseInsensitiveDict(record['headers'])
+        response._content = record['body'].encode()
+        response.url = str(url)
+        response.reason = ''
+        return DAVResponse(response)
+
     def login(self, name, url, username, password):
         user_id = self.reminders._do_generate_id()
         if username == '':
             username = None
         if password == '':
             password = None
-        self.principals[user_id] = DAVClient(url, None, username, password).principal()
-        self.users[user_id] = {
+        user = {
             'name': name,
             'url': url,
             'username': username,
             'password': password
         }
+        self.principals[user_id] = self.discover_principal(user_id, user)
+        self.users[user_id] = user
         self.store()
         return user_id
 
     def logout(self, user_id):
         self.users.pop(user_id)
+        self.forget_user(user_id)
         try:
             self.principals[user_id].client.close()
             self.principals.pop(user_id)
@@ -108,12 +328,7 @@ class CalDAV():
             pass
 
         if self.users == {}:
-            Secret.password_clear(
-                self.schema,
-                { 'name': 'caldav' },
-                None,
-                None
-            )
+            self.credentials.clear('caldav')
         else:
             self.store()
 
@@ -123,9 +338,10 @@ class CalDAV():
 
         if user_id in self.principals:
             try:
-                calendar = self.principals[user_id].calendar(cal_id=task_list)
+                calendar = self.get_calendar(user_id, task_list)
                 todo = calendar.save_todo(**task)
                 task_id = todo.icalendar_component.get('UID', None)
+                self.todos.setdefault(user_id, {})[task_id] = (task_list, todo)
                 return task_id
             except HTTPError as error:
                 if error.response.status_code == 503:
@@ -141,21 +357,24 @@ class CalDAV():
         else:
             raise ConnectionError
 
-    def update_task(self, user_id, task_list, task_id, task):
+    def update_task(self, user_id, task_list, task_id, task, merge = None):
+        # if the task changed on the server since it was fetched, merge is called with the new copy and returns the task to send instead
         if user_id not in self.principals:
             self.get_principals()
 
         if user_id in self.principals:
             try:
-                calendar = self.principals[user_id].calendar(cal_id=task_list)
-                todo = calendar.object_by_uid(task_id, comp_class=Todo)
-
-                i = todo.icalendar_component
-                for key, value in task.items():
-                    i.pop(key, None)
-                    if value is not None:
-                        i.add(key, value)
-                todo.save()
+                try:
+                    self._update_todo(self.get_todo(user_id, task_list, task_id), task)
+                except NotFoundError:
+                    # the cached object is out of date, look it up again
+                    self._update_todo(self.get_todo(user_id, task_list, task_id, False), task)
+                except PutError as error:
+                    # sending the task as is would overwrite whatever was changed on the server
+                    if merge is None:
+                        raise error
+                    todo = self.get_todo(user_id, task_list, task_id, False)
+                    self._update_todo(todo, merge(todo))
             except HTTPError as error:
                 if error.response.status_code == 503:
                     raise error
@@ -170,13 +389,37 @@ class CalDAV():
         else:
             raise ConnectionError
 
+    def _update_todo(self, todo, task):
+        i = todo.icalendar_component
+        for key, value in task.items():
+            i.pop(key, None)
+            if value is not None:
+                i.add(key, value)
+        self._save(todo)
+
+    def _save(self, todo):
+        # same as Todo.save(), but the server rejects the change if the object was modified since it was fetched
+        headers = {'Content-Type': 'text/calendar; charset="utf-8"'}
+        etag = todo.props.get('{DAV:}getetag', None)
+        if etag:
+            headers['If-Match'] = etag
+        response = todo.client.put(str(todo.url), todo.data.encode('utf-8'), headers)
+        if response.status not in (201, 204):
+            raise PutError(f'{response.status} {response.reason}')
+        # keep the object usable for the next change without having to fetch it again
+        etag = response.headers.get('ETag', None)
+        if etag:
+            todo.props['{DAV:}getetag'] = etag
+        else:
+            todo.props.pop('{DAV:}getetag', None)
+
     def complete_recurring(self, todo, completion_timestamp):
         # from https://github.com/python-caldav/caldav/blob/v1.2.1/caldav/objects.py#L2492
-        if not todo._reduce_count():
-            return todo.complete(handle_rrule=False)
+        if not todo._reduce_count() or not todo._next(completion_timestamp):
+            todo._complete_ical(completion_timestamp=completion_timestamp)
+            self._save(todo)
+            return None
         next_dtstart = todo._next(completion_timestamp)
-        if not next_dtstart:
-            return todo.complete(handle_rrule=False)
 
         completed = todo.copy()
         completed.url = todo.parent.url.join(completed.id + ".ics")
@@ -189,26 +432,42 @@ class CalDAV():
         i.add("DTSTART", next_dtstart)
         todo.set_duration(duration, movable_attr="DUE")
 
-        todo.save()
+        self._save(todo)
 
         return completed.icalendar_component.get('UID', None)
 
+    def _complete_todo(self, todo, now):
+        rrule = todo.icalendar_component.get('RRULE', None)
+        if rrule is not None:
+            return self.complete_recurring(todo, now)
+        todo._complete_ical(completion_timestamp=now)
+        self._save(todo)
+        return None
+
+    def _uncomplete_todo(self, todo):
+        i = todo.icalendar_component
+        i.pop('STATUS', None)
+        i.add('STATUS', 'NEEDS-ACTION')
+        i.pop('COMPLETED', None)
+        self._save(todo)
+
     def complete_task(self, user_id, task_list, task_id, completed_timestamp):
         if user_id not in self.principals:
             self.get_principals()
 
         if user_id in self.principals:
             try:
-                calendar = self.principals[user_id].calendar(cal_id=task_list)
                 now = datetime.datetime.fromtimestamp(completed_timestamp, tz=datetime.timezone.utc)
-                todo = calendar.object_by_uid(task_id, comp_class=Todo)
-
-                new_id = None
-                rrule = todo.icalendar_component.get('RRULE', None)
-                if rrule is not None:
-                    new_id = self.complete_recurring(todo, now)
-                else:
-                    todo.complete(handle_rrule=False)
+                try:
+                    todo = self.get_todo(user_id, task_list, task_id)
+                    if todo.icalendar_component.get('RRULE', None) is not None:
+                        # the next occurrence is worked out from DTSTART and a copy is saved before the todo itself,
+                        # so this can't wait for the server to reject an out of date object
+                        todo = self.get_todo(user_id, task_list, task_id, False)
+                    new_id = self._complete_todo(todo, now)
+                except (PutError, NotFoundError):
+                    todo = self.get_todo(user_id, task_list, task_id, False)
+                    new_id = self._complete_todo(todo, now)
                 return new_id, todo.icalendar_component
             except HTTPError as error:
                 if error.response.status_code == 503:
@@ -230,9 +489,10 @@ class CalDAV():
 
         if user_id in self.principals:
             try:
-                calendar = self.principals[user_id].calendar(cal_id=task_list)
-                todo = calendar.object_by_uid(task_id, comp_class=Todo)
-                todo.uncomplete()
+                try:
+                    self._uncomplete_todo(self.get_todo(user_id, task_list, task_id))
+                except (PutError, NotFoundError):
+                    self._uncomplete_todo(self.get_todo(user_id, task_list, task_id, False))
             except HTTPError as error:
                 if error.response.status_code == 503:
                     raise error
@@ -253,9 +513,9 @@ class CalDAV():
 
         if user_id in self.principals:
             try:
-                calendar = self.principals[user_id].calendar(cal_id=task_list)
-                todo = calendar.object_by_uid(task_id, comp_class=Todo)
-                todo.delete()
+                # deleting by url doesn't need the object to be up to date
+                self.get_todo(user_id, task_list, task_id).delete()
+                self.forget_todo(user_id, task_id)
             except HTTPError as error:
                 if error.response.status_code == 503:
                     raise error
@@ -277,6 +537,7 @@ class CalDAV():
         if user_id in self.principals:
             try:
                 calendar = self.principals[user_id].make_calendar(name=list_name, supported_calendar_component_set=['VTODO'])
+                self.calendars.setdefault(user_id, {})[calendar.id] = calendar
                 return calendar.id
             except HTTPError as error:
                 if error.response.status_code == 503:
@@ -298,7 +559,7 @@ class CalDAV():
 
         if user_id in self.principals:
             try:
-                calendar = self.principals[user_id].calendar(cal_id=calendar_id)
+                calendar = self.get_calendar(user_id, calendar_id)
                 calendar.set_properties([DisplayName(list_name)])
                 calendar.save()
             except HTTPError as error:
@@ -321,8 +582,9 @@ class CalDAV():
 
         if user_id in self.principals:
             try:
-                calendar = self.principals[user_id].calendar(cal_id=calendar_id)
+                calendar = self.get_calendar(user_id, calendar_id)
                 calendar.delete()
+                self.calendars[user_id].pop(calendar_id, None)
             except HTTPError as error:
                 if error.response.status_code == 503:
                     raise error
@@ -340,6 +602,7 @@ class CalDAV():
     def get_lists(self, removed_list_ids, old_lists, synced_ids):
         task_lists = {}
         not_synced = []
+        self.reset_stats()
 
         try:
             if self.users.keys() != self.principals.keys():
@@ -347,13 +610,26 @@ class CalDAV():
         except:
             pass
 
+        if RECORD_DIR is not None:
+            self._record_users()
+
         for user_id in self.users.keys():
             if user_id not in self.principals.keys():
                 not_synced.append(user_id)
                 continue
             try:
                 task_lists[user_id] = []
-                for calendar in self.principals[user_id].calendars():
+                calendars = {}
+                todos = {}
+                old_fingerprints = self.fingerprints.get(user_id, {})
+                fingerprints = {}
+                try:
+                    remote_calendars = self.principals[user_id].calendars()
+                except NotFoundError:
+                    self.rediscover(user_id)
+                    remote_calendars = self.principals[user_id].calendars()
+
+                for calendar in remote_calendars:
                     if 'VTODO' not in calendar.get_supported_components():
                         continue
                     list_uid = calendar.url.strip('/').rsplit('/', 1)[-1]
@@ -372,10 +648,21 @@ class CalDAV():
                     if list_id is None:
                         list_id = self.reminders._do_generate_id()
 
-                    if user_id not in synced_ids and list_id not in synced_ids:
-                        tasks = []
-                    else:
-                        tasks = calendar.todos(include_completed=True)
+                    calendars[list_uid] = calendar
+
+                    tasks = []
+                    if user_id in synced_ids or list_id in synced_ids:
+                        for todo in self.get_todos(calendar):
+                            url = str(todo.url)
+                            # the data is only hashed if the server didn't send an etag
+                            etag = self.get_etag(todo)
+                            if url in old_fingerprints and old_fingerprints[url][0] == etag:
+                                task_id = old_fingerprints[url][1]
+                            else:
+                                task_id = todo.icalendar_component.get('UID', None)
+                            fingerprints[url] = (etag, task_id)
+                            todos[task_id] = (list_uid, todo)
+                            tasks.append((task_id, etag, todo))
 
                     task_lists[user_id].append({
                         'id': list_id,
@@ -383,6 +670,10 @@ class CalDAV():
                         'name': calendar.get_display_name(),
                         'tasks': tasks
                     })
+
+                self.calendars[user_id] = calendars
+                self.todos[user_id] = todos
+                self.fingerprints[user_id] = fingerprints
             except HTTPError as error:
                 if error.response.status_code == 503:
                     not_synced.append(user_id)
@@ -477,6 +768,18 @@ class CalDAV():
 
         return task
 
+    def get_fingerprint(self, task):
+        # hash of the raw iCalendar data, this changes whenever anything in the task does
+        return blake2b(task.data.encode(), digest_size=16).hexdigest()
+
+    def get_etag(self, task):
+        props = getattr(task, 'props', None) or {}
+        etag = props.get('{DAV:}getetag', None)
+        if etag:
+            return etag
+        # not every server returns etags with calendar-data
+        return self.get_fingerprint(task)
+
     def task_to_reminder(self, ical_todo, list_id, reminder = None, timestamp = None, due_date = None):
         if reminder is None:
             reminder = Reminder()
@@ -552,11 +855,12 @@ class CalDAV():
             except:
                 pass
 
+            # every part of a parsed rule is a list
             count = rrule.get('COUNT', None)
-            reminder['repeat-times'] = count if count is not None else -1
+            reminder['repeat-times'] = count[0] if count is not None else -1
 
             interval = rrule.get('INTERVAL', None)
-            reminder['repeat-frequency'] = interval if interval is not None else 1
+            reminder['repeat-frequency'] = interval[0] if interval is not None else 1
 
             days = rrule.get('BYDAY', None)
             if days is not None:
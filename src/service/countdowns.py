@@ -13,18 +13,46 @@
 # You should have received a copy of the GNU General Public License along with
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from gi.repository import GLib, Gio
+from gi.repository import Gio
 
 from reminders import info
-from time import time
+from reminders.clock import get_clock
+from math import ceil
+from heapq import heappush, heappop, heapify
+from itertools import count
+from threading import Lock
 from logging import getLogger
 
 logger = getLogger(info.service_executable)
 
+# only deadlines within this many seconds are kept in the armed heap, the rest wait for a sweep to admit them
+HORIZON = 24 * 60 * 60
+# how often the far away deadlines are swept, this is also the longest the timeout is ever armed for
+SWEEP_INTERVAL = 60 * 60
+
 class Countdowns():
     '''Handles timeouts for notifications'''
-    def __init__(self):
+    def __init__(self, clock = None):
+        self.clock = clock if clock is not None else get_clock()
+        # {countdown_id: {'timestamp': float, 'callback': callable, 'sequence': int, 'interval': int (only for timeouts)}}
         self.dict = {}
+        # min-heap of (timestamp, sequence, countdown_id) within the horizon,
+        # replaced or removed countdowns stay in it until they reach the head
+        self.heap = []
+        # same as heap, for deadlines past the horizon
+        self.later = []
+        self.horizon = self.clock.time() + HORIZON
+        self.next_sweep = self.clock.time() + SWEEP_INTERVAL
+        self.sequence = count()
+        # ids of the countdowns that repeat on an interval
+        self.intervals = set()
+        # callable(start, end) returning [(timestamp, callback, countdown_id)] for deadlines in (start, end],
+        # so deadlines that are far away don't need to be added until a sweep gets close to them
+        self.pending = None
+        # the only GLib timeout, armed for the earliest deadline
+        self.source = 0
+        self.armed = None
+        self.lock = Lock()
 
         self.connection = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
         self.connection.signal_subscribe(
@@ -42,57 +70,133 @@ class Countdowns():
         if parameters.unpack()[0]:
             return
 
-        for reminder_id in self.dict.copy().keys():
-            self._start(reminder_id, resuming=True)
+        with self.lock:
+            # wait 30 seconds after waking from suspend, this hopefully will give enough time for internet to reconnect
+            for countdown_id in self.intervals:
+                self._push(countdown_id, self.dict[countdown_id], self.clock.time() + 30)
+            self._sweep()
+            self._compact()
+            self._disarm()
+
+        # everything that was due while suspended is at the front of the heap and fires together,
+        # the countdowns that are still in the future are left alone
+        self._fire()
 
-    def remove_countdown(self, reminder_id):
-        if reminder_id in self.dict.keys():
-            countdown_id = self.dict[reminder_id]['id']
-            if countdown_id != 0:
-                GLib.Source.remove(countdown_id)
-            self.dict.pop(reminder_id)
+    def remove_countdown(self, countdown_id):
+        with self.lock:
+            self.intervals.discard(countdown_id)
+            if self.dict.pop(countdown_id, None) is not None:
+                self._compact()
+                self._arm()
 
     def add_timeout(self, interval, callback, timeout_id):
-        if timeout_id in self.dict.keys() and self.dict[timeout_id]['id'] != 0:
-            GLib.Source.remove(self.dict[timeout_id]['id'])
-
-        dictionary = {
-            'interval': interval,
-            'callback': callback,
-            'id': 0
-        }
-        self.dict[timeout_id] = dictionary
-        self._start(timeout_id)
-
-    def add_countdown(self, timestamp, callback, reminder_id):
-        if reminder_id in self.dict.keys() and self.dict[reminder_id]['id'] != 0:
-            GLib.Source.remove(self.dict[reminder_id]['id'])
-
-        dictionary = {
-            'timestamp': timestamp,
-            'callback': callback,
-            'id': 0
-        }
-        self.dict[reminder_id] = dictionary
-        self._start(reminder_id)
-
-    def _start(self, reminder_id, resuming = False):
-        dictionary = self.dict[reminder_id]
-        if dictionary['id'] != 0:
-            GLib.Source.remove(dictionary['id'])
-            dictionary['id'] = 0
-
-        if 'interval' in dictionary.keys():
-            # wait 30 seconds after waking from suspend, this hopefully will give enough time for internet to reconnect
-            wait = 30000 if resuming else dictionary['interval'] * 60000
+        with self.lock:
+            countdown = {
+                'interval': interval,
+                'callback': callback
+            }
+            self._push(timeout_id, countdown, self.clock.time() + interval * 60)
+            self.intervals.add(timeout_id)
+            self._compact()
+            self._arm()
+
+    def add_countdown(self, timestamp, callback, countdown_id):
+        with self.lock:
+            countdown = {
+                'callback': callback
+            }
+            self._push(countdown_id, countdown, timestamp)
+            self.intervals.discard(countdown_id)
+            self._compact()
+            self._arm()
+
+    def _push(self, countdown_id, countdown, timestamp):
+        # anything already in the heap for this id is left behind and skipped
+        countdown['timestamp'] = timestamp
+        countdown['sequence'] = next(self.sequence)
+        self.dict[countdown_id] = countdown
+        if timestamp <= self.horizon:
+            heappush(self.heap, (timestamp, countdown['sequence'], countdown_id))
         else:
-            now = time()
-            wait = int(1000 * (dictionary['timestamp'] - now))
+            heappush(self.later, (timestamp, countdown['sequence'], countdown_id))
+
+    def _sweep(self):
+        # moves everything that is due within the horizon into the armed heap
+        now = self.clock.time()
+        start = self.horizon
+        self.horizon = now + HORIZON
+        self.next_sweep = now + SWEEP_INTERVAL
+        while len(self.later) > 0 and self.later[0][0] <= self.horizon:
+            entry = heappop(self.later)
+            if self._is_current(entry):
+                heappush(self.heap, entry)
+        if self.pending is not None and self.horizon > start:
+            for timestamp, callback, countdown_id in self.pending(start, self.horizon):
+                # anything that was added since then already has its countdown
+                if countdown_id not in self.dict:
+                    self._push(countdown_id, {'callback': callback}, timestamp)
+
+    def _is_current(self, entry):
+        timestamp, sequence, countdown_id = entry
+        return countdown_id in self.dict and self.dict[countdown_id]['sequence'] == sequence
+
+    def _compact(self):
+        # keeps the heap from filling up with countdowns that were replaced or removed
+        if len(self.heap) + len(self.later) > 2 * len(self.dict) + 64:
+            self.heap = [entry for entry in self.heap if self._is_current(entry)]
+            heapify(self.heap)
+            self.later = [entry for entry in self.later if self._is_current(entry)]
+            heapify(self.later)
+
+    def _disarm(self):
+        if self.source != 0:
+            self.clock.source_remove(self.source)
+            self.source = 0
+            self.armed = None
 
-        if wait > 0:
+    def _arm(self):
+        while len(self.heap) > 0 and not self._is_current(self.heap[0]):
+            heappop(self.heap)
+
+        if len(self.heap) == 0 and len(self.later) == 0 and self.pending is None:
+            self._disarm()
+            return
+
+        timestamp = self.next_sweep
+        if len(self.heap) > 0 and self.heap[0][0] < timestamp:
+            timestamp = self.heap[0][0]
+        if self.source != 0 and self.armed == timestamp:
+            return
+
+        self._disarm()
+        wait = max(timestamp - self.clock.time(), 0)
+        try:
+            self.source = self.clock.timeout_add(ceil(wait * 1000), self._fire)
+            self.armed = timestamp
+        except Exception as error:
+            logger.exception(f'{error}: Failed to set timeout')
+
+    def _fire(self):
+        due = []
+        with self.lock:
+            self.source = 0
+            self.armed = None
+            now = self.clock.time()
+            if now >= self.next_sweep:
+                self._sweep()
+            while len(self.heap) > 0 and self.heap[0][0] <= now:
+                entry = heappop(self.heap)
+                if self._is_current(entry):
+                    self.intervals.discard(entry[2])
+                    due.append((entry[2], self.dict.pop(entry[2])))
+
+        # callbacks can add countdowns again, so they run without the lock
+        for countdown_id, countdown in due:
             try:
-                self.dict[reminder_id]['id'] = GLib.timeout_add(wait, dictionary['callback'])
+                countdown['callback']()
             except Exception as error:
-                logger.exception(f'{error}: Failed to set timeout for {reminder_id}')
-        else:
-            dictionary['callback']()
+                logger.exception(f'{error}: Countdown for {countdown_id} failed')
+
+        with self.lock:
+            self._arm()
+        return False
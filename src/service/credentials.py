@@ -0,0 +1,124 @@
+# credentials.py
+# Copyright (C) 2023 Sasha Hale <dgsasha04@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of  MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from gi.repository import GLib, Secret
+
+from reminders import info
+from logging import getLogger
+from threading import Lock
+from atexit import register as atexit_register
+
+logger = getLogger(info.service_executable)
+
+class Credentials():
+    '''Write-behind cache in front of the secret service'''
+    def __init__(self, schema):
+        self.schema = schema
+        # {name: value} as last read or written, None if it was cleared
+        self.values = {}
+        # {name: (label, value)} waiting to be written, a value of None clears the secret
+        self.pending = {}
+        # names that have a write in flight
+        self.writing = set()
+        self.lock = Lock()
+        atexit_register(self.flush)
+
+    def load(self, names, callback):
+        # reads the secrets without blocking, callback runs on the main loop once they are all cached
+        remaining = set(names)
+        for name in names:
+            Secret.password_lookup(self.schema, { 'name': name }, None, self._looked_up, (name, remaining, callback))
+
+    def _looked_up(self, source, result, data):
+        name, remaining, callback = data
+        try:
+            value = Secret.password_lookup_finish(result)
+        except Exception as error:
+            logger.exception(f'{error}: Failed to read {name} from the secret service')
+            value = None
+
+        with self.lock:
+            # anything written since the lookup started is newer
+            if name not in self.values:
+                self.values[name] = value
+
+        remaining.discard(name)
+        if len(remaining) == 0:
+            callback()
+
+    def lookup(self, name):
+        # secrets are only read once by load, after that the cached value is used
+        with self.lock:
+            return self.values.get(name, None)
+
+    def store(self, name, label, value):
+        self._queue(name, label, value)
+
+    def clear(self, name):
+        self._queue(name, None, None)
+
+    def _queue(self, name, label, value):
+        with self.lock:
+            if name in self.values and self.values[name] == value and name not in self.pending:
+                return
+            self.values[name] = value
+            self.pending[name] = (label, value)
+            if name in self.writing:
+                # this gets written once the current write finishes
+                return
+            self.writing.add(name)
+
+        # can be called from any thread, the async calls have to be started from the main loop
+        GLib.idle_add(self._write, name)
+
+    def _write(self, name):
+        with self.lock:
+            if name not in self.pending:
+                self.writing.discard(name)
+                return False
+            label, value = self.pending.pop(name)
+
+        if value is None:
+            Secret.password_clear(self.schema, { 'name': name }, None, self._written, (name, False))
+        else:
+            Secret.password_store(self.schema, { 'name': name }, None, label, value, None, self._written, (name, True))
+        return False
+
+    def _written(self, source, result, data):
+        name, storing = data
+        try:
+            if storing:
+                Secret.password_store_finish(result)
+            else:
+                Secret.password_clear_finish(result)
+        except Exception as error:
+            logger.exception(f'{error}: Failed to write {name} to the secret service')
+
+        self._write(name)
+
+    def flush(self):
+        # the main loop isn't running anymore at exit, so anything left is written synchronously
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+
+        for name, (label, value) in pending.items():
+            try:
+                if value is None:
+                    Secret.password_clear_sync(self.schema, { 'name': name }, None)
+                else:
+                    Secret.password_store_sync(self.schema, { 'name': name }, None, label, value, None)
+            except Exception as error:
+                logger.exception(f'{error}: Failed to write {name} to the secret service')
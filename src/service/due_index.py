@@ -0,0 +1,109 @@
+# due_index.py
+# Copyright (C) 2023 Sasha Hale <dgsasha04@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of  MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+from bisect import bisect_left, insort
+from heapq import merge
+from itertools import islice
+from math import floor
+from threading import RLock
+from reminders.clock import get_clock
+
+class DueIndex():
+    '''Incomplete reminders sorted by when they are due'''
+    def __init__(self, clock = None):
+        self.clock = clock if clock is not None else get_clock()
+        # sorted lists of (timestamp, reminder_id) and (due_date, reminder_id)
+        self.timestamps = []
+        self.due_dates = []
+        # {reminder_id: (whether it is in timestamps, key)}
+        self.keys = {}
+        # reminders are completed and removed from several threads at once
+        self.lock = RLock()
+
+    def _key(self, reminder_id, reminder):
+        if reminder['completed']:
+            return None, None
+        if reminder['timestamp'] != 0:
+            return self.timestamps, (reminder['timestamp'], reminder_id)
+        if reminder['due-date'] != 0:
+            return self.due_dates, (reminder['due-date'], reminder_id)
+        return None, None
+
+    def rebuild(self, reminders):
+        timestamps = []
+        due_dates = []
+        keys = {}
+        for reminder_id, reminder in list(reminders.items()):
+            index, key = self._key(reminder_id, reminder)
+            if index is not None:
+                is_timestamp = index is self.timestamps
+                (timestamps if is_timestamp else due_dates).append(key)
+                keys[reminder_id] = (is_timestamp, key)
+        timestamps.sort()
+        due_dates.sort()
+        with self.lock:
+            self.timestamps = timestamps
+            self.due_dates = due_dates
+            self.keys = keys
+
+    def update(self, reminder_id, reminder):
+        with self.lock:
+            index, key = self._key(reminder_id, reminder)
+            if reminder_id in self.keys and self.keys[reminder_id] == (index is self.timestamps, key):
+                return
+            self.remove(reminder_id)
+            if index is not None:
+                insort(index, key)
+                self.keys[reminder_id] = (index is self.timestamps, key)
+
+    def remove(self, reminder_id):
+        with self.lock:
+            if reminder_id in self.keys:
+                is_timestamp, key = self.keys.pop(reminder_id)
+                index = self.timestamps if is_timestamp else self.due_dates
+                position = bisect_left(index, key)
+                if position < len(index) and index[position] == key:
+                    index.pop(position)
+
+    def boundary(self):
+        '''Returns how many reminders with a timestamp and how many with only a due date are past due'''
+        # same as the browser, a timestamp is past due once it is reached and a due date once its day is over
+        now = floor(self.clock.time())
+        today = datetime.datetime.combine(self.clock.today(), datetime.time(), tzinfo=datetime.timezone.utc).timestamp()
+        with self.lock:
+            return bisect_left(self.timestamps, (now + 1,)), bisect_left(self.due_dates, (today,))
+
+    def timestamps_between(self, start, end):
+        '''Returns the reminders with a timestamp after start, or from the beginning if it is None, up to and including end'''
+        with self.lock:
+            first = 0 if start is None else bisect_left(self.timestamps, (floor(start) + 1,))
+            last = bisect_left(self.timestamps, (floor(end) + 1,))
+            return [reminder_id for value, reminder_id in self.timestamps[first:last]]
+
+    def past_due(self, offset = 0, count = None):
+        '''Returns how many reminders are past due and up to count of them from offset on, the longest past due first'''
+        with self.lock:
+            timestamps, due_dates = self.boundary()
+            overdue = merge(islice(self.timestamps, timestamps), islice(self.due_dates, due_dates))
+            end = None if count is None else offset + count
+            return timestamps + due_dates, [reminder_id for value, reminder_id in islice(overdue, offset, end)]
+
+    def next_due(self, count):
+        with self.lock:
+            timestamps, due_dates = self.boundary()
+            upcoming = merge(islice(self.timestamps, timestamps, None), islice(self.due_dates, due_dates, None))
+            return [reminder_id for value, reminder_id in islice(upcoming, count)]
@@ -22,7 +22,6 @@ from gi.repository import GLib
 from os import path, mkdir
 from math import floor
 from logging import getLogger
-from time import time
 from icalendar.cal import Calendar, Todo
 
 logger = getLogger(info.service_executable)
@@ -120,7 +119,7 @@ class iCalendar():
                                 except:
                                     pass
 
-                            is_future = timestamp > floor(time())
+                            is_future = timestamp > floor(self.reminders.clock.time())
                             reminder['shown'] = timestamp != 0 and not is_future
 
                             reminder = self.reminders.caldav.task_to_reminder(todo, list_id, reminder, timestamp, due_date)
@@ -15,18 +15,21 @@
 
 import datetime
 
-from gi.repository import Secret, GLib
+from gi.repository import GLib
 
 from reminders import info
 from reminders.service.reminder import Reminder
 from msal import PublicClientApplication, SerializableTokenCache
-from requests import request, HTTPError, ConnectionError, Timeout
+from requests import request, Response, HTTPError, ConnectionError, Timeout
 from logging import getLogger
 from atexit import register as atexit_register
 from json import dumps, loads
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import parse_qs
-from threading import Thread
+from urllib.parse import parse_qs, urlencode
+from threading import Thread, Lock, local
+from time import perf_counter, sleep
+from hashlib import blake2b
+from os import environ
 
 GRAPH = 'https://graph.microsoft.com/v1.0'
 
@@ -37,8 +40,59 @@ SCOPES = [
 
 DAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
 
+# graph allows up to 20 requests in a single $batch request
+BATCH_LIMIT = 20
+
+# batched requests that failed with these are retried once, after waiting for as long as the server asks
+RETRY_STATUS = (429, 503, 504)
+# seconds to wait before a retry if the server doesn't say
+DEFAULT_RETRY_AFTER = 1
+# a retry that would have to wait longer than this is left to the queue instead, the thread can't be held up that long
+MAX_RETRY_AFTER = 30
+
+# for measuring sync offline, every Graph response is written to REMINDERS_RECORD_DIR if it is set,
+# and REMINDERS_REPLAY_DIR answers requests with responses recorded earlier instead of going to the network
+RECORD_DIR = environ.get('REMINDERS_RECORD_DIR', None)
+REPLAY_DIR = environ.get('REMINDERS_REPLAY_DIR', None)
+
+# access tokens are refreshed in the background this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 5 * 60
+
+# how many items to request per page when following @odata.nextLink
+PAGE_SIZE = 100
+# seconds before the completion request that the completed copy of a recurring task is looked for
+COMPLETED_COPY_WINDOW = 120
+
+# the only task fields that are used by task_to_reminder
+TASK_FIELDS = [
+    'id',
+    'title',
+    'body',
+    'importance',
+    'status',
+    'reminderDateTime',
+    'dueDateTime',
+    'recurrence',
+    'createdDateTime',
+    'lastModifiedDateTime',
+    'completedDateTime'
+]
+
 logger = getLogger(info.service_executable)
 
+def page_url(url, top = None, select = None, filter = None):
+    '''Adds the query options for the first page of a collection to url'''
+    params = {}
+    if top is not None:
+        params['$top'] = top
+    if select is not None:
+        params['$select'] = ','.join(select)
+    if filter is not None:
+        params['$filter'] = filter
+    if len(params) > 0:
+        url = f'{url}?{urlencode(params, safe="$,/:")}'
+    return url
+
 class Redirect(BaseHTTPRequestHandler):
     def __init__(self, callback, error_callback, *args):
         self.callback = callback
@@ -64,39 +118,63 @@ class MSToDo():
         self.app = None
         self.flow = None
         self.tokens = {}
+        # {user_id: unix time the access token expires at}
+        self.expiry = {}
+        self.refresh_id = 0
         self.users = {}
         self.reminders = reminders
         self.cache = SerializableTokenCache()
-        self.schema = reminders.schema
+        self.credentials = reminders.credentials
         self.flows = {}
+        # the account pipelines send requests while a sync is running, only the ones made by the sync are counted
+        self.stats_lock = Lock()
+        self.counting = local()
+        self.reset_stats()
+        self.record_lock = Lock()
+        self.replay = None
+        # {user_id: index} of the placeholders that replace the accounts in recordings
+        self.placeholders = {}
+        # when the sync that is being replayed was recorded
+        self.recorded_at = None
 
         atexit_register(self.store)
-        self.read_cache()
-
-        try:
-            self.get_tokens()
-        except:
-            pass
 
         server = HTTPServer(('', 0), lambda *args: Redirect(self.login, self.get_login_url, *args))
         self.port = server.server_port
         thread = Thread(target=self.start_server, args=(server,), daemon=True)
         thread.start()
 
+    def load_accounts(self):
+        # called once the credentials are read
+        # a replay never touches the secret service, the accounts come from the recording
+        if REPLAY_DIR is None:
+            self.read_cache()
+            self.read_users()
+
+        try:
+            self.get_tokens()
+        except:
+            pass
+
     def start_server(self, server):
         server.serve_forever()
 
     def do_request(self, method, url, user_id, data = None, retry = True):
         try:
-            if data is None:
+            if REPLAY_DIR is not None:
+                results = self._replay_request(method, url, user_id, data)
+            elif data is None:
                 results = request(method, f'{GRAPH}/{url}', headers={'Authorization': f'Bearer {self.tokens[user_id]}'}, timeout=5)
             else:
                 results = request(method, f'{GRAPH}/{url}', data=dumps(data), headers={'Authorization': f'Bearer {self.tokens[user_id]}', 'Content-Type': 'application/json'}, timeout=5)
+            if RECORD_DIR is not None:
+                self._record(method, url, user_id, data, results)
             results.raise_for_status()
+            self._count({'requests': 1, 'bytes': len(results.content)})
             return results
         except HTTPError as error:
             if error.response.status_code == 401 and retry:
-                self.get_tokens()
+                self.refresh_token(user_id, True)
                 results = self.do_request(method, url, user_id, data, False)
                 return results
             elif error.response.status_code == 503:
@@ -109,28 +187,215 @@ class MSToDo():
                 logger.exception(error)
                 raise error
 
+    def _placeholder(self, user_id):
+        # an account keeps the same placeholder for the whole recording
+        with self.record_lock:
+            index = self.placeholders.setdefault(user_id, len(self.placeholders))
+        return f'user{index}', f'user{index}@example.com'
+
+    def _record(self, method, url, user_id, data, response):
+        # headers aren't recorded, so tokens never end up in the recording
+        placeholder_id, email = self._placeholder(user_id)
+        record = {
+            'user': placeholder_id,
+            'method': method,
+            'url': url,
+            'data': data,
+            'status': response.status_code,
+            'body': response.text
+        }
+        with self.record_lock:
+            with open(f'{RECORD_DIR}/graph.jsonl', 'a') as recording:
+                recording.write(dumps(record) + '\n')
+
+    def _record_users(self, now):
+        # the accounts are replaced with placeholders so the recording can be shared
+        users = {}
+        for user_id in self.users.keys():
+            placeholder_id, email = self._placeholder(user_id)
+            users[placeholder_id] = {
+                'email': email,
+                'local-id': ''
+            }
+        with open(f'{RECORD_DIR}/users.json', 'w') as recording:
+            recording.write(dumps({'recorded-at': now, 'users': users}))
+
+    def _replay_request(self, method, url, user_id, data):
+        with self.record_lock:
+            if self.replay is None:
+                # {(user_id, method, url): [record]}, requests that were made more than once are answered in the same order
+                self.replay = {}
+                with open(f'{REPLAY_DIR}/graph.jsonl', 'r') as recording:
+                    for line in recording:
+                        record = loads(line)
+                        self.replay.setdefault((record['user'], record['method'], record['url']), []).append(record)
+
+            # the accounts of a replay are the placeholders they were recorded as
+            records = self.replay.get((user_id, method, url), [])
+            if len(records) == 0:
+                raise ConnectionError(f'No recorded response for {method} {url}')
+            record = records.pop(0) if len(records) > 1 else records[0]
+
+        response = Response()
+        response.status_code = record['status']
+        response._content = record['body'].encode()
+        response.url = f'{GRAPH}/{url}'
+        return response
+
+    def reset_stats(self):
+        # starts the counters for a sync, requests from this thread are counted in them until end_stats
+        stats = {
+            'requests': 0,
+            'bytes': 0,
+            'parse-time': 0.0
+        }
+        with self.stats_lock:
+            self.stats = stats
+        self.counting.stats = stats
+
+    def end_stats(self):
+        # the sync is over, the counters it read stay in self.stats
+        self.counting.stats = None
+
+    def _count(self, values):
+        stats = getattr(self.counting, 'stats', None)
+        if stats is not None:
+            with self.stats_lock:
+                for key, value in values.items():
+                    stats[key] += value
+
+    def get_pages(self, url, user_id, top = None, select = None, filter = None):
+        # yields every item of a collection, one page at a time
+        url = page_url(url, top, select, filter)
+
+        while url is not None:
+            response = self.do_request('GET', url, user_id)
+            start = perf_counter()
+            results = response.json()
+            self._count({'parse-time': perf_counter() - start})
+            yield from results['value']
+            url = results.get('@odata.nextLink', None)
+            if url is not None and url.startswith(GRAPH):
+                url = url[len(GRAPH) + 1:]
+
+    def do_batch_request(self, user_id, requests):
+        # requests is a dict of {key: (method, url, data)}, returns a dict of {key: (status, body)}
+        responses = {}
+        pending = requests
+        retry = True
+
+        while len(pending) > 0:
+            failed = {}
+            retry_after = 0
+            keys = list(pending.keys())
+            for start in range(0, len(keys), BATCH_LIMIT):
+                chunk = keys[start:start + BATCH_LIMIT]
+                batch = []
+                for index, key in enumerate(chunk):
+                    method, url, data = pending[key]
+                    sub_request = {
+                        'id': str(index),
+                        'method': method,
+                        'url': f'/{url}'
+                    }
+                    if data is not None:
+                        sub_request['body'] = data
+                        sub_request['headers'] = {'Content-Type': 'application/json'}
+                    batch.append(sub_request)
+
+                results = self.do_request('POST', '$batch', user_id, {'requests': batch}).json()
+
+                for response in results['responses']:
+                    key = chunk[int(response['id'])]
+                    status = response['status']
+                    body = response['body'] if 'body' in response else None
+                    if retry and status in RETRY_STATUS:
+                        failed[key] = pending[key]
+                        retry_after = max(retry_after, self._retry_after(response))
+                    responses[key] = (status, body)
+
+            if not retry or len(failed) == 0 or retry_after > MAX_RETRY_AFTER:
+                break
+            sleep(retry_after)
+            retry = False
+            pending = failed
+
+        return responses
+
+    def _retry_after(self, response):
+        # header names of batched responses aren't normalized, and Retry-After can also be a date which isn't worth parsing here
+        for key, value in response.get('headers', {}).items():
+            if key.lower() == 'retry-after':
+                try:
+                    return max(float(value), 0)
+                except ValueError:
+                    break
+        return DEFAULT_RETRY_AFTER
+
+    def _batch_results(self, user_id, requests):
+        results = {}
+        for key, (status, body) in self.do_batch_request(user_id, requests).items():
+            if status < 400:
+                results[key] = body
+            else:
+                response = Response()
+                response.status_code = status
+                response._content = dumps(body).encode() if body is not None else b''
+                results[key] = HTTPError(f'{status} Error for batched request', response=response)
+        return results
+
     def get_tokens(self):
+        # the account is only looked up on the server when it isn't known yet or its sign in name changed
+        if REPLAY_DIR is not None:
+            with open(f'{REPLAY_DIR}/users.json', 'r') as recording:
+                recording = loads(recording.read())
+            self.users = recording['users']
+            self.recorded_at = recording['recorded-at']
+            self.tokens = dict.fromkeys(self.users.keys(), '')
+            return
+
         try:
             if self.app is None:
                 self.app = PublicClientApplication(info.client_id, token_cache=self.cache)
+            old_users = self.users
+            known = {}
+            for user_id, value in old_users.items():
+                known[value['local-id']] = user_id
             self.tokens = {}
+            self.expiry = {}
             self.users = {}
             accounts = self.app.get_accounts()
 
             for account in accounts:
                 try:
-                    token = self.app.acquire_token_silent(SCOPES, account)['access_token']
-                    result = request('GET', f'{GRAPH}/me', headers={'Authorization': f'Bearer {token}'}, timeout=5)
-                    result.raise_for_status()
-                    result = result.json()
-                    user_id = result['id']
-                    email = result['userPrincipalName']
+                    # msal only goes to the network if the cached access token expired
+                    result = self.app.acquire_token_silent(SCOPES, account)
                     local_id = account['local_account_id']
+                    if result is None or 'access_token' not in result:
+                        # nothing usable is cached for the account, it has to sign in again
+                        logger.warning(f"No token for {account.get('username', local_id)}, signing in again is needed")
+                        continue
+                    token = result['access_token']
+                    username = account.get('username', None)
+
+                    if local_id in known and old_users[known[local_id]].get('username', None) == username:
+                        user_id = known[local_id]
+                        email = old_users[user_id]['email']
+                    else:
+                        user = request('GET', f'{GRAPH}/me', headers={'Authorization': f'Bearer {token}'}, timeout=5)
+                        user.raise_for_status()
+                        user = user.json()
+                        user_id = user['id']
+                        email = user['userPrincipalName']
+                        if local_id in known and email != old_users[known[local_id]]['email']:
+                            self.reminders.do_emit('UsernameUpdated', GLib.Variant('(ss)', (user_id, email)))
 
                     self.tokens[user_id] = token
+                    self.expiry[user_id] = self.reminders.clock.time() + result['expires_in']
                     self.users[user_id] = {
                         'email': email,
-                        'local-id': local_id
+                        'local-id': local_id,
+                        'username': username
                     }
                 except HTTPError as error:
                     if error.response.status_code == 503:
@@ -143,56 +408,119 @@ class MSToDo():
                     logger.exception(error)
 
             self.store()
+            self.schedule_refresh()
 
         except (ConnectionError, HTTPError, Timeout) as error:
-            try:
-                self.users = loads(
-                    Secret.password_lookup_sync(
-                        self.schema,
-                        { 'name': 'microsoft-users' },
-                        None
-                    )
-                )
-                for i, value in self.users.items():
-                    for key in ('email', 'local-id'):
-                        if key not in value.keys():
-                            self.users.pop(i)
-                            break
-            except:
-                self.users = {}
+            self.read_users()
             raise error
         except Exception as error:
             logger.exception(error)
             self.logout_all()
 
+    def read_users(self):
+        try:
+            self.users = loads(self.credentials.lookup('microsoft-users'))
+            for i, value in self.users.copy().items():
+                for key in ('email', 'local-id'):
+                    if key not in value.keys():
+                        self.users.pop(i)
+                        break
+        except:
+            self.users = {}
+
+    def refresh_token(self, user_id, force = False):
+        # a request was rejected, it is sent again with the new token straight away and the rest is applied on the main loop
+        refreshed = self._acquire_token(user_id, force)
+        self.tokens[user_id] = refreshed['token']
+        GLib.idle_add(self._refreshed, {user_id: refreshed})
+
+    def _acquire_token(self, user_id, force):
+        # only talks to msal and the server without changing anything, so it can run on any thread
+        if self.app is None:
+            self.app = PublicClientApplication(info.client_id, token_cache=self.cache)
+        user = self.users[user_id]
+        for account in self.app.get_accounts():
+            if account['local_account_id'] == user['local-id']:
+                result = self.app.acquire_token_silent(SCOPES, account, force_refresh=force)
+                if result is None or 'access_token' not in result:
+                    # nothing usable is cached and msal couldn't refresh it, the account has to sign in again
+                    reason = result.get('error_description', result.get('error', None)) if result is not None else 'nothing cached'
+                    raise KeyError(f'No token for {user_id}: {reason}')
+                refreshed = {
+                    'token': result['access_token'],
+                    'expiry': self.reminders.clock.time() + result['expires_in'],
+                    'username': result.get('id_token_claims', {}).get('preferred_username', account.get('username', None)),
+                    'email': None
+                }
+                # a new id token comes with a refresh, the account has to be looked up again if its name changed
+                if refreshed['username'] != user.get('username', None):
+                    try:
+                        refreshed['email'] = self._lookup_email(refreshed['token'])
+                    except Exception as error:
+                        logger.exception(f'{error}: Failed to look up the new name for {user_id}')
+                return refreshed
+        raise KeyError('Invalid user id')
+
+    def _lookup_email(self, token):
+        user = request('GET', f'{GRAPH}/me', headers={'Authorization': f'Bearer {token}'}, timeout=5)
+        user.raise_for_status()
+        return user.json()['userPrincipalName']
+
+    def _refreshed(self, refreshed):
+        # runs on the main loop with what _acquire_token gave back, the accounts could have signed out in the meantime
+        for user_id, value in refreshed.items():
+            if user_id not in self.users:
+                continue
+            self.tokens[user_id] = value['token']
+            self.expiry[user_id] = value['expiry']
+            if value['email'] is not None:
+                if value['email'] != self.users[user_id]['email']:
+                    self.reminders.do_emit('UsernameUpdated', GLib.Variant('(ss)', (user_id, value['email'])))
+                self.users[user_id]['email'] = value['email']
+                self.users[user_id]['username'] = value['username']
+        self.store()
+        self.schedule_refresh()
+        return False
+
+    def schedule_refresh(self):
+        # a single timer for the token that expires first
+        if self.refresh_id != 0:
+            self.reminders.clock.source_remove(self.refresh_id)
+            self.refresh_id = 0
+
+        if len(self.expiry) > 0:
+            wait = int(min(self.expiry.values()) - TOKEN_REFRESH_MARGIN - self.reminders.clock.time())
+            # a refresh that failed is retried a minute later
+            self.refresh_id = self.reminders.clock.timeout_add_seconds(max(wait, 60), self._refresh_cb)
+
+    def _refresh_cb(self):
+        self.refresh_id = 0
+        now = self.reminders.clock.time()
+        user_ids = [user_id for user_id, expiry in self.expiry.items() if expiry - TOKEN_REFRESH_MARGIN <= now and user_id in self.users]
+        thread = Thread(target=self._refresh_tokens, args=(user_ids,), daemon=True)
+        thread.start()
+        return False
+
+    def _refresh_tokens(self, user_ids):
+        # only the msal calls run on this thread, what they give back is applied on the main loop
+        refreshed = {}
+        for user_id in user_ids:
+            try:
+                refreshed[user_id] = self._acquire_token(user_id, True)
+            except Exception as error:
+                logger.exception(f'{error}: Failed to refresh the token for {user_id}')
+        GLib.idle_add(self._refreshed, refreshed)
+
     def store(self):
         if self.app is not None and len(self.users.keys()) > 0:
-            Secret.password_store_sync(
-                self.schema,
-                { 'name': 'microsoft-cache' },
-                None,
-                'cache',
-                self.cache.serialize(),
-                None
-            )
-            Secret.password_store_sync(
-                self.schema,
-                { 'name': 'microsoft-users' },
-                None,
-                'users',
-                dumps(self.users),
-                None
-            )
+            # serializing resets has_state_changed, so the cache is only written again after msal changes it
+            if self.cache.has_state_changed:
+                self.credentials.store('microsoft-cache', 'cache', self.cache.serialize())
+            self.credentials.store('microsoft-users', 'users', dumps(self.users))
 
     def read_cache(self):
         try:
-            self.cache.deserialize(
-                Secret.password_lookup_sync(
-                    self.schema,
-                    { 'name': 'microsoft-cache' },
-                    None
-                )
-            )
+            self.cache.deserialize(self.credentials.lookup('microsoft-cache'))
         except:
             self.logout_all()
 
@@ -206,7 +534,10 @@ class MSToDo():
         try:
             result = self.app.acquire_token_by_auth_code_flow(self.flow, results)
             token = result['access_token']
+            expiry = self.reminders.clock.time() + result['expires_in']
             local_id = result['id_token_claims']['oid']
+            # the same name msal gives the account, it is compared in get_tokens to notice when it changes
+            username = result['id_token_claims'].get('preferred_username', None)
             result = request('GET', f'{GRAPH}/me', headers={'Authorization': f'Bearer {token}'}, timeout=5)
             result.raise_for_status()
             result = result.json()
@@ -214,9 +545,12 @@ class MSToDo():
             email = result['userPrincipalName']
 
             self.tokens[user_id] = token
+            self.expiry[user_id] = expiry
+            GLib.idle_add(lambda *args: self.schedule_refresh())
             self.users[user_id] = {
                 'email': email,
-                'local-id': local_id
+                'local-id': local_id,
+                'username': username
             }
             self.store()
             self.reminders.emit_login(user_id)
@@ -235,19 +569,10 @@ class MSToDo():
             except:
                 pass
             self.tokens = {}
+            self.expiry = {}
             self.users = {}
-            Secret.password_clear(
-                self.schema,
-                { 'name': 'microsoft-cache' },
-                None,
-                None
-            )
-            Secret.password_clear(
-                self.schema,
-                { 'name': 'microsoft-users' },
-                None,
-                None
-            )
+            self.credentials.clear('microsoft-cache')
+            self.credentials.clear('microsoft-users')
 
         except Exception as error:
             logger.exception(error)
@@ -266,21 +591,12 @@ class MSToDo():
                 pass
             if user_id in self.tokens:
                 self.tokens.pop(user_id)
+            self.expiry.pop(user_id, None)
             if user_id in self.users:
                 self.users.pop(user_id)
             if self.users == {}:
-                Secret.password_clear(
-                    self.schema,
-                    { 'name': 'microsoft-cache' },
-                    None,
-                    None
-                )
-                Secret.password_clear(
-                    self.schema,
-                    { 'name': 'microsoft-users' },
-                    None,
-                    None
-                )
+                self.credentials.clear('microsoft-cache')
+                self.credentials.clear('microsoft-users')
             else:
                 self.store()
 
@@ -355,6 +671,63 @@ class MSToDo():
             logger.exception(error)
             raise error
 
+    def do_batch(self, user_id, requests):
+        try:
+            if user_id not in self.tokens.keys():
+                self.get_tokens()
+
+            if user_id in self.tokens.keys():
+                return self._batch_results(user_id, requests)
+            else:
+                raise ConnectionError
+        except HTTPError as error:
+            if error.response.status_code == 503:
+                if user_id in self.tokens.keys():
+                    self.tokens.pop(user_id)
+                raise error
+            else:
+                logger.exception(error)
+                raise error
+        except (ConnectionError, Timeout) as error:
+            if user_id in self.tokens.keys():
+                self.tokens.pop(user_id)
+            raise error
+        except Exception as error:
+            logger.exception(error)
+            raise error
+
+    def create_tasks(self, user_id, tasks):
+        # tasks is a dict of {key: (task_list, task)}, returns a dict of {key: task id or error}
+        requests = {}
+        for key, (task_list, task) in tasks.items():
+            requests[key] = ('POST', f'me/todo/lists/{task_list}/tasks', task)
+
+        results = self.do_batch(user_id, requests)
+        for key, value in results.items():
+            if not isinstance(value, Exception):
+                results[key] = value['id']
+        return results
+
+    def update_tasks(self, user_id, tasks):
+        # tasks is a dict of {key: (task_list, task_id, task)}, returns a dict of {key: task or error}
+        requests = {}
+        for key, (task_list, task_id, task) in tasks.items():
+            requests[key] = ('PATCH', f'me/todo/lists/{task_list}/tasks/{task_id}', task)
+
+        return self.do_batch(user_id, requests)
+
+    def remove_tasks(self, user_id, tasks):
+        # tasks is a dict of {key: (task_list, task_id)}, returns a dict of {key: None or error}
+        requests = {}
+        for key, (task_list, task_id) in tasks.items():
+            requests[key] = ('DELETE', f'me/todo/lists/{task_list}/tasks/{task_id}', None)
+
+        results = self.do_batch(user_id, requests)
+        for key, value in results.items():
+            if not isinstance(value, Exception):
+                results[key] = None
+        return results
+
     def create_list(self, user_id, list_name):
         content = {'displayName': list_name}
         try:
@@ -430,6 +803,7 @@ class MSToDo():
     def get_lists(self, removed_list_ids, old_lists, synced_ids):
         task_lists = {}
         not_synced = []
+        self.reset_stats()
 
         try:
             if self.users.keys() != self.tokens.keys():
@@ -437,17 +811,23 @@ class MSToDo():
         except:
             pass
 
+        # a replayed sync happens at the time it was recorded, the requests for completed tasks depend on it
+        now = self.recorded_at if REPLAY_DIR is not None else self.reminders.clock.time()
+        if RECORD_DIR is not None:
+            self._record_users(now)
+
+        completed_after = None
+        horizon = self.reminders.app.settings.get_int('completed-horizon')
+        if horizon > 0:
+            completed_after = datetime.datetime.fromtimestamp(now, tz=datetime.timezone.utc) - datetime.timedelta(days=horizon)
+
         for user_id in self.users.keys():
             if user_id not in self.tokens.keys():
                 not_synced.append(user_id)
                 continue
 
             try:
-                email = self.do_request('GET', 'me', user_id).json()['userPrincipalName']
-                if email != self.users[user_id]['email']:
-                    self.reminders.do_emit('UsernameUpdated', GLib.Variant('(ss)', (user_id, email)))
-
-                lists = self.do_request('GET', 'me/todo/lists', user_id).json()['value']
+                lists = list(self.get_pages('me/todo/lists', user_id))
 
                 task_lists[user_id] = []
 
@@ -474,7 +854,7 @@ class MSToDo():
                     if user_id not in synced_ids and list_id not in synced_ids:
                         tasks = []
                     else:
-                        tasks = self.do_request('GET', f'me/todo/lists/{list_uid}/tasks', user_id).json()['value']
+                        tasks = self.get_tasks(list_uid, user_id, completed_after)
 
                     task_lists[user_id].append({
                         'id': list_id,
@@ -498,15 +878,43 @@ class MSToDo():
 
         return task_lists, not_synced
 
-    def get_tasks(self, list_id, user_id):
+    def get_completed_copy(self, user_id, list_id, task, completed_date):
+        # completing a recurring task moves it to the next occurrence and creates a completed copy with a new id,
+        # only tasks that were completed around the same time are fetched to find it
+        modified = self.reminders._rfc_to_timestamp(task['lastModifiedDateTime'])
+        since = GLib.DateTime.new_from_unix_utc(modified - COMPLETED_COPY_WINDOW).format('%Y-%m-%dT%H:%M:%SZ')
+        task_filter = f"status eq 'completed' and lastModifiedDateTime ge {since}"
+        completed_day = self.reminders._timestamp_to_rfc(completed_date)[:10]
+
+        match_diff = None
+        new_uid = None
+        for candidate in self.get_pages(f'me/todo/lists/{list_id}/tasks', user_id, top=PAGE_SIZE, select=TASK_FIELDS, filter=task_filter):
+            if candidate['id'] == task['id'] or candidate['title'] != task['title']:
+                continue
+            if candidate.get('completedDateTime', None) is None or candidate['completedDateTime']['dateTime'][:10] != completed_day:
+                continue
+            # other tasks with the same title could have been completed at the same time, the closest one is the copy
+            diff = abs(self.reminders._rfc_to_timestamp(candidate['lastModifiedDateTime']) - modified)
+            if match_diff is None or diff < match_diff:
+                match_diff = diff
+                new_uid = candidate['id']
+
+        return new_uid
+
+    def get_tasks(self, list_id, user_id, completed_after = None):
+        # this is a generator so that large lists can be merged without keeping every page in memory
         try:
             if user_id not in self.tokens.keys():
                 self.get_tokens()
 
-            if user_id in self.tokens.keys():
-                tasks = self.do_request('GET', f'me/todo/lists/{list_id}/tasks', user_id).json()['value']
+            task_filter = None
+            if completed_after is not None:
+                # completed tasks older than the horizon are skipped by the server
+                completed_after = completed_after.strftime('%Y-%m-%dT%H:%M:%S')
+                task_filter = f"status ne 'completed' or completedDateTime/dateTime ge '{completed_after}'"
 
-            return tasks
+            if user_id in self.tokens.keys():
+                yield from self.get_pages(f'me/todo/lists/{list_id}/tasks', user_id, top=PAGE_SIZE, select=TASK_FIELDS, filter=task_filter)
         except HTTPError as error:
             if error.response.status_code == 503:
                 if user_id in self.tokens.keys():
@@ -607,11 +1015,20 @@ class MSToDo():
 
         return reminder_json
 
+    def get_fingerprint(self, task):
+        # hash of the task as it was received, this changes whenever anything in the task does
+        return blake2b(dumps(task, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+    def get_etag(self, task):
+        if '@odata.etag' in task:
+            return task['@odata.etag']
+        return self.get_fingerprint(task)
+
     def task_to_reminder(self, task, list_id, reminder = None, timestamp = None):
         if reminder is None:
             reminder = Reminder()
         if timestamp is None:
-            timestamp = self.reminders._rfc_to_timestamp(task['reminderDateTime']['dateTime']) if 'reminderDateTime' in task else 0
+            timestamp = self.reminders._rfc_to_timestamp(task['reminderDateTime']['dateTime']) if task.get('reminderDateTime', None) is not None else 0
         reminder['uid'] = task['id']
         reminder['title'] = task['title'].strip()
         reminder['description'] = task['body']['content'].strip() if task['body']['contentType'] == 'text' else ''
@@ -619,7 +1036,7 @@ class MSToDo():
         reminder['important'] = task['importance'] == 'high'
         reminder['timestamp'] = timestamp
         if timestamp == 0:
-            reminder['due-date'] = self.reminders._rfc_to_timestamp(task['dueDateTime']['dateTime']) if 'dueDateTime' in task else 0
+            reminder['due-date'] = self.reminders._rfc_to_timestamp(task['dueDateTime']['dateTime']) if task.get('dueDateTime', None) is not None else 0
         else:
             notif_date = datetime.date.fromtimestamp(reminder['timestamp'])
             reminder['due-date'] = int(datetime.datetime(notif_date.year, notif_date.month, notif_date.day, tzinfo=datetime.timezone.utc).timestamp())
@@ -628,11 +1045,11 @@ class MSToDo():
             reminder['created-timestamp'] = self.reminders._rfc_to_timestamp(task['createdDateTime'])
         reminder['updated-timestamp'] = self.reminders._rfc_to_timestamp(task['lastModifiedDateTime'])
         reminder['completed-timestamp'] = 0
-        reminder['completed-date'] = self.reminders._rfc_to_timestamp(task['completedDateTime']['dateTime']) if 'completedDateTime' in task else 0
+        reminder['completed-date'] = self.reminders._rfc_to_timestamp(task['completedDateTime']['dateTime']) if task.get('completedDateTime', None) is not None else 0
 
         reminder['list-id'] = list_id
 
-        if 'recurrence' in task:
+        if task.get('recurrence', None) is not None:
             if len(task['recurrence'].keys()) > 0:
                 reminder['repeat-until'] = 0
                 reminder['repeat-times'] = -1
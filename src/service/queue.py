@@ -15,203 +15,358 @@
 
 from reminders import info
 from logging import getLogger
-from queue import Queue
-from copy import deepcopy
 from requests import Timeout, HTTPError, ConnectionError
-from threading import Thread
-from json import load, dump
+from threading import Lock, RLock, Thread
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from json import load, loads, dumps
+from random import uniform
+from os import fsync, remove, replace
 from os.path import isfile
 
 logger = getLogger(info.service_executable)
 
-QUEUE_FILE = f'{info.data_dir}/queue.json'
-
-DEFAULT = {
-    'reminders': {
-        'create': [],
-        'update': {},
-        'delete': [],
-        'complete': []
-    },
-    'lists': {
-        'create': [],
-        'update': [],
-        'delete': []
-    }
-}
+QUEUE_FILE = f'{info.data_dir}/queue.log'
+
+# this is no longer used
+OLD_QUEUE_FILE = f'{info.data_dir}/queue.json'
+
+CREATE_REMINDER = 'create-reminder'
+UPDATE_REMINDER = 'update-reminder'
+COMPLETE_REMINDER = 'complete-reminder'
+DELETE_REMINDER = 'delete-reminder'
+CREATE_LIST = 'create-list'
+UPDATE_LIST = 'update-list'
+DELETE_LIST = 'delete-list'
+
+# seconds to wait before retrying an account after it fails, doubled after every failure
+RETRY_DELAY = 30
+RETRY_MAX_DELAY = 30 * 60
+# after this many failures in a row an account is only retried when connectivity returns or once an hour
+RETRY_MAX_FAILURES = 8
+RETRY_CIRCUIT_DELAY = 60 * 60
+
+# how many groups of queued operations are sent at the same time
+REPLAY_WORKERS = 4
+
+OPERATIONS = (
+    CREATE_REMINDER,
+    UPDATE_REMINDER,
+    COMPLETE_REMINDER,
+    DELETE_REMINDER,
+    CREATE_LIST,
+    UPDATE_LIST,
+    DELETE_LIST
+)
+
+def should_queue(error):
+    '''Whether a failed remote operation should be queued and retried later'''
+    if isinstance(error, (ConnectionError, Timeout)):
+        return True
+    if isinstance(error, HTTPError) and error.response is not None:
+        return error.response.status_code in (429, 503, 504)
+    return False
 
 class ReminderQueue():
+    '''Append-only log of remote operations that still need to be sent'''
     def __init__(self, reminders):
-        self.get_queue()
         self.reminders = reminders
+        # account pipelines replay and append from their own threads, so everything that reads entries, index or backoff holds this
+        self.lock = RLock()
+        # held while replaying, account pipelines and the main loop can all call load
+        self.replay_lock = Lock()
+        # {user_id: {'failures': int, 'retry-at': float}} for accounts that are waiting to be retried
+        self.backoff = {}
+        self.reset()
+        self.read()
 
     def reset(self):
-        self.queue = DEFAULT
-
-    def get_queue(self):
+        # {entry_id: entry}, entry ids only ever increase so this is in log order
+        self.entries = {}
+        # {operation: {key: entry_id}}, there is at most one pending entry per operation and key
+        self.index = {}
+        for operation in OPERATIONS:
+            self.index[operation] = {}
+        self.next_id = 0
+        # whether the log has entries that are done and can be compacted away
+        self.dirty = False
+
+    def read(self):
         try:
             if isfile(QUEUE_FILE):
-                with open(QUEUE_FILE, 'r') as jsonfile:
-                    self.queue = load(jsonfile)
-            else:
-                self.reset()
+                with open(QUEUE_FILE, 'r') as logfile:
+                    for line in logfile:
+                        try:
+                            record = loads(line)
+                        except ValueError:
+                            # the service was stopped in the middle of a write
+                            continue
+                        if 'done' in record:
+                            for entry_id in record['done']:
+                                self._forget(entry_id)
+                        else:
+                            self._add(record)
+            elif isfile(OLD_QUEUE_FILE):
+                self._migrate_old()
         except:
+            logger.exception(f'Something is wrong with {QUEUE_FILE}')
             self.reset()
 
-    def write(self):
-        with open(QUEUE_FILE, 'w') as jsonfile:
-            dump(self.queue, jsonfile)
-
-    def get_updated_reminder_ids(self):
-        try:
-            retval = self.queue['reminders']['create'] + self.queue['reminders']['complete'] + list(self.queue['reminders']['update'].keys())
-        except:
-            self.queue['reminders']['create'] = []
-            self.queue['reminders']['complete'] = []
-            self.queue['reminders']['update'] = {}
-            retval = []
-        return retval
-
-    def get_removed_reminder_ids(self):
-        try:
-            retval = []
-            for value in self.queue['reminders']['delete']:
-                retval.append(value[0])
-            for value in self.queue['reminders']['update'].values():
-                retval.append(value[0])
-        except:
-            self.queue['reminders']['delete'] = []
-            retval = []
-        return retval
+        self.compact()
 
-    def get_updated_list_ids(self):
+    def _migrate_old(self):
         try:
-            retval = self.queue['lists']['create'] + self.queue['lists']['update']
+            with open(OLD_QUEUE_FILE, 'r') as jsonfile:
+                old_queue = load(jsonfile)
+
+            for list_id in old_queue['lists']['create']:
+                self.add_list(list_id)
+            for reminder_id in old_queue['reminders']['create']:
+                self.create_reminder(reminder_id)
+            for reminder_id, value in old_queue['reminders']['update'].items():
+                self.update_reminder(reminder_id, *value)
+            for reminder_id in old_queue['reminders']['complete']:
+                self.update_completed(reminder_id)
+            for list_id in old_queue['lists']['update']:
+                self.update_list(list_id)
+            for task_id, user_id, task_list in old_queue['reminders']['delete']:
+                self._append(DELETE_REMINDER, task_id, [task_id, user_id, task_list])
+            for uid, user_id in old_queue['lists']['delete']:
+                self._append(DELETE_LIST, uid, [uid, user_id])
         except:
-            self.queue['lists']['create'] = []
-            self.queue['lists']['update'] = []
-            retval = []
-        return retval
+            logger.exception(f'Something is wrong with {OLD_QUEUE_FILE}')
+        remove(OLD_QUEUE_FILE)
+
+    def _add(self, entry):
+        self.entries[entry['id']] = entry
+        self.index[entry['op']][entry['key']] = entry['id']
+        self.next_id = max(self.next_id, entry['id'] + 1)
+
+    def _forget(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is not None and self.index[entry['op']].get(entry['key'], None) == entry_id:
+            self.index[entry['op']].pop(entry['key'])
+
+    def _write_record(self, record):
+        with open(QUEUE_FILE, 'a') as logfile:
+            logfile.write(dumps(record) + '\n')
+            logfile.flush()
+            fsync(logfile.fileno())
+
+    def _append(self, operation, key, args = None):
+        with self.lock:
+            entry = {
+                'id': self.next_id,
+                'op': operation,
+                'key': key,
+                'args': args if args is not None else []
+            }
+            self._add(entry)
+            self._write_record(entry)
+        self.schedule()
+
+    def done(self, entry_ids):
+        if len(entry_ids) == 0:
+            return
 
-    def get_removed_list_ids(self):
-        try:
-            retval = []
-            for value in self.queue['lists']['delete']:
-                retval.append(value[0])
-        except:
-            self.queue['lists']['delete'] = []
-            retval = []
-        return retval
+        with self.lock:
+            for entry_id in entry_ids:
+                self._forget(entry_id)
+            self._write_record({'done': entry_ids})
+            self.dirty = True
 
-    def create_reminder(self, reminder_id, retry = True):
+    def compact(self):
+        # rewrite the log with only the entries that are still pending
+        with self.lock:
+            try:
+                if len(self.entries) == 0:
+                    if isfile(QUEUE_FILE):
+                        remove(QUEUE_FILE)
+                    self.dirty = False
+                    return
+
+                with open(f'{QUEUE_FILE}.tmp', 'w') as logfile:
+                    for entry in self.entries.values():
+                        logfile.write(dumps(entry) + '\n')
+                    logfile.flush()
+                    fsync(logfile.fileno())
+                replace(f'{QUEUE_FILE}.tmp', QUEUE_FILE)
+                self.dirty = False
+            except:
+                logger.exception(f'Failed to compact {QUEUE_FILE}')
+
+    def _pending_ids(self, operations, key):
+        entry_ids = []
+        with self.lock:
+            for op in operations:
+                if key in self.index[op]:
+                    entry_ids.append(self.index[op][key])
+        return entry_ids
+
+    def pending(self, operation, user_ids = None):
+        with self.lock:
+            candidates = [self.entries[entry_id] for entry_id in sorted(self.index[operation].values())]
+        entries = {}
+        for entry in candidates:
+            if user_ids is None or self._entry_user(entry) in user_ids:
+                entries[entry['key']] = entry
+        return entries
+
+    def _entry_user(self, entry):
+        if entry['op'] in (DELETE_REMINDER, DELETE_LIST):
+            return entry['args'][1]
         try:
-            if reminder_id not in self.queue['reminders']['create']:
-                self.queue['reminders']['create'].append(reminder_id)
-                self.write()
-        except Exception as error:
-            if retry:
-                self.reset()
-                self.create_reminder(reminder_id, False)
+            if entry['op'] in (CREATE_LIST, UPDATE_LIST):
+                return self.reminders.lists[entry['key']]['user-id']
+            list_id = self.reminders.reminders[entry['key']]['list-id']
+            return self.reminders.lists[list_id]['user-id']
+        except KeyError:
+            # the reminder or list is gone, replaying it will drop it
+            return None
+
+    def _pending_users(self):
+        with self.lock:
+            entries = list(self.entries.values())
+        return set(self._entry_user(entry) for entry in entries)
+
+    def _backoff(self, user_id, error):
+        with self.lock:
+            state = self.backoff.setdefault(user_id, {'failures': 0})
+            state['failures'] += 1
+            if state['failures'] >= RETRY_MAX_FAILURES:
+                if state['failures'] == RETRY_MAX_FAILURES:
+                    logger.warning(f'{error}: Giving up on retrying queued changes for {user_id} until connectivity changes')
+                delay = RETRY_CIRCUIT_DELAY
             else:
-                raise error
+                delay = min(RETRY_MAX_DELAY, RETRY_DELAY * 2 ** (state['failures'] - 1))
+                # jitter so accounts on the same server don't all retry at once
+                delay = uniform(delay / 2, delay)
+            state['retry-at'] = self.reminders.clock.time() + delay
+
+    def schedule(self):
+        # arms a single timer for the account that should be retried first
+        retry_at = None
+        with self.lock:
+            for user_id in self._pending_users():
+                if user_id is None:
+                    continue
+                if user_id not in self.backoff:
+                    # something was queued without going through load, so the account is failing
+                    self._backoff(user_id, None)
+                # accounts whose circuit is open are in here too, their retry-at is RETRY_CIRCUIT_DELAY after the last failure
+                state = self.backoff[user_id]
+                if retry_at is None or state['retry-at'] < retry_at:
+                    retry_at = state['retry-at']
+
+        if retry_at is None:
+            self.reminders.countdowns.remove_countdown('retry-queue')
+        else:
+            self.reminders.countdowns.add_countdown(max(retry_at, self.reminders.clock.time() + 1), self._retry_cb, 'retry-queue')
 
-    def update_reminder(self, reminder_id, old_uid, old_user_id, old_list_uid, old_list_id, updating, completed, completed_timestamp, completed_date, retry = True):
+    def _retry(self):
         try:
-            if reminder_id not in self.queue['reminders']['create'] and reminder_id not in self.queue['reminders']['update']:
-                self.queue['reminders']['update'][reminder_id] = [old_uid, old_user_id, old_list_uid, old_list_id, updating, completed, completed_timestamp, completed_date]
-                self.write()
+            self.load()
         except Exception as error:
-            if retry:
-                self.reset()
-                self.update_reminder(reminder_id, old_uid, old_user_id, old_list_uid, old_list_id, updating, completed, completed_timestamp, completed_date, False)
-            else:
-                raise error
+            if not should_queue(error):
+                logger.exception(error)
 
-    def update_completed(self, reminder_id, retry = True):
-        try:
-            if reminder_id not in self.queue['reminders']['complete']:
-                self.queue['reminders']['complete'].append(reminder_id)
-                self.write()
-            else:
-                self.queue['reminders']['complete'].pop(reminder_id)
-                self.write()
-        except Exception as error:
-            if retry:
-                self.reset()
-                self.update_completed(reminder_id, False)
-            else:
-                raise error
+    def _retry_cb(self):
+        # replaying blocks on the network, so it can't run on the main loop
+        Thread(target=self._retry, daemon=True).start()
+        return False
 
-    def remove_reminder(self, reminder_id, task_id, user_id, task_list, retry = True):
-        try:
-            if reminder_id in self.queue['reminders']['update']:
-                self.queue['reminders']['update'].pop(reminder_id)
+    def reconnect(self):
+        # connectivity came back, so every account gets retried straight away
+        with self.lock:
+            self.backoff = {}
+            pending = len(self.entries) > 0
+        if pending:
+            Thread(target=self._retry, daemon=True).start()
 
-            value = [task_id, user_id, task_list]
+    def get_updated_reminder_ids(self):
+        with self.lock:
+            return set(self.index[CREATE_REMINDER]) | set(self.index[COMPLETE_REMINDER]) | set(self.index[UPDATE_REMINDER])
 
-            if reminder_id not in self.queue['reminders']['create'] and value not in self.queue['reminders']['delete']:
-                self.queue['reminders']['delete'].append(value)
-            elif reminder_id in self.queue['reminders']['create']:
-                self.queue['reminders']['create'].pop(reminder_id)
-            self.write()
-        except Exception as error:
-            if retry:
-                self.reset()
-                self.remove_reminder(reminder_id, task_id, user_id, task_list, False)
-            else:
-                raise error
+    def get_removed_reminder_ids(self):
+        retval = set()
+        with self.lock:
+            for entry_id in self.index[DELETE_REMINDER].values():
+                retval.add(self.entries[entry_id]['args'][0])
+            for entry_id in self.index[UPDATE_REMINDER].values():
+                retval.add(self.entries[entry_id]['args'][0])
+        return retval
 
-    def add_list(self, list_id, retry = True):
-        try:
-            if list_id not in self.queue['lists']['create']:
-                self.queue['lists']['create'].append(list_id)
-                self.write()
-        except Exception as error:
-            if retry:
-                self.reset()
-                self.add_list(list_id, False)
-            else:
-                raise error
+    def get_updated_list_ids(self):
+        with self.lock:
+            return set(self.index[CREATE_LIST]) | set(self.index[UPDATE_LIST])
 
-    def update_list(self, list_id, retry = True):
-        try:
-            if list_id not in self.queue['lists']['create'] and list_id not in self.queue['lists']['update']:
-                self.queue['lists']['update'].append(list_id)
-                self.write()
-        except Exception as error:
-            if retry:
-                self.reset()
-                self.update_list(list_id, False)
-            else:
-                raise error
+    def get_removed_list_ids(self):
+        retval = set()
+        with self.lock:
+            for entry_id in self.index[DELETE_LIST].values():
+                retval.add(self.entries[entry_id]['args'][0])
+        return retval
 
-    def remove_list(self, list_id, uid, user_id, retry = True):
-        try:
-            if list_id in self.queue['lists']['update']:
-                self.queue['lists']['update'].pop(list_id)
+    # the checks and the append have to happen together, a pipeline could queue the same thing in between otherwise
+    def create_reminder(self, reminder_id):
+        with self.lock:
+            if reminder_id not in self.index[CREATE_REMINDER]:
+                self._append(CREATE_REMINDER, reminder_id)
+
+    def update_reminder(self, reminder_id, old_uid, old_user_id, old_list_uid, old_list_id, updating, completed, completed_timestamp, completed_date):
+        # a pending create or update already sends the latest version of the reminder
+        with self.lock:
+            if reminder_id not in self.index[CREATE_REMINDER] and reminder_id not in self.index[UPDATE_REMINDER]:
+                self._append(UPDATE_REMINDER, reminder_id, [old_uid, old_user_id, old_list_uid, old_list_id, updating, completed, completed_timestamp, completed_date])
+
+    def update_completed(self, reminder_id):
+        with self.lock:
+            if reminder_id in self.index[COMPLETE_REMINDER]:
+                # completing and then uncompleting cancels out
+                self.done([self.index[COMPLETE_REMINDER][reminder_id]])
+            else:
+                self._append(COMPLETE_REMINDER, reminder_id)
 
-            value = [uid, user_id]
+    def remove_reminder(self, reminder_id, task_id, user_id, task_list):
+        with self.lock:
+            superseded = self._pending_ids((UPDATE_REMINDER, COMPLETE_REMINDER), reminder_id)
 
-            if list_id not in self.queue['lists']['create'] and value not in self.queue['lists']['delete']:
-                self.queue['lists']['delete'].append(value)
-            elif list_id in self.queue['lists']['create']:
-                self.queue['lists']['create'].pop(list_id)
-        except Exception as error:
-            if retry:
-                self.reset()
-                self.remove_list(list_id, uid, user_id, False)
+            if reminder_id in self.index[CREATE_REMINDER]:
+                # it never made it to the server, so there is nothing to delete
+                superseded.append(self.index[CREATE_REMINDER][reminder_id])
+                self.done(superseded)
+            else:
+                self.done(superseded)
+                if reminder_id not in self.index[DELETE_REMINDER]:
+                    self._append(DELETE_REMINDER, reminder_id, [task_id, user_id, task_list])
+
+    def add_list(self, list_id):
+        with self.lock:
+            if list_id not in self.index[CREATE_LIST]:
+                self._append(CREATE_LIST, list_id)
+
+    def update_list(self, list_id):
+        with self.lock:
+            if list_id not in self.index[CREATE_LIST] and list_id not in self.index[UPDATE_LIST]:
+                self._append(UPDATE_LIST, list_id)
+
+    def remove_list(self, list_id, uid, user_id):
+        with self.lock:
+            superseded = self._pending_ids((UPDATE_LIST,), list_id)
+
+            if list_id in self.index[CREATE_LIST]:
+                superseded.append(self.index[CREATE_LIST][list_id])
+                self.done(superseded)
             else:
-                raise error
+                self.done(superseded)
+                if list_id not in self.index[DELETE_LIST]:
+                    self._append(DELETE_LIST, list_id, [uid, user_id])
 
     def do_create_list(self, list_id):
         if list_id in self.reminders.lists:
             user_id = self.reminders.lists[list_id]['user-id']
             list_name = self.reminders.lists[list_id]['name']
 
-            new_uid = self.reminders._remote_create_list(user_id, list_name)
-
-            if new_uid is not None:
-                self.reminders.lists[list_id]['uid'] = new_uid
+            return self.reminders._remote_create_list(user_id, list_name)
 
     def do_update_list(self, list_id):
         if list_id in self.reminders.lists:
@@ -220,279 +375,168 @@ class ReminderQueue():
             list_name = self.reminders.lists[list_id]['name']
             self.reminders._remote_rename_list(user_id, uid, list_name)
 
-    def do_remove_list(self, value):
-        uid = value[0]
-        user_id = value[1]
-
+    def do_remove_list(self, uid, user_id):
         self.reminders._remote_delete_list(user_id, uid)
 
-    def do_create_reminder(self, reminder_id):
-        user_id = self.reminders.lists[self.reminders.reminders[reminder_id]['list-id']]['user-id']
-        if user_id == 'local':
-            location = 'local'
-        elif user_id in self.reminders.to_do.users.keys():
-            location = 'ms-to-do'
-        elif user_id in self.reminders.caldav.users.keys():
-            location = 'caldav'
-        else:
-            raise KeyError('Invalid user id')
-
-        new_task_id = self.reminders._to_remote_task(self.reminders.reminders[reminder_id], location, False)
-        if new_task_id is not None:
-            self.reminders.reminders[reminder_id]['uid'] = new_task_id
-
-    def do_update_reminder(self, reminder_id, args):
+    def _update_args(self, reminder_id, value):
         user_id = self.reminders.lists[self.reminders.reminders[reminder_id]['list-id']]['user-id']
-
-        if user_id == 'local':
-            location = 'local'
-        elif user_id in self.reminders.to_do.users.keys():
-            location = 'ms-to-do'
-        elif user_id in self.reminders.caldav.users.keys():
-            location = 'caldav'
-        else:
-            raise KeyError('Invalid user id')
-
-        old_uid = args[0]
-        old_user_id = args[1]
-        old_list_uid = args[2]
-        updating = args[4]
-        completed = args[5]
-        completed_timestamp = args[6]
-        completed_date = args[7]
-        new_task_id = self.reminders._to_remote_task(self.reminders.reminders[reminder_id], location, updating, old_user_id, old_list_uid, old_uid, completed, completed_timestamp)
-        if new_task_id is not None:
-            self.reminders.reminders[reminder_id]['uid'] = new_task_id
-
-    def do_complete_reminder(self, reminder_id):
-        user_id = self.reminders.lists[self.reminders.reminders[reminder_id]['list-id']]['user-id']
-
-        if user_id in self.reminders.to_do.users.keys():
-            self.reminders._ms_set_completed(reminder_id, self.reminders.reminders[reminder_id])
-        elif user_id in self.reminders.caldav.users.keys():
-            self.reminders._caldav_set_completed(reminder_id, self.reminders.reminders[reminder_id])
-        else:
-            raise KeyError('Invalid reminder id')
-
-    def do_remove_reminder(self, value):
-        task_id = value[0]
-        user_id = value[1]
-        task_list = value[2]
-
-        self.reminders._remote_remove_task(user_id, task_list, task_id)
-
-    def load(self):
-        old_queue = deepcopy(self.queue)
-        if old_queue == DEFAULT:
-            return
-
-        try:
-            error = None
-            try:
-                threads = []
-                queue = Queue()
-                for list_id in old_queue['lists']['create']:
-                    thread = QueueThread(queue, list_id, target = self.do_create_list, args = (list_id,))
-                    thread.start()
-                    threads.append(thread)
-
-                for thread in threads:
-                    thread.join()
-
-                while not queue.empty():
-                    value = queue.get()
-                    if isinstance(value, Exception):
-                        error = value
-                    else:
-                        if value in self.queue['lists']['create']:
-                            self.queue['lists']['create'].remove(value)
-            except:
-                self.queue['lists']['create'] = []
-
-            if error is not None:
-                raise error
-
-            try:
-                threads = []
-                queue = Queue()
-                for reminder_id in old_queue['reminders']['create']:
-                    thread = QueueThread(queue, reminder_id, target = self.do_create_reminder, args = (reminder_id,))
-                    thread.start()
-                    threads.append(thread)
-
-                for thread in threads:
-                    thread.join()
-
-                while not queue.empty():
-                    value = queue.get()
-                    if isinstance(value, Exception):
-                        error = value
-                    else:
-                        if value in self.queue['reminders']['create']:
-                            self.queue['reminders']['create'].remove(value)
-            except:
-                self.queue['reminders']['create'] = []
-
-            if error is not None:
-                raise error
-
-            try:
-                threads = []
-                queue = Queue()
-                for reminder_id, value in old_queue['reminders']['update'].items():
-                    def cb():
-                        self.reminders.reminders[reminder_id]['uid'] = value[0]
-                        self.reminders.reminders[reminder_id]['list-id'] = value[3]
-                    thread = QueueThread(queue, reminder_id, except_cb = cb, target = self.do_update_reminder, args = (reminder_id, value))
-                    thread.start()
-                    threads.append(thread)
-
-                for thread in threads:
-                    thread.join()
-
-                while not queue.empty():
-                    value = queue.get()
-                    if isinstance(value, Exception):
-                        error = value
-                    else:
-                        if value in self.queue['reminders']['update']:
-                            self.queue['reminders']['update'].pop(value)
-            except:
-                self.queue['reminders']['update'] = {}
-
-            if error is not None:
-                raise error
-
-            try:
-                threads = []
-                queue = Queue()
-                for reminder_id in old_queue['reminders']['complete']:
-                    thread = QueueThread(queue, reminder_id, target = self.do_complete_reminder, args = (reminder_id,))
-                    thread.start()
-                    threads.append(thread)
-
-                for thread in threads:
-                    thread.join()
-
-                while not queue.empty():
-                    value = queue.get()
-                    if isinstance(value, Exception):
-                        error = value
-                    else:
-                        if value in self.queue['reminders']['complete']:
-                            self.queue['reminders']['complete'].remove(value)
-            except:
-                self.queue['reminders']['complete'] = []
-
-            if error is not None:
-                raise error
-
-            try:
-                threads = []
-                queue = Queue()
-                for list_id in old_queue['lists']['update']:
-                    thread = QueueThread(queue, list_id, target = self.do_update_list, args = (list_id,))
-                    thread.start()
-                    threads.append(thread)
-
-                for thread in threads:
-                    thread.join()
-
-                while not queue.empty():
-                    value = queue.get()
-                    if isinstance(value, Exception):
-                        error = value
-                    else:
-                        if value in self.queue['lists']['update']:
-                            self.queue['lists']['update'].remove(value)
-            except:
-                self.queue['lists']['update'] = []
-
-            if error is not None:
-                raise error
-
-            try:
-                threads = []
-                queue = Queue()
-                for value in old_queue['reminders']['delete']:
-                    thread = QueueThread(queue, value, target = self.do_remove_reminder, args = (value,))
-                    thread.start()
-                    threads.append(thread)
-
-                for thread in threads:
-                    thread.join()
-
-                while not queue.empty():
-                    value = queue.get()
-                    if isinstance(value, Exception):
-                        error = value
-                    else:
-                        if value in self.queue['reminders']['delete']:
-                            self.queue['reminders']['delete'].remove(value)
-            except:
-                self.queue['reminders']['delete'] = []
-
-            if error is not None:
-                raise error
-
-            try:
-                threads = []
-                queue = Queue()
-                for value in old_queue['lists']['delete']:
-                    thread = QueueThread(queue, value, target = self.do_remove_list, args = (value,))
-                    thread.start()
-                    threads.append(thread)
-
-                for thread in threads:
-                    thread.join()
-
-                while not queue.empty():
-                    value = queue.get()
-                    if isinstance(value, Exception):
-                        error = value
-                    else:
-                        if value in self.queue['lists']['delete']:
-                            self.queue['lists']['delete'].remove(value)
-            except:
-                self.queue['lists']['delete'] = []
-
-            if error is not None:
-                raise error
-
-        except Exception as error:
-            if old_queue != self.queue:
-                self.write()
-            self.reminders._save_reminders()
-            self.reminders._save_lists()
-            raise error
-
-        if old_queue != self.queue:
-            self.write()
-        self.reminders._save_reminders()
-        self.reminders._save_lists()
-
-class QueueThread(Thread):
-    def __init__(self, queue, value, except_cb = None, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.queue = queue
-        self.val = value
-        self.except_cb = except_cb
-
-    def run(self):
+        location = self.reminders._get_location(user_id)
+        old_uid, old_user_id, old_list_uid, old_list_id, updating, completed, completed_timestamp, completed_date = value
+        return (location, updating, old_user_id, old_list_uid, old_uid, completed, completed_timestamp, completed_date)
+
+    def _finish(self, operation, entries, results, failed):
+        # marks everything that doesn't need to be retried as done, transient errors are added to failed by account
+        # returns the reminders and lists to write back, in the form Reminders._write_back takes
+        done = []
+        reminders = {}
+        lists = {}
+        for key, entry in entries.items():
+            result = results.get(key, None)
+            if isinstance(result, Exception):
+                if should_queue(result):
+                    failed.setdefault(self._entry_user(entry), result)
+                    continue
+                logger.error(f"{result}: Dropping queued {entry['op']} for {key}")
+                if operation == UPDATE_REMINDER:
+                    # it stays where it was on the server
+                    reminders[key] = {'uid': entry['args'][0], 'list-id': entry['args'][3]}
+            elif result is not None:
+                if operation == CREATE_LIST:
+                    lists[key] = result
+                else:
+                    reminders[key] = {'uid': result}
+            done.append(entry['id'])
+        self.done(done)
+        return reminders, lists
+
+    def _dependencies(self, entry):
+        # entry ids that have to be replayed before this entry
+        operation, key, args = entry['op'], entry['key'], entry['args']
+        entry_ids = []
+        if operation in (CREATE_REMINDER, UPDATE_REMINDER, COMPLETE_REMINDER):
+            if key in self.reminders.reminders:
+                entry_ids += self._pending_ids((CREATE_LIST,), self.reminders.reminders[key]['list-id'])
+            if operation == COMPLETE_REMINDER:
+                entry_ids += self._pending_ids((CREATE_REMINDER, UPDATE_REMINDER), key)
+        elif operation == UPDATE_LIST:
+            entry_ids += self._pending_ids((CREATE_LIST,), key)
+        elif operation == DELETE_LIST:
+            # tasks have to be removed or moved out of the list before it is deleted
+            uid, user_id = args
+            with self.lock:
+                for entry_id in self.index[DELETE_REMINDER].values():
+                    if self.entries[entry_id]['args'][1:] == [user_id, uid]:
+                        entry_ids.append(entry_id)
+                for entry_id in self.index[UPDATE_REMINDER].values():
+                    if self.entries[entry_id]['args'][1:3] == [user_id, uid]:
+                        entry_ids.append(entry_id)
+        return entry_ids
+
+    def _replay_group(self, operation, entries):
+        # sends entries that all have the same operation and account, returns a dict of {key: new uid, None or error}
         try:
-            if self._target is not None:
-                self._target(*self._args, **self._kwargs)
-                self.queue.put(self.val)
-        except (ConnectionError, Timeout) as error:
-            self.queue.put(error)
-        except HTTPError as error:
-            if error.response.status_code == 503:
-                self.queue.put(error)
+            if operation == CREATE_REMINDER:
+                return self.reminders._remote_create_reminderv(list(entries.keys()))
+            elif operation == UPDATE_REMINDER:
+                items = {}
+                results = {}
+                for reminder_id, entry in entries.items():
+                    try:
+                        items[reminder_id] = self._update_args(reminder_id, entry['args'])
+                    except Exception as error:
+                        results[reminder_id] = error
+                results.update(self.reminders._remote_update_reminderv(items))
+                return results
+            elif operation == COMPLETE_REMINDER:
+                return self.reminders._remote_set_completedv(list(entries.keys()))
+            elif operation == DELETE_REMINDER:
+                values = {}
+                for key, entry in entries.items():
+                    values[key] = tuple(entry['args'])
+                return self.reminders._remote_remove_taskv(values)
+            elif operation == DELETE_LIST:
+                items = {}
+                for key, entry in entries.items():
+                    items[key] = tuple(entry['args'])
+                return self.reminders._remote_each(items, self.do_remove_list)
             else:
-                logger.exception(error)
-                self.queue.put(self.val)
+                items = {}
+                for list_id in entries.keys():
+                    items[list_id] = (list_id,)
+                target = self.do_create_list if operation == CREATE_LIST else self.do_update_list
+                return self.reminders._remote_each(items, target)
         except Exception as error:
-            logger.exception(error)
-            self.queue.put(self.val)
-            if except_cb is not None:
-                self.except_cb()
+            return dict.fromkeys(entries.keys(), error)
+
+    def _replay(self, user_ids):
+        # entries are sent as soon as everything they depend on is done, an entry that fails only holds back its dependents
+        failed = {}
+        remaining = {}
+        dependencies = {}
+        with self.lock:
+            entries = list(self.entries.items())
+        for entry_id, entry in entries:
+            if self._entry_user(entry) in user_ids:
+                remaining[entry_id] = entry
+                dependencies[entry_id] = self._dependencies(entry)
+
+        running = {}
+        with ThreadPoolExecutor(max_workers=REPLAY_WORKERS) as pool:
+            while True:
+                groups = {}
+                with self.lock:
+                    ready = [entry_id for entry_id in remaining.keys() if all(dependency not in self.entries for dependency in dependencies[entry_id])]
+                for entry_id in ready:
+                    entry = remaining.pop(entry_id)
+                    group = (entry['op'], self._entry_user(entry))
+                    groups.setdefault(group, {})[entry['key']] = entry
+
+                for (operation, user_id), entries in groups.items():
+                    running[pool.submit(self._replay_group, operation, entries)] = (operation, entries)
+
+                if len(running) == 0:
+                    break
+
+                finished, not_finished = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    operation, entries = running.pop(future)
+                    reminders, lists = self._finish(operation, entries, future.result(), failed)
+                    # entries that depend on these are sent next and need the new uids
+                    self.reminders._write_back(reminders, lists)
+
+        return failed
+
+    def load(self, user_ids = None):
+        # replays the accounts that are due, raises if anything for user_ids (or any account) is still waiting
+        with self.lock:
+            if len(self.entries) == 0:
+                return
+
+        # if something else is already replaying, don't wait for it
+        if self.replay_lock.acquire(blocking=False):
+            try:
+                now = self.reminders.clock.time()
+                due = set()
+                with self.lock:
+                    for user_id in self._pending_users():
+                        if user_id not in self.backoff or self.backoff[user_id]['retry-at'] <= now:
+                            due.add(user_id)
+
+                if len(due) > 0:
+                    failed = self._replay(due)
+                    with self.lock:
+                        for user_id in due:
+                            if user_id in failed:
+                                self._backoff(user_id, failed[user_id])
+                            else:
+                                self.backoff.pop(user_id, None)
+            finally:
+                if self.dirty:
+                    self.compact()
+                self.schedule()
+                self.replay_lock.release()
+
+        # new changes have to wait behind the ones that are still queued for the same account
+        for user_id in self._pending_users():
+            if user_id is not None and (user_ids is None or user_id in user_ids):
+                raise ConnectionError(f'Waiting to retry queued changes for {user_id}')
@@ -0,0 +1,284 @@
+# recurrence.py
+# Copyright (C) 2023 Sasha Hale <dgsasha04@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of  MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+from reminders import info
+from math import floor, gcd
+from calendar import monthrange, isleap
+from functools import lru_cache
+from reminders.clock import get_clock
+
+# occurrences that are kept around per reminder before the cache is cleared
+MAX_CACHED = 4096
+# how far the wall clock can be off from the real time, this covers any change in utc offset
+MAX_OFFSET_CHANGE = 2 * 24 * 60 * 60
+EPOCH = datetime.datetime(1970, 1, 1)
+# seconds in each fixed repeat interval
+INTERVALS = {
+    info.RepeatType.MINUTE: 60,
+    info.RepeatType.HOUR: 60 * 60,
+    info.RepeatType.DAY: 24 * 60 * 60
+}
+
+def get_rule(reminder):
+    return (
+        reminder['timestamp'],
+        reminder['due-date'],
+        reminder['repeat-type'],
+        reminder['repeat-frequency'],
+        reminder['repeat-days'],
+        reminder['repeat-until'],
+        reminder['repeat-times']
+    )
+
+@lru_cache(maxsize=256)
+def get_days(repeat_days, week_starts_sunday):
+    # repeat days are a RepeatDays flag, monday being the lowest bit
+    if not week_starts_sunday:
+        bits = (0, 1, 2, 3, 4, 5, 6)
+    else:
+        bits = (6, 0, 1, 2, 3, 4, 5)
+    return tuple(num for num, bit in enumerate(bits) if repeat_days & (1 << bit))
+
+def month_repeat(reminder_datetime, frequency, count=1):
+    date = reminder_datetime.date()
+    time = reminder_datetime.time()
+    tz = reminder_datetime.tzinfo
+    months = date.year * 12 + date.month - 1
+    day = date.day
+
+    # a day that gets clamped to the end of a shorter month stays clamped for the repeats after it
+    if day > 28:
+        cycle = 12 // gcd(frequency, 12)
+        for i in range(1, min(count, cycle) + 1):
+            year, month = divmod(months + i * frequency, 12)
+            day = min(day, monthrange(year, month + 1)[1])
+        # after one cycle only a february in a leap year can still be longer than the day
+        if day == 29:
+            for i in range(1, cycle + 1):
+                if (months + i * frequency) % 12 == 1:
+                    i += cycle
+                    while i <= count:
+                        if not isleap((months + i * frequency) // 12):
+                            day = 28
+                            break
+                        i += cycle
+                    break
+
+    year, month = divmod(months + count * frequency, 12)
+    day = min(day, monthrange(year, month + 1)[1])
+
+    return datetime.datetime.combine(datetime.date(year, month + 1, day), time, tzinfo=tz)
+
+class Recurrence():
+    '''Expands the repeat rule of a reminder into its occurrences'''
+    def __init__(self, rule, week_starts_sunday):
+        timestamp, due_date, self.repeat_type, self.frequency, repeat_days, repeat_until, self.repeat_times = rule
+        self.notify = timestamp != 0
+        if self.notify:
+            self.start = datetime.datetime.fromtimestamp(timestamp)
+        else:
+            self.start = datetime.datetime.fromtimestamp(due_date, tz=datetime.timezone.utc)
+
+        self.repeat_until = datetime.datetime.fromtimestamp(repeat_until, tz=datetime.timezone.utc).date() if repeat_until > 0 else None
+        # {n: datetime}
+        self.cache = {}
+
+        self.days = ()
+        if self.repeat_type == info.RepeatType.WEEK:
+            if not week_starts_sunday:
+                self.weekday = self.start.date().weekday()
+            else:
+                self.weekday = (self.start.date().weekday() + 1) % 7
+
+            if repeat_days == 0:
+                repeat_days = self.weekday
+
+            self.days = get_days(repeat_days, week_starts_sunday)
+
+            # the first repeat is the next selected day, skipping weeks if it wraps around
+            self.start_index = 0
+            self.start_week = self.frequency
+            for index, value in enumerate(self.days):
+                if value > self.weekday:
+                    self.start_index = index
+                    self.start_week = 0
+                    break
+
+        if self.repeat_type in (info.RepeatType.MINUTE, info.RepeatType.HOUR, info.RepeatType.DAY, info.RepeatType.MONTH, info.RepeatType.YEAR):
+            self.repeats = True
+        else:
+            self.repeats = self.repeat_type == info.RepeatType.WEEK and len(self.days) > 0
+
+    def get(self, n):
+        '''Returns the nth occurrence as a datetime, 0 being the reminder itself'''
+        if n == 0 or not self.repeats:
+            return self.start
+
+        if n in self.cache:
+            return self.cache[n]
+
+        if self.repeat_type == info.RepeatType.MINUTE:
+            value = self.start + n * datetime.timedelta(minutes=self.frequency)
+        elif self.repeat_type == info.RepeatType.HOUR:
+            value = self.start + n * datetime.timedelta(hours=self.frequency)
+        elif self.repeat_type == info.RepeatType.DAY:
+            value = self.start + n * datetime.timedelta(days=self.frequency)
+        elif self.repeat_type == info.RepeatType.WEEK:
+            # every len(days) repeats make up frequency weeks
+            weeks, index = divmod(self.start_index + n - 1, len(self.days))
+            offset = self.days[index] - self.weekday + 7 * (self.start_week + weeks * self.frequency)
+            value = self.start + datetime.timedelta(days=offset)
+        elif self.repeat_type == info.RepeatType.MONTH:
+            value = month_repeat(self.start, self.frequency, n)
+        else:
+            value = month_repeat(self.start, 12 * self.frequency, n)
+
+        if len(self.cache) >= MAX_CACHED:
+            self.cache.clear()
+        self.cache[n] = value
+        return value
+
+    def search(self, is_before, first=0):
+        '''Returns the first n from first onwards where is_before(occurrence) is False'''
+        if not self.repeats or not is_before(self.get(first)):
+            return first
+
+        # the occurrences only get later, so the boundary can be found with a binary search
+        low = first
+        high = first + 1
+        while is_before(self.get(high)):
+            low = high
+            high = first + 2 * (high - first)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if is_before(self.get(middle)):
+                low = middle
+            else:
+                high = middle
+        return high
+
+    def between(self, start, end):
+        '''Yields the timestamps of the remaining occurrences from start up to but not including end'''
+        if self.repeats and self.repeat_times != -1:
+            count = max(self.repeat_times, 1)
+        elif self.repeats:
+            count = None
+        else:
+            count = 1
+
+        n = self.search(lambda value: value.timestamp() < start)
+        while count is None or n < count:
+            value = self.get(n)
+            if self.repeat_until is not None and value.date() > self.repeat_until:
+                return
+            timestamp = floor(value.timestamp())
+            if timestamp >= end:
+                return
+            if timestamp >= start:
+                yield timestamp
+            n += 1
+
+def _lower_bounds(starts, targets, steps):
+    # the first repeat that can possibly not be in the past, at least 1
+    return [max((target - start) // step, 1) for start, target, step in zip(starts, targets, steps)]
+
+def next_occurrences(rules, week_starts_sunday, clock = None):
+    '''Returns (timestamp, due_date, repeat_times) of the next occurrence that isn't in the past for each rule, or None if it doesn't repeat again'''
+    if clock is None:
+        clock = get_clock()
+    now = floor(clock.time())
+    today = clock.today()
+    now_wall = (datetime.datetime.fromtimestamp(now) - EPOCH).total_seconds()
+    midnight = datetime.datetime.combine(today, datetime.time(), tzinfo=datetime.timezone.utc).timestamp()
+
+    results = [None] * len(rules)
+    # (index, recurrence, repeat_times)
+    pending = []
+    # fixed interval rules get their starting point for the search in one pass
+    fixed = []
+    starts = []
+    targets = []
+    steps = []
+
+    for index, rule in enumerate(rules):
+        repeat_times = rule[6]
+        if repeat_times != -1:
+            repeat_times -= 1
+
+        if repeat_times == 0:
+            continue
+
+        recurrence = Recurrence(rule, week_starts_sunday)
+
+        if recurrence.repeat_until is not None and recurrence.start.date() > recurrence.repeat_until:
+            continue
+
+        if recurrence.repeat_type == info.RepeatType.WEEK and not recurrence.repeats:
+            continue
+
+        pending.append((index, recurrence, repeat_times))
+
+        if recurrence.repeat_type in INTERVALS:
+            fixed.append(len(pending) - 1)
+            if recurrence.notify:
+                starts.append(floor((recurrence.start - EPOCH).total_seconds()))
+                targets.append(floor(now_wall) - MAX_OFFSET_CHANGE)
+            else:
+                starts.append(floor(recurrence.start.timestamp()))
+                targets.append(floor(midnight))
+            steps.append(max(recurrence.frequency * INTERVALS[recurrence.repeat_type], 1))
+
+    first = [1] * len(pending)
+    for position, bound in zip(fixed, _lower_bounds(starts, targets, steps)):
+        first[position] = bound
+
+    for (index, recurrence, repeat_times), search_from in zip(pending, first):
+        reminder_datetime = recurrence.start
+
+        if recurrence.repeats:
+            if recurrence.notify:
+                search_from = _checked_bound(recurrence, lambda value: value.timestamp() < now, search_from)
+                skipped = recurrence.search(lambda value: value.timestamp() < now, search_from) - 1
+            else:
+                search_from = _checked_bound(recurrence, lambda value: value.date() < today, search_from)
+                skipped = recurrence.search(lambda value: value.date() < today, search_from) - 1
+
+            # every skipped occurrence uses up one of the remaining repeats, the last one is kept even if it is in the past
+            if repeat_times != -1:
+                if skipped >= repeat_times:
+                    skipped = repeat_times - 1
+                    repeat_times = 0
+                else:
+                    repeat_times -= skipped
+
+            reminder_datetime = recurrence.get(skipped + 1)
+
+        if recurrence.repeat_until is not None and reminder_datetime.date() > recurrence.repeat_until:
+            continue
+
+        timestamp = floor(reminder_datetime.timestamp()) if recurrence.notify else 0
+        due_date = floor(reminder_datetime.timestamp()) if not recurrence.notify else 0
+
+        results[index] = (timestamp, due_date, repeat_times)
+
+    return results
+
+def _checked_bound(recurrence, is_before, search_from):
+    # the estimate is only a shortcut, it is never allowed to skip over an occurrence that isn't in the past
+    if search_from > 1 and not is_before(recurrence.get(search_from - 1)):
+        return 1
+    return search_from
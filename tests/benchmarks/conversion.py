@@ -0,0 +1,122 @@
+# conversion.py
+# Copyright (C) 2023 Sasha Hale <dgsasha04@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of  MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Converts synthetic tasks to reminders the way a sync does, without any requests
+
+Every step a sync takes per task is timed on its own: finding the etag (hashing the data when the server didn't send
+one), parsing the iCalendar data and converting the task to a reminder.
+
+usage: python tests/benchmarks/conversion.py [--tasks 10000] [--recurring 0.2] [--completed 0.5] [--repeat 3]
+'''
+
+import sys
+
+from os import path
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from support import load_package
+load_package()
+
+from reminders.service.backend import Reminders
+from reminders.service.caldav import CalDAV
+from reminders.service.ms_to_do import MSToDo
+from reminders.service.reminder import Reminder
+
+from argparse import ArgumentParser
+from caldav.objects import Todo
+from time import perf_counter
+
+import synthetic
+
+NOW = 1700000000
+
+class Backend():
+    _rfc_to_timestamp = Reminders._rfc_to_timestamp
+
+class ToDo():
+    '''The conversions of MSToDo, nothing is fetched'''
+    get_etag = MSToDo.get_etag
+    get_fingerprint = MSToDo.get_fingerprint
+    task_to_reminder = MSToDo.task_to_reminder
+
+    def __init__(self):
+        self.reminders = Backend()
+
+class DAV():
+    '''The conversions of CalDAV, nothing is fetched'''
+    get_etag = CalDAV.get_etag
+    get_fingerprint = CalDAV.get_fingerprint
+    task_to_reminder = CalDAV.task_to_reminder
+
+    def __init__(self):
+        self.reminders = Backend()
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument('--tasks', type=int, default=10000)
+    parser.add_argument('--recurring', type=float, default=0.2, help='fraction of tasks that repeat')
+    parser.add_argument('--completed', type=float, default=0.5, help='fraction of tasks that are completed')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every step, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+def best(repeat, target):
+    times = []
+    for i in range(repeat):
+        start = perf_counter()
+        target()
+        times.append(perf_counter() - start)
+    return min(times)
+
+def report(name, elapsed, count):
+    print(f'{name:<28}{elapsed:8.3f} s  {elapsed / count * 1e6:8.1f} us/task')
+
+def new_todos(ical, etags):
+    # a fresh object every run, the parsed component is cached on it
+    todos = []
+    for index, data in enumerate(ical):
+        props = {'{DAV:}getetag': f'"{index}"'} if etags else {}
+        todos.append(Todo(client=None, data=data, props=props))
+    return todos
+
+def main():
+    args = parse_args()
+    tasks = synthetic.generate(1, 1, args.tasks, args.recurring, args.completed, NOW, args.seed)[0][0]['tasks']
+    graph = [synthetic.to_graph(task) for task in tasks]
+    ical = [synthetic.to_ical(task) for task in tasks]
+    to_do = ToDo()
+    dav = DAV()
+    count = len(tasks)
+
+    print(f'tasks:          {count}')
+
+    report('ms etag:', best(args.repeat, lambda: [to_do.get_etag(task) for task in graph]), count)
+    report('ms to reminder:', best(args.repeat, lambda: [to_do.task_to_reminder(task, 'list', Reminder()) for task in graph]), count)
+
+    todos = new_todos(ical, True)
+    report('caldav etag:', best(args.repeat, lambda: [dav.get_etag(todo) for todo in todos]), count)
+    todos = new_todos(ical, False)
+    report('caldav etag (fingerprint):', best(args.repeat, lambda: [dav.get_etag(todo) for todo in todos]), count)
+
+    def parse():
+        for todo in new_todos(ical, True):
+            todo.icalendar_component
+    report('caldav parse:', best(args.repeat, parse), count)
+
+    components = [todo.icalendar_component for todo in new_todos(ical, True)]
+    report('caldav to reminder:', best(args.repeat, lambda: [dav.task_to_reminder(component, 'list', Reminder()) for component in components]), count)
+
+if __name__ == '__main__':
+    main()
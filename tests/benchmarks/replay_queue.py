@@ -0,0 +1,201 @@
+# replay_queue.py
+# Copyright (C) 2023 Sasha Hale <dgsasha04@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of  MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Replays a queue of operations across several accounts against servers that only simulate a round trip
+
+usage: python tests/benchmarks/replay_queue.py [--operations 1000] [--accounts 3] [--latency 0.02]
+'''
+
+import sys
+
+from os import path
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from support import load_package
+load_package()
+
+from reminders.clock import VirtualClock
+from reminders.service import queue
+from reminders.service.backend import Reminders, REMOTE_WORKERS
+from reminders.service.countdowns import Countdowns
+from reminders.service.ms_to_do import BATCH_LIMIT
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import sleep, perf_counter
+from uuid import uuid4
+
+class Server():
+    '''Counts requests and how many of them are in flight at once'''
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.peak = 0
+
+    def request(self):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            sleep(self.latency)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        return str(uuid4())
+
+class ToDo():
+    def __init__(self, server):
+        self.server = server
+        self.users = {}
+
+    def reminder_to_task(self, reminder, **kwargs):
+        return {'title': reminder['title']}
+
+    def create_list(self, user_id, list_name):
+        return self.server.request()
+
+    def update_list(self, user_id, list_id, list_name):
+        self.server.request()
+
+    def create_tasks(self, user_id, tasks):
+        keys = list(tasks.keys())
+        results = {}
+        for start in range(0, len(keys), BATCH_LIMIT):
+            self.server.request()
+            for key in keys[start:start + BATCH_LIMIT]:
+                results[key] = str(uuid4())
+        return results
+
+    def update_tasks(self, user_id, tasks):
+        keys = list(tasks.keys())
+        for start in range(0, len(keys), BATCH_LIMIT):
+            self.server.request()
+        return {key: {'status': 'completed'} for key in keys}
+
+class CalDAV():
+    def __init__(self, server):
+        self.server = server
+        self.users = {}
+
+    def create_list(self, user_id, list_name):
+        return self.server.request()
+
+    def update_list(self, user_id, list_id, list_name):
+        self.server.request()
+
+class Backend():
+    '''Just enough of Reminders to replay the queue, everything between the queue and the server is the real code'''
+    _remote_each = Reminders._remote_each
+    _remote_batches = Reminders._remote_batches
+    _get_location = Reminders._get_location
+    _remote_create_list = Reminders._remote_create_list
+    _remote_rename_list = Reminders._remote_rename_list
+    _remote_create_reminderv = Reminders._remote_create_reminderv
+    _ms_create_reminderv = Reminders._ms_create_reminderv
+    _remote_set_completedv = Reminders._remote_set_completedv
+    _ms_set_completedv = Reminders._ms_set_completedv
+    _ms_completed_json = Reminders._ms_completed_json
+    _ms_completed_recurring = Reminders._ms_completed_recurring
+    _timestamp_to_rfc = Reminders._timestamp_to_rfc
+    _write_back = Reminders._write_back
+    _apply_write_back = Reminders._apply_write_back
+
+    def __init__(self, server):
+        self.server = server
+        self.clock = VirtualClock()
+        self.countdowns = Countdowns(self.clock)
+        self.to_do = ToDo(server)
+        self.caldav = CalDAV(server)
+        self.remote_pool = ThreadPoolExecutor(max_workers=REMOTE_WORKERS)
+        self.lists = {}
+        self.reminders = {}
+
+    # a caldav task is one request each
+    def _remote_create_reminder(self, reminder_id):
+        return self.server.request()
+
+    def _remote_set_completed(self, reminder_id, reminder):
+        self.server.request()
+
+    def _save_reminders(self):
+        return False
+
+    def _save_lists(self):
+        return False
+
+def fill(backend, operations, accounts):
+    '''Queues creates, completes and renames spread evenly over the accounts, completes depend on their create'''
+    reminders_queue = queue.ReminderQueue(backend)
+    queued = 0
+    lists_per_account = 10
+    user_ids = []
+    for account in range(accounts):
+        user_id = f'account-{account}'
+        user_ids.append(user_id)
+        # the first account is microsoft to do so batching is covered as well
+        (backend.to_do if account == 0 else backend.caldav).users[user_id] = {}
+
+    i = 0
+    while queued < operations:
+        user_id = user_ids[i % accounts]
+        list_id = f'{user_id}-list-{i // accounts % lists_per_account}'
+        if list_id not in backend.lists:
+            backend.lists[list_id] = {'user-id': user_id, 'uid': '', 'name': list_id}
+            reminders_queue.add_list(list_id)
+            queued += 1
+        reminder_id = f'reminder-{queued}'
+        backend.reminders[reminder_id] = {'title': reminder_id, 'list-id': list_id, 'uid': '', 'completed': True, 'completed-date': 0}
+        reminders_queue.create_reminder(reminder_id)
+        queued += 1
+        if queued % 3 == 0 and queued < operations:
+            reminders_queue.update_completed(reminder_id)
+            queued += 1
+        i += 1
+
+    return reminders_queue
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--operations', type=int, default=1000)
+    parser.add_argument('--accounts', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per simulated request')
+    args = parser.parse_args()
+
+    server = Server(args.latency)
+    backend = Backend(server)
+    reminders_queue = fill(backend, args.operations, args.accounts)
+    queued = len(reminders_queue.entries)
+    # as if connectivity just came back, everything was queued while the accounts were offline
+    reminders_queue.backoff.clear()
+
+    start = perf_counter()
+    reminders_queue.load()
+    elapsed = perf_counter() - start
+
+    print(f'operations:       {queued} across {args.accounts} accounts')
+    print(f'left in queue:    {len(reminders_queue.entries)}')
+    print(f'wall time:        {elapsed:.3f} s')
+    print(f'throughput:       {queued / elapsed:.0f} operations/s')
+    print(f'requests:         {server.requests}')
+    print(f'peak in flight:   {server.peak} (replay workers {queue.REPLAY_WORKERS}, remote workers {REMOTE_WORKERS})')
+
+    backend.remote_pool.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# scheduler.py
+# Copyright (C) 2023 Sasha Hale <dgsasha04@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of  MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Fires countdowns on a virtual clock, first as time passes normally and then all at once as if waking from suspend
+
+Throughput is countdowns fired per second of wall time. Lateness is how far past its deadline each countdown fired in
+virtual time, and stall is how long each timeout held the main loop in wall time, so jitter shows up in both.
+
+usage: python tests/benchmarks/scheduler.py [--countdowns 10000] [--days 7] [--repeating 0.2] [--churn 0.1] [--step 1]
+'''
+
+import sys
+
+from os import path
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from support import load_package
+load_package()
+
+from reminders.clock import VirtualClock
+from reminders.service.countdowns import Countdowns
+
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+
+DAY = 24 * 60 * 60
+
+class TimedClock(VirtualClock):
+    '''Records how long every timeout callback takes in wall time'''
+    def __init__(self, start):
+        super().__init__(start)
+        self.stalls = []
+
+    def timeout_add(self, interval, callback, *args):
+        def timed(*args):
+            start = perf_counter()
+            try:
+                return callback(*args)
+            finally:
+                self.stalls.append(perf_counter() - start)
+        return super().timeout_add(interval, timed, *args)
+
+class Load():
+    '''Countdowns spread over a number of days, some repeat like recurring reminders and some are replaced or removed before they fire'''
+    def __init__(self, clock, countdowns, args, seed):
+        self.clock = clock
+        self.countdowns = countdowns
+        self.random = Random(seed)
+        self.end = clock.time() + args.days * DAY
+        self.repeating = args.repeating
+        self.churn = args.churn
+        # {countdown_id: deadline}
+        self.deadlines = {}
+        self.lateness = []
+        self.fired = 0
+
+        ids = [f'countdown-{i}' for i in range(args.countdowns)]
+        for countdown_id in ids:
+            self.add(countdown_id, clock.time() + self.random.uniform(0, args.days * DAY))
+        # the same as reminders being edited or removed before they are due
+        for countdown_id in self.random.sample(ids, int(len(ids) * self.churn)):
+            if self.random.random() < 0.5:
+                self.countdowns.remove_countdown(countdown_id)
+                self.deadlines.pop(countdown_id)
+            else:
+                self.add(countdown_id, clock.time() + self.random.uniform(0, args.days * DAY))
+
+    def add(self, countdown_id, deadline):
+        self.deadlines[countdown_id] = deadline
+        self.countdowns.add_countdown(deadline, lambda: self.fire(countdown_id), countdown_id)
+
+    def fire(self, countdown_id):
+        deadline = self.deadlines.pop(countdown_id)
+        self.lateness.append(self.clock.time() - deadline)
+        self.fired += 1
+        # a recurring reminder is counted down again for its next occurrence
+        if self.random.random() < self.repeating:
+            following = deadline + self.random.choice((60 * 60, DAY, 7 * DAY))
+            if following < self.end:
+                self.add(countdown_id, following)
+
+class Waking():
+    '''The parameters of PrepareForSleep after resuming'''
+    def unpack(self):
+        return (False,)
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def report(name, load, clock, elapsed, lateness = True):
+    print(f'{name}')
+    print(f'  fired:        {load.fired} in {elapsed:.3f} s, {load.fired / elapsed:.0f} countdowns/s')
+    print(f'  timeouts:     {len(clock.stalls)}')
+    if lateness:
+        print(f'  lateness:     p50 {percentile(load.lateness, 0.5) * 1000:.3f} ms, p99 {percentile(load.lateness, 0.99) * 1000:.3f} ms, max {max(load.lateness, default=0) * 1000:.3f} ms (virtual)')
+    print(f'  stall:        p50 {percentile(clock.stalls, 0.5) * 1e6:.0f} us, p99 {percentile(clock.stalls, 0.99) * 1e6:.0f} us, max {max(clock.stalls, default=0) * 1e6:.0f} us (wall)')
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--countdowns', type=int, default=10000)
+    parser.add_argument('--days', type=float, default=7, help='how far ahead the countdowns are spread')
+    parser.add_argument('--repeating', type=float, default=0.2, help='fraction of fired countdowns that are added again')
+    parser.add_argument('--churn', type=float, default=0.1, help='fraction of countdowns replaced or removed before they fire')
+    parser.add_argument('--step', type=float, default=1, help='seconds of virtual time per main loop iteration')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    clock = TimedClock(1700000000)
+    countdowns = Countdowns(clock)
+    start = perf_counter()
+    load = Load(clock, countdowns, args, args.seed)
+    print(f'scheduled:      {args.countdowns} countdowns over {args.days:g} days in {perf_counter() - start:.3f} s')
+
+    start = perf_counter()
+    while clock.time() < load.end:
+        clock.advance(args.step)
+    report('running:', load, clock, perf_counter() - start)
+
+    clock = TimedClock(1700000000)
+    countdowns = Countdowns(clock)
+    load = Load(clock, countdowns, args, args.seed)
+    # the whole span passes at once and everything that came due fires when waking up
+    start = perf_counter()
+    clock.now = load.end
+    countdowns.on_wake_from_suspend(None, None, None, None, None, Waking())
+    clock.stalls.append(perf_counter() - start)
+    # recurring countdowns that were added again for a time that already passed
+    clock.advance(0)
+    # how late they are is only how long the suspend was
+    report('after suspend:', load, clock, perf_counter() - start, False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# sync.py
+# Copyright (C) 2023 Sasha Hale <dgsasha04@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of  MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Replays a full sync and the refreshes after it, from synthetic accounts or from a recording
+
+A recording is made by running the service with REMINDERS_RECORD_DIR set, it is already scrubbed of account names,
+servers and tokens. Everything between the recorded responses and the merged reminders is the real code.
+
+usage: python tests/benchmarks/sync.py [--ms-accounts 2] [--caldav-accounts 2] [--lists 5] [--tasks 1000]
+                                       [--recurring 0.2] [--completed 0.5] [--refreshes 3] [--recording DIR]
+'''
+
+import sys
+
+from argparse import ArgumentParser
+from os import path, environ
+from subprocess import run
+from tempfile import mkdtemp
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument('--ms-accounts', type=int, default=2)
+    parser.add_argument('--caldav-accounts', type=int, default=2)
+    parser.add_argument('--lists', type=int, default=5, help='lists per account')
+    parser.add_argument('--tasks', type=int, default=1000, help='tasks per list')
+    parser.add_argument('--recurring', type=float, default=0.2, help='fraction of tasks that repeat')
+    parser.add_argument('--completed', type=float, default=0.5, help='fraction of tasks that are completed')
+    parser.add_argument('--refreshes', type=int, default=3, help='refreshes after the first sync, nothing changes on the server between them')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--recording', help='replay a recording from REMINDERS_RECORD_DIR instead of synthetic accounts')
+    # used internally, the CalDAV accounts are recorded in a child process since the mode is read when caldav.py is imported
+    parser.add_argument('--record-caldav', help=None)
+    return parser.parse_args()
+
+args = parse_args()
+if args.record_caldav is not None:
+    environ['REMINDERS_RECORD_DIR'] = args.record_caldav
+else:
+    if args.recording is None:
+        args.recording = mkdtemp(prefix='reminders-sync-')
+        args.synthetic = True
+    else:
+        args.synthetic = False
+    environ['REMINDERS_REPLAY_DIR'] = args.recording
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from support import load_package
+load_package()
+
+from reminders.clock import VirtualClock
+from reminders.service.backend import Reminders
+from reminders.service.caldav import CalDAV
+from reminders.service.ms_to_do import MSToDo
+from reminders.service.queue import ReminderQueue
+
+from json import dumps
+from time import perf_counter
+from tracemalloc import start as start_tracing, stop as stop_tracing, get_traced_memory
+
+import synthetic
+
+class Settings():
+    def __init__(self, synced_ids):
+        self.synced_ids = synced_ids
+
+    def get_value(self, key):
+        return Value(self.synced_ids)
+
+    def get_int(self, key):
+        # completed tasks are all fetched, the synthetic ones are spread over months
+        return 0
+
+    def get_boolean(self, key):
+        return False
+
+class Value():
+    def __init__(self, value):
+        self.value = value
+
+    def unpack(self):
+        return self.value
+
+class Credentials():
+    '''The only accounts are the ones in the recording, nothing is looked up or stored'''
+    def __init__(self, caldav_users = None):
+        self.caldav_users = caldav_users
+
+    def lookup(self, name):
+        if name == 'caldav' and self.caldav_users is not None:
+            return dumps(self.caldav_users)
+        return None
+
+    def store(self, *args):
+        pass
+
+class App():
+    def __init__(self, synced_ids):
+        self.settings = Settings(synced_ids)
+
+class Backend():
+    '''Just enough of Reminders to sync, everything between the recorded responses and the merged reminders is the real code'''
+    _sync_remote = Reminders._sync_remote
+    _merge_ms_tasks = Reminders._merge_ms_tasks
+    _remote_unchanged = Reminders._remote_unchanged
+    _remote_changed = Reminders._remote_changed
+    _merge_remote = Reminders._merge_remote
+    _keep_list = Reminders._keep_list
+    _do_generate_id = Reminders._do_generate_id
+    _rfc_to_timestamp = Reminders._rfc_to_timestamp
+    _timestamp_to_rfc = Reminders._timestamp_to_rfc
+
+    def __init__(self, now, caldav_users = None):
+        self.clock = VirtualClock(now)
+        self.app = App([])
+        self.credentials = Credentials(caldav_users)
+        self.remote_base = {}
+        self.queue = ReminderQueue(self)
+        self.caldav = CalDAV(self)
+        self.caldav.load_accounts()
+        # only CalDAV is recorded by the stand in, the Microsoft To Do recording is already written
+        if caldav_users is None:
+            self.to_do = MSToDo(self)
+            self.to_do.load_accounts()
+        # every account is synced
+        self.synced_ids = list(self.caldav.users.keys()) + (list(self.to_do.users.keys()) if caldav_users is None else [])
+        self.app.settings.synced_ids = self.synced_ids
+
+    def do_emit(self, *args):
+        pass
+
+def record_caldav():
+    '''Serves the synthetic CalDAV accounts locally and records one sync of them'''
+    accounts = synthetic.generate(args.caldav_accounts, args.lists, args.tasks, args.recurring, args.completed, NOW, args.seed + 1)
+    server = synthetic.StandIn(accounts)
+    server.start()
+    backend = Backend(NOW, server.users())
+    task_lists, not_synced = backend.caldav.get_lists([], {}, backend.synced_ids)
+    if len(not_synced) > 0:
+        sys.exit(f'Failed to record {not_synced}')
+    server.shutdown()
+
+def write_synthetic():
+    accounts = synthetic.generate(args.ms_accounts, args.lists, args.tasks, args.recurring, args.completed, NOW, args.seed)
+    synthetic.write_graph(args.recording, accounts, NOW)
+    if args.caldav_accounts > 0:
+        env = environ.copy()
+        env.pop('REMINDERS_REPLAY_DIR')
+        run([sys.executable, __file__, '--record-caldav', args.recording, '--caldav-accounts', str(args.caldav_accounts),
+            '--lists', str(args.lists), '--tasks', str(args.tasks), '--recurring', str(args.recurring),
+            '--completed', str(args.completed), '--seed', str(args.seed)], env=env, check=True)
+    else:
+        with open(f'{args.recording}/caldav_users.json', 'w') as recording:
+            recording.write(dumps({}))
+
+def sync(backend, reminders, lists):
+    start = perf_counter()
+    reminders, lists = backend._sync_remote(reminders, lists, False)
+    return reminders, lists, perf_counter() - start
+
+def report(name, backend, elapsed):
+    stats = backend.sync_stats
+    print(f'{name:<16}{elapsed:8.3f} s  {stats["ms-requests"]:6} MS requests {stats["ms-bytes"]:>11} bytes  {stats["caldav-requests"]:6} CalDAV requests {stats["caldav-bytes"]:>11} bytes')
+
+def main():
+    if args.synthetic:
+        write_synthetic()
+
+    backend = Backend(None)
+    now = backend.to_do.recorded_at
+    backend.clock = VirtualClock(now)
+
+    reminders, lists, elapsed = sync(backend, {}, {})
+    print(f'accounts:       {len(backend.to_do.users)} Microsoft To Do, {len(backend.caldav.users)} CalDAV')
+    print(f'lists:          {len(lists)}')
+    print(f'reminders:      {len(reminders)}')
+    report('first sync:', backend, elapsed)
+    for refresh in range(args.refreshes):
+        reminders, lists, elapsed = sync(backend, reminders, lists)
+        report(f'refresh {refresh + 1}:', backend, elapsed)
+
+    # tracing slows everything down, so memory is measured on a separate first sync
+    backend = Backend(None)
+    backend.clock = VirtualClock(now)
+    start_tracing()
+    reminders, lists, elapsed = sync(backend, {}, {})
+    current, peak = get_traced_memory()
+    stop_tracing()
+    print(f'sync peak memory: {peak // 1024} KiB allocated while syncing, {current // 1024} KiB still held after')
+
+# synthetic accounts are generated around a fixed day so runs can be compared
+NOW = 1700000000
+
+if __name__ == '__main__':
+    if args.record_caldav is not None:
+        record_caldav()
+    else:
+        main()
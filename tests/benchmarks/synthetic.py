@@ -0,0 +1,287 @@
+# synthetic.py
+# Copyright (C) 2023 Sasha Hale <dgsasha04@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of  MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Synthetic accounts for the sync benchmark
+
+Microsoft To Do accounts are written straight to a recording that MSToDo can replay. CalDAV requests are
+XML built by the caldav library, so CalDAV accounts are served by StandIn and recorded from it instead.
+'''
+
+import datetime
+
+from reminders.service.ms_to_do import GRAPH, PAGE_SIZE, TASK_FIELDS, DAYS, page_url
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from json import dumps
+from random import Random
+from threading import Thread
+from uuid import UUID
+from xml.sax.saxutils import escape
+
+REPEATS = ('daily', 'weekly', 'absoluteMonthly', 'absoluteYearly')
+FREQUENCIES = {
+    'daily': 'DAILY',
+    'weekly': 'WEEKLY',
+    'absoluteMonthly': 'MONTHLY',
+    'absoluteYearly': 'YEARLY'
+}
+DAY = 24 * 60 * 60
+
+def generate(accounts, lists, tasks, recurring, completed, now, seed = 0):
+    '''Returns a list of accounts, each a list of {'id', 'name', 'tasks'}, the same for the same arguments'''
+    random = Random(seed)
+    today = now - now % DAY
+
+    def new_id():
+        return str(UUID(int=random.getrandbits(128)))
+
+    result = []
+    for account in range(accounts):
+        task_lists = []
+        for list_index in range(lists):
+            list_tasks = []
+            for task_index in range(tasks):
+                day = today + random.randint(-60, 60) * DAY
+                # half of them notify at a time, the rest only have a due date
+                timestamp = day + random.randint(8, 20) * 60 * 60 if random.random() < 0.5 else 0
+                repeat = None
+                if random.random() < recurring:
+                    repeat_type = random.choice(REPEATS)
+                    days = sorted(random.sample(range(7), random.randint(1, 3))) if repeat_type == 'weekly' else []
+                    repeat = (repeat_type, random.randint(1, 3), days)
+                is_completed = random.random() < completed
+                created = day - random.randint(1, 90) * DAY
+                list_tasks.append({
+                    'id': new_id(),
+                    'title': f'Task {task_index}',
+                    'description': f'Synthetic task {task_index} in list {list_index}' if random.random() < 0.3 else '',
+                    'important': random.random() < 0.1,
+                    'timestamp': timestamp,
+                    'due-date': day,
+                    'repeat': repeat,
+                    'completed': is_completed,
+                    'created': created,
+                    'modified': created + random.randint(0, 30) * DAY,
+                    'completed-at': day + 60 * 60 if is_completed else 0
+                })
+            task_lists.append({
+                'id': new_id(),
+                'name': f'List {list_index}',
+                'tasks': list_tasks
+            })
+        result.append(task_lists)
+    return result
+
+def graph_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.0000000')
+
+def to_graph(task):
+    value = {
+        '@odata.etag': f'W/"{task["id"]}-{task["modified"]}"',
+        'id': task['id'],
+        'title': task['title'],
+        'body': {'content': task['description'], 'contentType': 'text'},
+        'importance': 'high' if task['important'] else 'normal',
+        'status': 'completed' if task['completed'] else 'notStarted',
+        'createdDateTime': graph_time(task['created']) + 'Z',
+        'lastModifiedDateTime': graph_time(task['modified']) + 'Z'
+    }
+    if task['timestamp'] != 0:
+        value['isReminderOn'] = True
+        value['reminderDateTime'] = {'dateTime': graph_time(task['timestamp']), 'timeZone': 'UTC'}
+    else:
+        value['isReminderOn'] = False
+    value['dueDateTime'] = {'dateTime': graph_time(task['due-date']), 'timeZone': 'UTC'}
+    if task['completed']:
+        value['completedDateTime'] = {'dateTime': graph_time(task['completed-at']), 'timeZone': 'UTC'}
+    if task['repeat'] is not None:
+        repeat_type, interval, days = task['repeat']
+        value['recurrence'] = {
+            'pattern': {
+                'type': repeat_type,
+                'interval': interval,
+                'daysOfWeek': [DAYS[day] for day in days],
+                'firstDayOfWeek': 'monday'
+            },
+            'range': {
+                'type': 'noEnd',
+                'startDate': graph_time(task['due-date'])[:10]
+            }
+        }
+    return value
+
+def write_graph(directory, accounts, now):
+    '''Writes users.json and graph.jsonl the same way MSToDo records a sync'''
+    users = {}
+    records = []
+
+    def record(user_id, url, body):
+        records.append(dumps({'user': user_id, 'method': 'GET', 'url': url, 'data': None, 'status': 200, 'body': dumps(body)}))
+
+    for index, task_lists in enumerate(accounts):
+        user_id = f'user{index}'
+        email = f'user{index}@example.com'
+        users[user_id] = {'email': email, 'local-id': ''}
+        record(user_id, 'me/todo/lists', {'value': [{
+            'id': task_list['id'],
+            'displayName': task_list['name'],
+            'wellknownListName': 'defaultList' if list_index == 0 else 'none'
+        } for list_index, task_list in enumerate(task_lists)]})
+
+        for task_list in task_lists:
+            tasks = [to_graph(task) for task in task_list['tasks']]
+            url = page_url(f"me/todo/lists/{task_list['id']}/tasks", PAGE_SIZE, TASK_FIELDS)
+            for start in range(0, max(len(tasks), 1), PAGE_SIZE):
+                body = {'value': tasks[start:start + PAGE_SIZE]}
+                next_url = None
+                if start + PAGE_SIZE < len(tasks):
+                    next_url = f"me/todo/lists/{task_list['id']}/tasks?$top={PAGE_SIZE}&$skip={start + PAGE_SIZE}"
+                    body['@odata.nextLink'] = f'{GRAPH}/{next_url}'
+                record(user_id, url, body)
+                url = next_url
+
+    with open(f'{directory}/users.json', 'w') as recording:
+        recording.write(dumps({'recorded-at': now, 'users': users}))
+    with open(f'{directory}/graph.jsonl', 'w') as recording:
+        recording.write('\n'.join(records) + '\n')
+
+def ical_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+def to_ical(task):
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Reminders//Benchmark//EN',
+        'BEGIN:VTODO',
+        f"UID:{task['id']}",
+        f"DTSTAMP:{ical_time(task['created'])}",
+        f"LAST-MODIFIED:{ical_time(task['modified'])}",
+        f"SUMMARY:{task['title']}"
+    ]
+    if task['description'] != '':
+        lines.append(f"DESCRIPTION:{task['description']}")
+    if task['important']:
+        lines.append('PRIORITY:1')
+    if task['timestamp'] != 0:
+        lines.append(f"DUE:{ical_time(task['timestamp'])}")
+    else:
+        lines.append(f"DUE;VALUE=DATE:{ical_time(task['due-date'])[:8]}")
+    if task['repeat'] is not None:
+        repeat_type, interval, days = task['repeat']
+        rule = f'RRULE:FREQ={FREQUENCIES[repeat_type]};INTERVAL={interval}'
+        if len(days) > 0:
+            rule += ';BYDAY=' + ','.join(DAYS[day][:2].upper() for day in days)
+        lines.append(rule)
+    if task['completed']:
+        lines.append('STATUS:COMPLETED')
+        lines.append(f"COMPLETED:{ical_time(task['completed-at'])}")
+    else:
+        lines.append('STATUS:NEEDS-ACTION')
+    lines += ['END:VTODO', 'END:VCALENDAR']
+    return '\r\n'.join(lines) + '\r\n'
+
+class StandIn(ThreadingHTTPServer):
+    '''A local CalDAV server for synthetic accounts that only answers what a sync asks for'''
+    daemon_threads = True
+
+    def __init__(self, accounts):
+        super().__init__(('127.0.0.1', 0), Handler)
+        # {user: {list_id: {'name', 'tasks'}}}
+        self.accounts = {}
+        for index, task_lists in enumerate(accounts):
+            self.accounts[f'user{index}'] = {task_list['id']: task_list for task_list in task_lists}
+
+    def start(self):
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    def users(self):
+        '''The accounts the way CalDAV stores them'''
+        users = {}
+        for user in self.accounts.keys():
+            home = f'http://127.0.0.1:{self.server_port}/dav/{user}/'
+            users[f'caldav-{user}'] = {
+                'name': user,
+                'url': home,
+                'username': user,
+                'password': 'password',
+                'principal-url': home,
+                'calendar-home-url': home
+            }
+        return users
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _multistatus(self, responses):
+        body = '<?xml version="1.0" encoding="utf-8"?>\n<d:multistatus xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">'
+        for href, props in responses:
+            body += f'<d:response><d:href>{href}</d:href><d:propstat><d:prop>{props}</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>'
+        body += '</d:multistatus>'
+        data = body.encode()
+        self.send_response(207)
+        self.send_header('Content-Type', 'application/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self):
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _resolve(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        parts = self.path.strip('/').split('/')
+        if len(parts) < 2 or parts[0] != 'dav' or parts[1] not in self.server.accounts:
+            return None, None
+        task_lists = self.server.accounts[parts[1]]
+        if len(parts) == 2:
+            return parts[1], None
+        if parts[2] in task_lists:
+            return parts[1], parts[2]
+        return None, None
+
+    def _calendar_props(self, task_list):
+        return (f"<d:displayname>{escape(task_list['name'])}</d:displayname>"
+            '<d:resourcetype><d:collection/><c:calendar/></d:resourcetype>'
+            '<c:supported-calendar-component-set><c:comp name="VTODO"/></c:supported-calendar-component-set>')
+
+    def do_PROPFIND(self):
+        user, list_id = self._resolve()
+        if user is None:
+            self._not_found()
+            return
+        task_lists = self.server.accounts[user]
+        if list_id is not None:
+            self._multistatus([(f'/dav/{user}/{list_id}/', self._calendar_props(task_lists[list_id]))])
+            return
+        responses = [(f'/dav/{user}/', f'<d:displayname>{user}</d:displayname><d:resourcetype><d:collection/></d:resourcetype>')]
+        if self.headers.get('Depth', '0') != '0':
+            for task_list_id, task_list in task_lists.items():
+                responses.append((f'/dav/{user}/{task_list_id}/', self._calendar_props(task_list)))
+        self._multistatus(responses)
+
+    def do_REPORT(self):
+        user, list_id = self._resolve()
+        if list_id is None:
+            self._not_found()
+            return
+        responses = []
+        for task in self.server.accounts[user][list_id]['tasks']:
+            props = f'<d:getetag>"{task["id"]}-{task["modified"]}"</d:getetag><c:calendar-data>{escape(to_ical(task))}</c:calendar-data>'
+            responses.append((f"/dav/{user}/{list_id}/{task['id']}.ics", props))
+        self._multistatus(responses)
@@ -0,0 +1,76 @@
+# support.py
+# Copyright (C) 2023 Sasha Hale <dgsasha04@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of  MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Makes src importable as the reminders package without installing it, used by the tests and the benchmarks'''
+
+import sys
+
+from importlib.util import spec_from_file_location, module_from_spec
+from os import path, environ, mkdir, makedirs
+from re import sub
+from tempfile import mkdtemp
+
+ROOT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+SRC_DIR = path.join(ROOT_DIR, 'src')
+INTERFACE_FILE = path.join(ROOT_DIR, 'data', 'service', 'io.github.remindersdevs.Reminders.Service.xml.in')
+
+# the values meson fills into info.py, see src/meson.build
+CONFIGURATION = {
+    'VERSION': '5.0',
+    'PROJECT_NAME': 'reminders',
+    'BASE_APP_ID': 'io.github.remindersdevs.Reminders',
+    'APP_ID': 'io.github.remindersdevs.Reminders.Devel',
+    'APP_EXECUTABLE': 'reminders',
+    'APP_OBJECT': '/io/github/remindersdevs/Reminders/Devel',
+    'SERVICE_EXECUTABLE': 'reminders-service',
+    'SERVICE_ID': 'io.github.remindersdevs.Reminders.Devel.Service',
+    'SERVICE_INTERFACE': 'io.github.remindersdevs.Reminders.Devel.Service',
+    'SERVICE_OBJECT': '/io/github/remindersdevs/Reminders/Devel/Service',
+    'SERVICE_PATH': '/usr/libexec/reminders-service',
+    'PORTALS_ENABLED': 'False',
+    'CLIENT_ID': '',
+    'INTERFACES_DIR': None
+}
+
+def configure(source):
+    return sub(r'@(\w+)@', lambda match: CONFIGURATION[match.group(1)], source)
+
+def load_package():
+    '''Imports src as reminders, configured the same way meson would with everything it writes in a temporary directory'''
+    if 'reminders' in sys.modules:
+        return sys.modules['reminders']
+
+    root = mkdtemp(prefix='reminders-test-')
+    # nothing is ever written to the real data dir, this has to be set before GLib first looks it up
+    environ['XDG_DATA_HOME'] = path.join(root, 'data')
+    CONFIGURATION['INTERFACES_DIR'] = path.join(root, 'interfaces')
+    mkdir(CONFIGURATION['INTERFACES_DIR'])
+    with open(INTERFACE_FILE, 'r') as source, open(path.join(CONFIGURATION['INTERFACES_DIR'], f"{CONFIGURATION['SERVICE_INTERFACE']}.xml"), 'w') as interface:
+        interface.write(configure(source.read()))
+
+    spec = spec_from_file_location('reminders', path.join(SRC_DIR, '__init__.py'), submodule_search_locations=[SRC_DIR])
+    package = module_from_spec(spec)
+    sys.modules['reminders'] = package
+    spec.loader.exec_module(package)
+
+    with open(path.join(SRC_DIR, 'info.py'), 'r') as info_file:
+        source = configure(info_file.read())
+    info = module_from_spec(spec_from_file_location('reminders.info', path.join(SRC_DIR, 'info.py')))
+    exec(compile(source, info.__file__, 'exec'), info.__dict__)
+    sys.modules['reminders.info'] = info
+    package.info = info
+    makedirs(info.data_dir, exist_ok=True)
+
+    return package
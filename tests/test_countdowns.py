@@ -0,0 +1,128 @@
+# test_countdowns.py
+# Copyright (C) 2023 Sasha Hale <dgsasha04@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of  MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+pytest.importorskip('gi')
+
+from support import load_package
+load_package()
+
+from reminders.clock import VirtualClock
+from reminders.service.backend import Reminders
+from reminders.service.countdowns import Countdowns, HORIZON
+from reminders.service.due_index import DueIndex
+
+from random import Random
+
+START = 1700000000
+DAY = 24 * 60 * 60
+REMINDERS = 50000
+
+class Waking():
+    '''The parameters of PrepareForSleep after resuming'''
+    def unpack(self):
+        return (False,)
+
+class Backend():
+    '''The countdown handling of Reminders on a virtual clock, a notification is only recorded'''
+    start_countdowns = Reminders.start_countdowns
+    _set_countdown = Reminders._set_countdown
+    _remove_countdown = Reminders._remove_countdown
+    _countdown_callback = Reminders._countdown_callback
+    _pending_countdowns = Reminders._pending_countdowns
+
+    def __init__(self, reminders):
+        self.clock = VirtualClock(START)
+        self.countdowns = Countdowns(self.clock)
+        self.due_index = DueIndex(self.clock)
+        self.reminders = reminders
+        self.refresh_time = 15
+        self.wall_clock = set()
+        # [(reminder_id, when it was shown)]
+        self.shown = []
+
+    def _refresh_cb(self):
+        return False
+
+    def _update_wall_clock(self, reminder_id):
+        # the timezone never changes here
+        pass
+
+    def show_notification(self, reminder_id):
+        self.shown.append((reminder_id, self.clock.time()))
+        self.reminders[reminder_id]['shown'] = True
+
+def new_reminders(count, days, seed = 0):
+    random = Random(seed)
+    reminders = {}
+    for i in range(count):
+        reminders[f'reminder-{i}'] = {
+            'timestamp': START + random.randint(60, days * DAY),
+            'due-date': 0,
+            'completed': random.random() < 0.1,
+            'shown': False
+        }
+    return reminders
+
+@pytest.fixture
+def backend():
+    backend = Backend(new_reminders(REMINDERS, 7))
+    backend.start_countdowns()
+    return backend
+
+def test_only_horizon_is_admitted(backend):
+    within = [reminder_id for reminder_id, reminder in backend.reminders.items() if not reminder['completed'] and reminder['timestamp'] <= START + HORIZON]
+    # the refresh timeout is counted down as well
+    assert set(backend.countdowns.dict.keys()) == set(within) | {'refresh'}
+
+def test_multi_day_suspend(backend):
+    incomplete = {reminder_id for reminder_id, reminder in backend.reminders.items() if not reminder['completed']}
+
+    # an hour passes normally
+    backend.clock.advance(60 * 60)
+    before_suspend = len(backend.shown)
+
+    # nothing runs while suspended, three days later every countdown that was passed fires in one go
+    wake = backend.clock.time() + 3 * DAY
+    backend.clock.now = wake
+    future = {countdown_id: countdown['sequence'] for countdown_id, countdown in backend.countdowns.dict.items() if countdown.get('timestamp', 0) > wake}
+    backend.countdowns.on_wake_from_suspend(None, None, None, None, None, Waking())
+
+    missed = {reminder_id for reminder_id in incomplete if backend.reminders[reminder_id]['timestamp'] <= wake}
+    caught_up = backend.shown[before_suspend:]
+    assert {reminder_id for reminder_id, when in backend.shown} == missed
+    assert all(when == wake for reminder_id, when in caught_up)
+
+    # the countdowns that are still in the future weren't touched
+    for countdown_id, sequence in future.items():
+        if countdown_id != 'refresh':
+            assert backend.countdowns.dict[countdown_id]['sequence'] == sequence
+
+    # the rest fire on time as the sweeps admit them
+    backend.clock.advance(7 * DAY)
+    shown = [reminder_id for reminder_id, when in backend.shown]
+    assert len(shown) == len(set(shown))
+    assert set(shown) == incomplete
+    for reminder_id, when in backend.shown[:before_suspend] + backend.shown[len(missed):]:
+        assert 0 <= when - backend.reminders[reminder_id]['timestamp'] < 1
+
+def test_completed_while_far_away(backend):
+    # a reminder past the horizon that is completed before a sweep reaches it never fires
+    reminder_id, reminder = next((reminder_id, reminder) for reminder_id, reminder in backend.reminders.items() if not reminder['completed'] and reminder['timestamp'] > START + 3 * DAY)
+    reminder['completed'] = True
+    backend._set_countdown(reminder_id)
+    backend.clock.advance(8 * DAY)
+    assert reminder_id not in {shown_id for shown_id, when in backend.shown}
@@ -0,0 +1,236 @@
+# test_recurrence.py
+# Copyright (C) 2023 Sasha Hale <dgsasha04@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of  MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Checks the closed form recurrences against the step by step implementation they replaced, on random rules'''
+
+import datetime
+import pytest
+
+pytest.importorskip('gi')
+
+from support import load_package
+load_package()
+
+from reminders import info
+from reminders.clock import VirtualClock
+from reminders.service.recurrence import next_occurrences, month_repeat, get_rule
+
+from calendar import monthrange
+from math import floor
+from random import Random
+
+NOW = 1700000000
+DAY = 24 * 60 * 60
+# how far back a rule can start, in occurrences, so the step by step version stays quick
+MAX_MISSED = 400
+WEEK_FLAGS = (
+    info.RepeatDays.MON,
+    info.RepeatDays.TUE,
+    info.RepeatDays.WED,
+    info.RepeatDays.THU,
+    info.RepeatDays.FRI,
+    info.RepeatDays.SAT,
+    info.RepeatDays.SUN
+)
+
+def step_month_repeat(reminder_datetime, frequency):
+    date = reminder_datetime.date()
+    months = date.month + frequency - 1
+    year = date.year + months // 12
+    month = months % 12 + 1
+    day = min(date.day, monthrange(year, month)[1])
+    return datetime.datetime.combine(datetime.date(year, month, day), reminder_datetime.time(), tzinfo=reminder_datetime.tzinfo)
+
+def step_year_repeat(reminder_datetime, frequency):
+    date = reminder_datetime.date()
+    year = date.year + frequency
+    day = min(date.day, monthrange(year, date.month)[1])
+    return datetime.datetime.combine(datetime.date(year, date.month, day), reminder_datetime.time(), tzinfo=reminder_datetime.tzinfo)
+
+def step_repeat(reminder, week_starts_sunday, now, today):
+    '''Reminders._repeat before it was replaced, one occurrence at a time until it isn't in the past'''
+    repeat_times = reminder['repeat-times']
+    if repeat_times != -1:
+        repeat_times -= 1
+    if repeat_times == 0:
+        return None
+
+    timestamp = reminder['timestamp']
+    repeat_until = reminder['repeat-until']
+    notify = timestamp != 0
+    if notify:
+        reminder_datetime = datetime.datetime.fromtimestamp(timestamp)
+    else:
+        reminder_datetime = datetime.datetime.fromtimestamp(reminder['due-date'], tz=datetime.timezone.utc)
+    repeat_until_date = datetime.datetime.fromtimestamp(repeat_until, tz=datetime.timezone.utc).date()
+    if repeat_until > 0 and reminder_datetime.date() > repeat_until_date:
+        return None
+
+    def is_past(value):
+        return value.timestamp() < now if notify else value.date() < today
+
+    repeat_type = reminder['repeat-type']
+    frequency = reminder['repeat-frequency']
+    repeat_days = reminder['repeat-days']
+
+    delta = None
+    if repeat_type == info.RepeatType.MINUTE:
+        delta = datetime.timedelta(minutes=frequency)
+    elif repeat_type == info.RepeatType.HOUR:
+        delta = datetime.timedelta(hours=frequency)
+    elif repeat_type == info.RepeatType.DAY:
+        delta = datetime.timedelta(days=frequency)
+
+    if delta is not None:
+        reminder_datetime += delta
+        while is_past(reminder_datetime):
+            if repeat_times != -1:
+                repeat_times -= 1
+            if repeat_times == 0:
+                break
+            reminder_datetime += delta
+    elif repeat_type == info.RepeatType.WEEK:
+        flags = WEEK_FLAGS if not week_starts_sunday else WEEK_FLAGS[6:] + WEEK_FLAGS[:6]
+
+        def weekday_of(value):
+            return value.date().weekday() if not week_starts_sunday else (value.date().weekday() + 1) % 7
+
+        weekday = weekday_of(reminder_datetime)
+        if repeat_days == 0:
+            repeat_days = weekday
+        days = [num for num, flag in enumerate(flags) if flag in info.RepeatDays(repeat_days)]
+        if len(days) == 0:
+            return None
+
+        index = 0
+        week_frequency = 0
+        for i, value in enumerate(days):
+            if value == weekday:
+                index = i + 1
+                if index > len(days) - 1:
+                    index = 0
+                    week_frequency = frequency - 1
+                break
+            if value > weekday:
+                index = i
+                break
+            if i == len(days) - 1:
+                index = 0
+                week_frequency = frequency - 1
+                break
+
+        reminder_datetime += datetime.timedelta(days=(((days[index] - weekday - 1) % 7 + 1) + 7 * week_frequency))
+        while is_past(reminder_datetime):
+            week_frequency = 0
+            if repeat_times != -1:
+                repeat_times -= 1
+            if repeat_times == 0:
+                break
+            weekday = weekday_of(reminder_datetime)
+            index += 1
+            if index > len(days) - 1:
+                index = 0
+                week_frequency = frequency - 1
+            reminder_datetime += datetime.timedelta(days=(((days[index] - weekday - 1) % 7 + 1) + 7 * week_frequency))
+    elif repeat_type in (info.RepeatType.MONTH, info.RepeatType.YEAR):
+        step = step_month_repeat if repeat_type == info.RepeatType.MONTH else step_year_repeat
+        reminder_datetime = step(reminder_datetime, frequency)
+        while is_past(reminder_datetime):
+            if repeat_times != -1:
+                repeat_times -= 1
+            if repeat_times == 0:
+                break
+            reminder_datetime = step(reminder_datetime, frequency)
+
+    if repeat_until > 0 and reminder_datetime.date() > repeat_until_date:
+        return None
+
+    timestamp = floor(reminder_datetime.timestamp()) if notify else 0
+    due_date = floor(reminder_datetime.timestamp()) if not notify else 0
+    return timestamp, due_date, repeat_times
+
+# seconds in an occurrence for the repeat types, roughly, only used to pick how far back a rule starts
+SPANS = {
+    info.RepeatType.MINUTE: 60,
+    info.RepeatType.HOUR: 60 * 60,
+    info.RepeatType.DAY: DAY,
+    info.RepeatType.WEEK: 7 * DAY,
+    info.RepeatType.MONTH: 31 * DAY,
+    info.RepeatType.YEAR: 366 * DAY
+}
+
+def random_reminder(random):
+    repeat_type = random.choice(list(SPANS.keys()))
+    frequency = random.choice((1, 1, 2, 3, 5, 7, 13))
+    span = SPANS[repeat_type] * frequency
+    # nothing starts more than 30 years back
+    start = NOW - random.randint(-3, min(MAX_MISSED, 30 * 366 * DAY // span)) * span + random.randint(0, DAY)
+    if repeat_type in (info.RepeatType.MONTH, info.RepeatType.YEAR) and random.random() < 0.5:
+        # the days that get clamped in shorter months
+        day = datetime.datetime.fromtimestamp(start, tz=datetime.timezone.utc)
+        last = monthrange(day.year, day.month)[1]
+        start += (min(random.choice((29, 30, 31)), last) - day.day) * DAY
+
+    notify = random.random() < 0.5
+    if not notify:
+        start -= start % DAY
+    repeat_until = 0
+    if random.random() < 0.2:
+        repeat_until = min(start + random.randint(0, 2 * MAX_MISSED) * span, NOW + 60 * 366 * DAY)
+        repeat_until -= repeat_until % DAY
+    return {
+        'timestamp': start if notify else 0,
+        'due-date': 0 if notify else start,
+        'repeat-type': repeat_type,
+        'repeat-frequency': frequency,
+        'repeat-days': random.randint(0, 127) if repeat_type == info.RepeatType.WEEK else 0,
+        'repeat-until': max(repeat_until, 0),
+        'repeat-times': random.choice((-1, -1, 1, 2, 5, random.randint(1, 2 * MAX_MISSED)))
+    }
+
+@pytest.mark.parametrize('week_starts_sunday', (False, True))
+@pytest.mark.parametrize('seed', range(4))
+def test_next_occurrences_match_stepping(seed, week_starts_sunday):
+    random = Random(seed)
+    clock = VirtualClock(NOW + random.randint(0, DAY))
+    reminders = [random_reminder(random) for i in range(500)]
+
+    results = next_occurrences([get_rule(reminder) for reminder in reminders], week_starts_sunday, clock)
+
+    now = floor(clock.time())
+    today = clock.today()
+    for reminder, result in zip(reminders, results):
+        assert result == step_repeat(reminder, week_starts_sunday, now, today), reminder
+
+def test_next_occurrences_batch_matches_single():
+    # the search starting points are worked out for the whole batch, they have to agree with doing them one at a time
+    random = Random(10)
+    clock = VirtualClock(NOW)
+    rules = [get_rule(random_reminder(random)) for i in range(300)]
+    assert next_occurrences(rules, False, clock) == [next_occurrences([rule], False, clock)[0] for rule in rules]
+
+@pytest.mark.parametrize('seed', range(4))
+def test_month_repeat_matches_stepping(seed):
+    random = Random(seed)
+    for i in range(300):
+        year = random.randint(1990, 2060)
+        month = random.randint(1, 12)
+        day = random.randint(max(1, monthrange(year, month)[1] - 5), monthrange(year, month)[1])
+        start = datetime.datetime(year, month, day, random.randint(0, 23), random.randint(0, 59), tzinfo=random.choice((None, datetime.timezone.utc)))
+        frequency = random.choice((1, 2, 3, 4, 5, 6, 7, 11, 12, 13, 24, 25))
+        stepped = start
+        for count in range(1, 60):
+            stepped = step_month_repeat(stepped, frequency)
+            assert month_repeat(start, frequency, count) == stepped, (start, frequency, count)